@@ -0,0 +1,191 @@
+"""
+In-process admission control for the gameplay endpoints.
+
+A token bucket per client address, kept in memory by each worker, caps
+how fast one client can call the endpoints (429). When workers fall
+behind, requests spend time queued before a thread picks them up; those
+that waited longer than ADMISSION_MAX_QUEUE_* are answered straight away
+with 503 rather than served late to a client that has likely given up.
+Both carry `Retry-After`.
+
+Players already in a story come first: new sessions are shed after a
+shorter wait (ADMISSION_MAX_QUEUE_NEW_SESSION) than choices
+(ADMISSION_MAX_QUEUE_IN_STORY), so under overload running games keep
+going while new ones are turned away.
+"""
+import functools
+import math
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.http import JsonResponse
+from .ratelimit import TokenBucket
+
+# Priorities for admission_control
+NEW_SESSION = 'new_session'
+IN_STORY = 'in_story'
+
+_controller = None
+_lock = threading.Lock()
+
+
+class ClientBuckets:
+    """
+    One token bucket per client, keeping only the `max_clients` most recent
+    """
+    def __init__(self, rate, burst, max_clients):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def bucket(self, client):
+        with self.lock:
+            bucket = self.buckets.get(client)
+            if bucket is None:
+                bucket = self.buckets[client] = TokenBucket(self.rate, self.burst)
+                if len(self.buckets) > self.max_clients:
+                    self.buckets.popitem(last=False)
+            else:
+                self.buckets.move_to_end(client)
+            return bucket
+
+    def try_acquire(self, client):
+        """Returns 0 if admitted, otherwise seconds until the client may retry"""
+        bucket = self.bucket(client)
+        if bucket.try_acquire():
+            return 0
+        return bucket.retry_after()
+
+
+class QueueTimeLimit:
+    """
+    Sheds requests that waited longer than their priority allows before a
+    worker thread picked them up
+    """
+    def __init__(self, limits):
+        self.limits = limits  # priority -> seconds, 0 for no limit
+
+    def exceeded(self, request, priority):
+        limit = self.limits.get(priority)
+        if not limit:
+            return False
+        waited = queue_time(request)
+        return waited is not None and waited > limit
+
+
+class AdmissionController:
+    """
+    Applies the per-client limit and the queue-time limit; either may be None
+    """
+    def __init__(self, clients=None, queue=None):
+        self.clients = clients
+        self.queue = queue
+
+    def admit(self, request, priority):
+        """Returns a rejection response, or None if the request may run"""
+        if self.queue is not None and self.queue.exceeded(request, priority):
+            return rejection("Server busy", 503, 1)
+        if self.clients is not None and not bypasses_rate_limit(request):
+            wait = self.clients.try_acquire(client_address(request))
+            if wait:
+                return rejection("Too many requests", 429, wait)
+        return None
+
+
+def queue_time(request):
+    """
+    Seconds between the request reaching us and a thread starting on it,
+    or None if unknown. `serve` records when it accepted the connection;
+    a proxy in front can send `X-Request-Start: t=<epoch seconds, ms or µs>`.
+    The larger of the two is used.
+    """
+    now = time.time()
+    waits = []
+    accepted_at = request.META.get('backend.accepted_at')
+    if accepted_at is not None:
+        waits.append(now - accepted_at)
+    header = request.META.get('HTTP_X_REQUEST_START')
+    if header:
+        try:
+            started = float(header.strip().removeprefix('t='))
+        except ValueError:
+            started = None
+        if started:
+            # Proxies differ in the unit they send
+            while started > 1e11:
+                started /= 1000
+            waits.append(now - started)
+    return max(waits) if waits else None
+
+
+def client_address(request):
+    """
+    Address to rate limit a request by. Behind ADMISSION_TRUSTED_PROXIES,
+    the nearest X-Forwarded-For entry the proxies did not add themselves.
+    """
+    address = request.META.get('REMOTE_ADDR', '')
+    trusted = settings.ADMISSION_TRUSTED_PROXIES
+    if address not in trusted:
+        return address
+    forwarded = request.META.get('HTTP_X_FORWARDED_FOR', '')
+    for hop in reversed([hop.strip() for hop in forwarded.split(',') if hop.strip()]):
+        if hop not in trusted:
+            return hop
+    return address
+
+
+def bypasses_rate_limit(request):
+    """Whether the request carries ADMISSION_BYPASS_TOKEN, as `loadtest` sends"""
+    token = settings.ADMISSION_BYPASS_TOKEN
+    sent = request.META.get('HTTP_X_ADMISSION_TOKEN')
+    return bool(token) and sent is not None and secrets.compare_digest(
+        sent.encode(), token.encode()
+    )
+
+
+def rejection(message, status, retry_after):
+    response = JsonResponse({"error": message}, status=status)
+    response['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def get_controller():
+    """Return this worker's admission controller, built from settings on first use"""
+    global _controller
+    if _controller is None:
+        with _lock:
+            if _controller is None:
+                clients = queue = None
+                if settings.ADMISSION_CLIENT_RATE > 0:
+                    clients = ClientBuckets(settings.ADMISSION_CLIENT_RATE,
+                                            settings.ADMISSION_CLIENT_BURST,
+                                            settings.ADMISSION_MAX_CLIENTS)
+                limits = {NEW_SESSION: settings.ADMISSION_MAX_QUEUE_NEW_SESSION,
+                          IN_STORY: settings.ADMISSION_MAX_QUEUE_IN_STORY}
+                if any(limits.values()):
+                    queue = QueueTimeLimit(limits)
+                _controller = AdmissionController(clients, queue)
+    return _controller
+
+
+def reset_admission():
+    """Forget all limiter state so the next request rebuilds it from settings"""
+    global _controller
+    _controller = None
+
+
+def admission_control(priority):
+    """Decorator that sheds a view's requests when the worker is over capacity"""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = get_controller().admit(request, priority)
+            if response is not None:
+                return response
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
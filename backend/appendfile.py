@@ -0,0 +1,26 @@
+"""
+Concurrent appends to shared files.
+
+Workers append whole records with a single O_APPEND write, which the
+kernel keeps from interleaving with other writers' records, so no lock
+is needed across processes.
+"""
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+def append_bytes(path, data):
+    """Append `data` to `path` in one write; failures are logged, never raised"""
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+    except OSError as exc:
+        logger.warning("Could not append to %s: %s", path, exc)
+        return False
+    return True
@@ -0,0 +1,44 @@
+"""
+Append-only archive of finished playthroughs for later analytics.
+
+Records are JSON lines in one gzip file per UTC day. Each record is
+written as its own gzip member with a single O_APPEND write, so workers
+can append concurrently and the file stays readable with gzip.open().
+"""
+import gzip
+import json
+import time
+from pathlib import Path
+from django.conf import settings
+from .appendfile import append_bytes
+
+
+def archive_path(timestamp):
+    day = time.strftime('%Y%m%d', time.gmtime(timestamp))
+    return Path(settings.PLAYTHROUGH_ARCHIVE_DIR) / f"playthroughs-{day}.jsonl.gz"
+
+
+def archive_playthrough(state, locale=None):
+    """Append a finished playthrough; failures are logged, never raised"""
+    finished_at = time.time()
+    record = {
+        "story_id": state.story_id,
+        "story_version": state.story_version,
+        "ending_scene_id": state.current_scene_id,
+        "final_variables": state.variables,
+        "path": state.visited_scenes,
+        "steps": state.step,
+        "locale": locale,
+        "finished_at": round(finished_at, 3),
+    }
+    line = json.dumps(record, separators=(',', ':')) + "\n"
+    member = gzip.compress(line.encode(), compresslevel=6, mtime=0)
+
+    return append_bytes(archive_path(finished_at), member)
+
+
+def read_archive(path):
+    """Yield the records of one archive file"""
+    with gzip.open(path, 'rt', encoding='utf-8') as fh:
+        for line in fh:
+            yield json.loads(line)
@@ -0,0 +1,175 @@
+"""
+Scene asset pipeline.
+
+`build_manifest` copies every background referenced by the stories to a
+content-hashed filename and records its URL, byte size and pixel
+dimensions in manifest.json. Hashed files never change, so they are
+served with long-lived immutable cache headers.
+"""
+import hashlib
+import json
+import shutil
+import struct
+import threading
+from pathlib import Path
+from django.conf import settings
+
+MANIFEST_NAME = 'manifest.json'
+
+_manifest = None
+_manifest_files = frozenset()
+_lock = threading.Lock()
+
+
+def get_manifest():
+    """Return the asset manifest, reading it on first use"""
+    global _manifest, _manifest_files
+    if _manifest is None:
+        with _lock:
+            if _manifest is None:
+                path = Path(settings.STORY_ASSET_ROOT) / MANIFEST_NAME
+                try:
+                    with open(path, encoding='utf-8') as fh:
+                        manifest = json.load(fh)
+                except (OSError, ValueError):
+                    manifest = {}
+                _manifest_files = frozenset(entry["file"] for entry in manifest.values())
+                _manifest = manifest
+    return _manifest
+
+
+def reset_manifest():
+    """Forget the cached manifest so the next access rereads it"""
+    global _manifest
+    _manifest = None
+
+
+def asset_path(filename):
+    """Filesystem path of a hashed asset, or None if it is not in the manifest"""
+    get_manifest()
+    if filename not in _manifest_files:
+        return None
+    return Path(settings.STORY_ASSET_ROOT) / filename
+
+
+def asset_url(path):
+    """Hashed URL for a background path, or the path itself if unknown"""
+    entry = get_manifest().get(path)
+    return entry["url"] if entry else path
+
+
+def asset_info(path):
+    """Size and dimensions recorded for a background path, if any"""
+    entry = get_manifest().get(path)
+    if not entry:
+        return None
+    return {"width": entry["width"], "height": entry["height"], "bytes": entry["bytes"]}
+
+
+def find_source(path):
+    """Locate the source file for a /static/... background path"""
+    relative = path
+    prefix = '/' + settings.STATIC_URL.strip('/') + '/'
+    if relative.startswith(prefix):
+        relative = relative[len(prefix):]
+    relative = relative.lstrip('/')
+    for directory in settings.STORY_ASSET_DIRS:
+        candidate = (Path(directory) / relative).resolve()
+        if candidate.is_file() and candidate.is_relative_to(Path(directory).resolve()):
+            return candidate
+    return None
+
+
+def build_manifest(stories):
+    """
+    Hash and copy every background used by `stories` into STORY_ASSET_ROOT.
+
+    Returns (manifest, missing) where missing lists backgrounds whose
+    source file could not be found.
+    """
+    output_dir = Path(settings.STORY_ASSET_ROOT)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    backgrounds = sorted({
+        scene.background
+        for story in stories
+        for scene in story["scenes"].values()
+        if scene.background
+    })
+
+    manifest, missing = {}, []
+    for background in backgrounds:
+        source = find_source(background)
+        if source is None:
+            missing.append(background)
+            continue
+
+        data = source.read_bytes()
+        digest = hashlib.sha256(data).hexdigest()
+        filename = f"{source.stem}.{digest[:12]}{source.suffix}"
+        target = output_dir / filename
+        if not target.exists():
+            shutil.copyfile(source, target)
+
+        width, height = image_dimensions(data)
+        manifest[background] = {
+            "url": settings.STORY_ASSET_URL + filename,
+            "file": filename,
+            "sha256": digest,
+            "bytes": len(data),
+            "width": width,
+            "height": height,
+        }
+
+    tmp_path = output_dir / (MANIFEST_NAME + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as fh:
+        json.dump(manifest, fh, indent=2, sort_keys=True)
+    tmp_path.replace(output_dir / MANIFEST_NAME)
+    reset_manifest()
+    return manifest, missing
+
+
+def image_dimensions(data):
+    """(width, height) of a PNG, GIF, JPEG or WebP image, else (None, None)"""
+    if data[:8] == b'\x89PNG\r\n\x1a\n' and len(data) >= 24:
+        return struct.unpack('>II', data[16:24])
+
+    if data[:6] in (b'GIF87a', b'GIF89a') and len(data) >= 10:
+        return struct.unpack('<HH', data[6:10])
+
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP' and len(data) >= 30:
+        chunk = data[12:16]
+        if chunk == b'VP8 ':
+            width, height = struct.unpack('<HH', data[26:30])
+            return width & 0x3FFF, height & 0x3FFF
+        if chunk == b'VP8L':
+            bits = int.from_bytes(data[21:25], 'little')
+            return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        if chunk == b'VP8X':
+            return (int.from_bytes(data[24:27], 'little') + 1,
+                    int.from_bytes(data[27:30], 'little') + 1)
+
+    if data[:2] == b'\xff\xd8':
+        return jpeg_dimensions(data)
+
+    return None, None
+
+
+def jpeg_dimensions(data):
+    """Walk JPEG segments to the first start-of-frame marker"""
+    offset = 2
+    while offset + 9 < len(data):
+        if data[offset] != 0xFF:
+            offset += 1
+            continue
+        marker = data[offset + 1]
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7 or marker == 0xFF:
+            offset += 1 if marker == 0xFF else 2
+            continue
+        length = struct.unpack('>H', data[offset + 2:offset + 4])[0]
+        # SOF0-SOF15, except DHT (C4), JPG (C8) and DAC (CC)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack('>HH', data[offset + 5:offset + 9])
+            return width, height
+        offset += 2 + length
+    return None, None
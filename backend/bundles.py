@@ -0,0 +1,116 @@
+"""
+Prefetchable story bundles for client-side play.
+
+A bundle holds every scene a player can reach within a few choices of a
+scene: backgrounds, choice texts, conditions and effects. With it the
+client can run check_conditions and apply effects locally, then have the
+server verify the whole path in one call (see views.verify_path).
+
+Choices with weighted branches are sent without a target. The server
+picks the branch, so the client has to submit its path when it takes one.
+
+Bundles depend only on the story version, scene, hop count and locale.
+They are built once, gzip-compressed and kept in a small LRU cache.
+"""
+import gzip
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from django.conf import settings
+from .assets import asset_url
+from .stories import has_conditional_flow, scenes_within
+
+_bundles = OrderedDict()  # (story_id, version, scene_id, hops, locale) -> Bundle, LRU order
+_lock = threading.Lock()
+
+
+class Bundle:
+    """A compressed bundle body and its ETag"""
+    __slots__ = ('compressed', 'etag')
+
+    def __init__(self, compressed, etag):
+        self.compressed = compressed
+        self.etag = etag
+
+    def body(self):
+        return gzip.decompress(self.compressed)
+
+
+def bundle_choice(choice, text):
+    data = {
+        "id": choice.id,
+        "text": text.choice_text(choice),
+        "target_scene_id": None if choice.branches else choice.target_scene_id,
+    }
+    # Left out when empty, which is most choices
+    if choice.conditions:
+        data["conditions"] = choice.conditions
+    if choice.effects:
+        data["effects"] = choice.effects
+    return data
+
+
+def bundle_scene(scene, text):
+    data = {
+        "id": scene.id,
+        "background": asset_url(scene.background),
+        "choices": [bundle_choice(choice, text) for choice in scene.choices],
+    }
+    if has_conditional_flow(scene.choices):
+        # Only the first available choice is offered (see get_available_choices)
+        data["conditional_flow"] = True
+    return data
+
+
+def build_bundle(story_id, story, scene_id, hops, text):
+    """The bundle body as a dict"""
+    adjacency = story["adjacency"]
+    # Only forward: the player can't go back to scenes behind them
+    distances = scenes_within(story, scene_id, hops, settings.STORY_BUNDLE_MAX_SCENES,
+                              neighbours=lambda current: adjacency.get(current, ()))
+    scenes = story["scenes"]
+    included = [found_id for found_id in distances if found_id in scenes]
+    # Scenes whose choices lead out of the bundle; the client must fetch
+    # a new bundle (or verify its path) before going past them
+    frontier = [
+        found_id for found_id in included
+        if any(target not in distances for target in adjacency.get(found_id, ()))
+    ]
+    return {
+        "story_id": story_id,
+        "version": story["version"],
+        "locale": text.locale,
+        "root": scene_id,
+        "hops": hops,
+        "scenes": [bundle_scene(scenes[found_id], text) for found_id in included],
+        "frontier": frontier,
+    }
+
+
+def get_bundle(story_id, story, scene_id, hops, text):
+    """Return the compressed bundle, building it on first request"""
+    key = (story_id, story["version"], scene_id, hops, text.locale)
+    with _lock:
+        bundle = _bundles.get(key)
+        if bundle is not None:
+            _bundles.move_to_end(key)
+            return bundle
+
+    body = json.dumps(build_bundle(story_id, story, scene_id, hops, text),
+                      separators=(',', ':'), ensure_ascii=False).encode()
+    bundle = Bundle(gzip.compress(body, compresslevel=9, mtime=0),
+                    '"%s"' % hashlib.blake2b(body, digest_size=12).hexdigest())
+
+    with _lock:
+        _bundles[key] = bundle
+        _bundles.move_to_end(key)
+        while len(_bundles) > settings.STORY_BUNDLE_CACHE_SIZE:
+            _bundles.popitem(last=False)
+    return bundle
+
+
+def reset_bundles():
+    """Drop every cached bundle"""
+    with _lock:
+        _bundles.clear()
@@ -0,0 +1,156 @@
+"""
+Locale-aware story text.
+
+Choice texts in the story graph are the default-locale strings. Other
+locales live in backend/story_text/<story_id>/<locale>.json, outside the
+graph, and are loaded the first time a (story, version, locale) is served.
+Loaded strings are interned so repeated texts share one object.
+
+Tables are keyed by choice id, so a story-wide table must stay valid for
+every version of the story. A version that renumbers or rewords choices
+gets its own tables in backend/story_text/<story_id>/<version>/, which
+take precedence for that version.
+"""
+import json
+import sys
+import threading
+from django.conf import settings
+
+DEFAULT_MESSAGES = {
+    "ending": "The story concludes here.",
+}
+
+
+class StoryText:
+    """Text table for one story in one locale"""
+    def __init__(self, locale, choices=None, messages=None):
+        self.locale = locale
+        self.choices = choices or {}
+        self.messages = messages or {}
+
+    def choice_text(self, choice):
+        return self.choices.get(choice.id, choice.text)
+
+    def message(self, key):
+        return self.messages.get(key, DEFAULT_MESSAGES[key])
+
+
+_loaded_text = {}
+_locale_files = {}
+_lock = threading.Lock()
+
+
+def locale_files(story_id, version=None):
+    """
+    (files, locales) for a story version: the text table path of each
+    translated locale (lowercased), and every locale it can be served in
+    """
+    key = (story_id, version)
+    found = _locale_files.get(key)
+    if found is None:
+        story_dir = settings.STORY_TEXT_DIR / str(story_id)
+        directories = [story_dir]
+        if version is not None:
+            directories.append(story_dir / str(version))
+        files = {}
+        for directory in directories:
+            if directory.is_dir():
+                # File names keep their case (pt-BR.json); tags are matched lowercased
+                files.update((path.stem.lower(), path) for path in directory.glob('*.json'))
+        locales = frozenset(files) | {settings.STORY_DEFAULT_LOCALE}
+        _locale_files[key] = found = (files, locales)
+    return found
+
+
+def available_locales(story_id, version=None):
+    """Locales with a text table for the story version, plus the default locale"""
+    return locale_files(story_id, version)[1]
+
+
+def get_story_text(story_id, locale, version=None):
+    """Return the text table for a story version and locale, loading it on first use"""
+    key = (story_id, version, locale)
+    text = _loaded_text.get(key)
+    if text is None:
+        with _lock:
+            text = _loaded_text.get(key)
+            if text is None:
+                text = _loaded_text[key] = load_story_text(story_id, locale, version)
+    return text
+
+
+def load_story_text(story_id, locale, version=None):
+    if locale == settings.STORY_DEFAULT_LOCALE:
+        return StoryText(locale)
+
+    path = locale_files(story_id, version)[0][locale]
+
+    with open(path, encoding='utf-8') as fh:
+        data = json.load(fh)
+
+    choices = {
+        int(choice_id): sys.intern(text)
+        for choice_id, text in data.get("choices", {}).items()
+    }
+    messages = {
+        sys.intern(key): sys.intern(text)
+        for key, text in data.get("messages", {}).items()
+    }
+    return StoryText(locale, choices, messages)
+
+
+def negotiate_locale(request, story_id, data=None, version=None):
+    """
+    Pick the response locale from an explicit `lang` parameter (JSON body
+    or query string), then Accept-Language, then the default locale.
+    """
+    supported = available_locales(story_id, version)
+
+    requested = data.get('lang') if isinstance(data, dict) else None
+    requested = requested or request.GET.get('lang')
+    if isinstance(requested, str):
+        match = match_locale(requested, supported)
+        if match:
+            return match
+
+    for tag in parse_accept_language(request.headers.get('Accept-Language', '')):
+        match = match_locale(tag, supported)
+        if match:
+            return match
+
+    return settings.STORY_DEFAULT_LOCALE
+
+
+def match_locale(tag, supported):
+    """Match a language tag exactly, then by its primary subtag"""
+    tag = tag.strip().lower().replace('_', '-')
+    if tag in supported:
+        return tag
+    primary = tag.split('-', 1)[0]
+    if primary in supported:
+        return primary
+    return None
+
+
+def parse_accept_language(header):
+    """Language tags from an Accept-Language header, most preferred first"""
+    weighted = []
+    for position, part in enumerate(header.split(',')):
+        tag, _, params = part.strip().partition(';')
+        if not tag or tag == '*':
+            continue
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                continue
+        if quality > 0:
+            weighted.append((-quality, position, tag))
+    return [tag for _, _, tag in sorted(weighted)]
+
+
+def reset_story_text():
+    """Drop every loaded text table"""
+    _loaded_text.clear()
+    _locale_files.clear()
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from backend.stories import archive_story_versions
+
+
+class Command(BaseCommand):
+    help = "Archive the current version of every registered story in STORY_VERSION_DIR"
+
+    def handle(self, *args, **options):
+        try:
+            stories = archive_story_versions()
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        versions = ", ".join(f"{story_id} v{story['version']}" for story_id, story in stories.items())
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {versions} in {settings.STORY_VERSION_DIR}"
+        ))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from backend.assets import build_manifest
+from backend.stories import load_stories
+
+
+class Command(BaseCommand):
+    help = "Copy story backgrounds to content-hashed files and write the asset manifest"
+
+    def handle(self, *args, **options):
+        manifest, missing = build_manifest(load_stories().values())
+
+        for background in missing:
+            self.stderr.write(self.style.WARNING(f"Missing source file for {background}"))
+        total = sum(entry["bytes"] for entry in manifest.values())
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote manifest with {len(manifest)} assets ({total} bytes)"
+        ))
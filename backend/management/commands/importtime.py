@@ -0,0 +1,64 @@
+import os
+import subprocess
+import sys
+from django.core.management.base import BaseCommand, CommandError
+
+# Runs in a fresh interpreter so nothing is already imported
+PROBE = """
+import time
+start = time.perf_counter()
+import django
+django.setup()
+from django.urls import get_resolver
+get_resolver().url_patterns
+from backend.stories import get_story
+get_story(0)
+print(round((time.perf_counter() - start) * 1000, 2))
+"""
+
+
+class Command(BaseCommand):
+    help = "Report cold-start import time for one or more settings profiles"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'profiles', nargs='*',
+            default=['backend.settings', 'backend.settings_gameplay'],
+            help="Settings modules to measure",
+        )
+        parser.add_argument(
+            '--top', type=int, default=10,
+            help="Number of slowest top-level imports to list per profile",
+        )
+
+    def handle(self, *args, **options):
+        for profile in options['profiles']:
+            wall_ms, modules = self.measure(profile)
+            self_us = sum(entry[0] for entry in modules)
+            top_level = [entry for entry in modules if not entry[2].startswith(' ')]
+            top_level.sort(key=lambda entry: entry[1], reverse=True)
+
+            self.stdout.write(self.style.MIGRATE_HEADING(profile))
+            self.stdout.write(f"  ready in:      {wall_ms:.2f} ms")
+            self.stdout.write(f"  modules:       {len(modules)}")
+            self.stdout.write(f"  import time:   {self_us / 1000:.2f} ms")
+            for self_time, cumulative, name in top_level[:options['top']]:
+                self.stdout.write(f"  {cumulative / 1000:10.2f} ms  {name.strip()}")
+
+    def measure(self, profile):
+        """Run the startup probe under -X importtime and parse its report"""
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=profile)
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', PROBE],
+            capture_output=True, text=True, env=env,
+        )
+        if result.returncode != 0:
+            raise CommandError(f"{profile} failed to start:\n{result.stderr[-2000:]}")
+
+        modules = []
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:') or 'self [us]' in line:
+                continue
+            self_time, cumulative, name = line[len('import time:'):].split('|', 2)
+            modules.append((int(self_time), int(cumulative), name[1:]))
+        return float(result.stdout.strip().splitlines()[-1]), modules
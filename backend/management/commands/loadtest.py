@@ -0,0 +1,232 @@
+import http.cookiejar
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.urls import reverse
+from backend.regression import load_scripts
+
+
+class InProcessTransport:
+    """Drives the views through Django's test client, with CSRF enforced"""
+
+    def __init__(self, playthrough=0):
+        host = next((h for h in settings.ALLOWED_HOSTS if '*' not in h), 'localhost')
+        # Each playthrough comes from its own address, like a real player
+        # would, so per-client rate limits do not throttle the whole test
+        address = f"10.{playthrough >> 16 & 255}.{playthrough >> 8 & 255}.{playthrough & 255}"
+        self.client = Client(enforce_csrf_checks=True, SERVER_NAME=host.lstrip('.'),
+                             REMOTE_ADDR=address)
+
+    def get(self, path):
+        return self.parse(self.client.get(path))
+
+    def post(self, path, payload, csrf_token):
+        return self.parse(self.client.post(
+            path, data=json.dumps(payload), content_type='application/json',
+            HTTP_X_CSRFTOKEN=csrf_token,
+        ))
+
+    def parse(self, response):
+        try:
+            return response.status_code, json.loads(response.content)
+        except ValueError:
+            return response.status_code, {}
+
+
+class LiveTransport:
+    """Drives a running server over HTTP, keeping cookies per player"""
+
+    def __init__(self, base_url, admission_token=''):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar())
+        )
+        # Every virtual player comes from this one address, so skip the
+        # server's per-client rate limit when it shares the token
+        if admission_token:
+            self.opener.addheaders.append(('X-Admission-Token', admission_token))
+
+    def get(self, path):
+        return self.send(urllib.request.Request(self.base_url + path))
+
+    def post(self, path, payload, csrf_token):
+        request = urllib.request.Request(
+            self.base_url + path, data=json.dumps(payload).encode(), method='POST',
+            headers={
+                'Content-Type': 'application/json',
+                'X-CSRFToken': csrf_token,
+                'Referer': self.base_url + '/',
+            },
+        )
+        return self.send(request)
+
+    def send(self, request):
+        try:
+            with self.opener.open(request, timeout=30) as response:
+                return response.status, json.loads(response.read())
+        except urllib.error.HTTPError as exc:
+            try:
+                body = json.loads(exc.read())
+            except ValueError:
+                body = {}
+            return exc.code, body
+
+
+class Command(BaseCommand):
+    help = "Simulate concurrent players and report throughput and latency percentiles"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url', default=None,
+            help="Base URL of a live server (default: in-process test client)",
+        )
+        parser.add_argument(
+            '--players', type=int, default=10,
+            help="Concurrent virtual players (default: 10)",
+        )
+        parser.add_argument(
+            '--playthroughs', type=int, default=100,
+            help="Total playthroughs to run across all players (default: 100)",
+        )
+        parser.add_argument(
+            '--script', default=None,
+            help="Choice scripts to replay, in playthrough_regression's format "
+                 "(a JSON array, or JSON lines of {\"name\", \"choices\"})",
+        )
+        parser.add_argument(
+            '--admission-token', default=None,
+            help="Token that lets live players past the per-client rate limit "
+                 "(default: ADMISSION_BYPASS_TOKEN)",
+        )
+        parser.add_argument(
+            '--max-steps', type=int, default=50,
+            help="Abandon a playthrough after this many choices (default: 50)",
+        )
+        parser.add_argument(
+            '--seed', type=int, default=None,
+            help="Seed for random choice selection, for reproducible runs",
+        )
+
+    def handle(self, *args, **options):
+        if options['players'] < 1 or options['playthroughs'] < 1:
+            raise CommandError("--players and --playthroughs must be positive")
+
+        self.scripts = None
+        if options['script']:
+            try:
+                self.scripts = [choices for _, choices in load_scripts(options['script'])]
+            except (OSError, ValueError, KeyError, TypeError) as exc:
+                raise CommandError(f"Could not read script file: {exc}")
+            if not self.scripts:
+                raise CommandError("Script file contains no choice sequences")
+
+        self.options = options
+        self.admission_token = options['admission_token']
+        if self.admission_token is None:
+            self.admission_token = settings.ADMISSION_BYPASS_TOKEN
+        self.start_path = reverse('start_story')
+        self.choice_path = reverse('process_choice')
+        self.samples = {self.start_path: [], self.choice_path: []}
+        self.errors = {self.start_path: 0, self.choice_path: 0}
+        self.lock = threading.Lock()
+        self.remaining = options['playthroughs']
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['players']) as pool:
+            for future in [pool.submit(self.run_player, n) for n in range(options['players'])]:
+                future.result()
+        elapsed = time.perf_counter() - started
+
+        self.report(elapsed)
+
+    def run_player(self, player_number):
+        seed = self.options['seed']
+        rng = random.Random(None if seed is None else seed + player_number)
+        while True:
+            with self.lock:
+                if self.remaining == 0:
+                    return
+                self.remaining -= 1
+                playthrough = self.options['playthroughs'] - self.remaining - 1
+            if self.options['url']:
+                transport = LiveTransport(self.options['url'], self.admission_token)
+            else:
+                transport = InProcessTransport(playthrough)
+            script = None
+            if self.scripts:
+                script = list(self.scripts[playthrough % len(self.scripts)])
+            self.play(transport, rng, script)
+
+    def play(self, transport, rng, script):
+        status, data = self.timed(self.start_path, transport.get, self.start_path)
+        if status != 200:
+            return
+
+        csrf_token = data['csrf_token']
+        for _ in range(self.options['max_steps']):
+            scene = data['scene']
+            choices = [c['id'] for c in scene['choices'] if c['available']]
+            if script is not None:
+                if not script:
+                    return
+                choice_id = script.pop(0)
+            elif choices:
+                choice_id = rng.choice(choices)
+            else:
+                return
+
+            payload = {'choice_id': choice_id, 'current_scene_id': scene['id'],
+                       'step': data['step']}
+            status, data = self.timed(self.choice_path, transport.post,
+                                      self.choice_path, payload, csrf_token)
+            if status != 200 or data.get('ending'):
+                return
+            csrf_token = data.get('csrf_token', csrf_token)
+
+    def timed(self, endpoint, send, *args):
+        started = time.perf_counter()
+        status, data = send(*args)
+        latency = time.perf_counter() - started
+        with self.lock:
+            self.samples[endpoint].append(latency)
+            if status != 200:
+                self.errors[endpoint] += 1
+        return status, data
+
+    def report(self, elapsed):
+        total = sum(len(samples) for samples in self.samples.values())
+        target = self.options['url'] or 'in-process client'
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"{self.options['playthroughs']} playthroughs, "
+            f"{self.options['players']} players against {target}"
+        ))
+        self.stdout.write(f"  requests:    {total}")
+        self.stdout.write(f"  elapsed:     {elapsed:.2f} s")
+        self.stdout.write(f"  throughput:  {total / elapsed:.1f} req/s")
+        self.stdout.write("")
+        self.stdout.write(
+            f"  {'endpoint':<16}{'count':>8}{'errors':>8}"
+            f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+        )
+        for endpoint, samples in self.samples.items():
+            if not samples:
+                continue
+            samples.sort()
+            self.stdout.write(
+                f"  {endpoint:<16}{len(samples):>8}{self.errors[endpoint]:>8}"
+                f"{percentile(samples, 50):>10.2f}{percentile(samples, 95):>10.2f}"
+                f"{percentile(samples, 99):>10.2f}{samples[-1] * 1000:>10.2f}"
+            )
+
+
+def percentile(sorted_samples, pct):
+    """Nearest-rank percentile of sorted latencies, in milliseconds"""
+    rank = max(1, -(-len(sorted_samples) * pct // 100))
+    return sorted_samples[int(rank) - 1] * 1000
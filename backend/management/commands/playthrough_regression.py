@@ -0,0 +1,66 @@
+import json
+import time
+from django.core.management.base import BaseCommand, CommandError
+from backend.regression import load_scripts, random_scripts, run_regression
+from backend.stories import get_story
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay recorded choice scripts against two story versions and "
+        "report playthroughs whose ending, variables or path changed"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('scripts', help="JSON or JSON-lines file of choice scripts")
+        parser.add_argument('--story', type=int, default=0, help="Story id (default: 0)")
+        parser.add_argument('--old', type=int, required=True, help="Baseline story version")
+        parser.add_argument('--new', type=int, default=None,
+                            help="Version to check (default: the current version)")
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Worker processes (default: CPU count)")
+        parser.add_argument('--record', type=int, default=0, metavar='COUNT',
+                            help="First record COUNT random playthroughs of --old into the file")
+        parser.add_argument('--show', type=int, default=20,
+                            help="Number of differing scripts to print (default: 20)")
+
+    def handle(self, *args, **options):
+        story_id = options['story']
+        if options['record']:
+            baseline = get_story(story_id, options['old'])
+            if baseline is None:
+                raise CommandError(f"Story {story_id} version {options['old']} is not available")
+            with open(options['scripts'], 'w', encoding='utf-8') as fh:
+                for name, choices in random_scripts(baseline, options['record']):
+                    fh.write(json.dumps({"name": name, "choices": choices}) + "\n")
+
+        try:
+            scripts = load_scripts(options['scripts'])
+        except (OSError, ValueError, KeyError, TypeError) as exc:
+            raise CommandError(f"Could not read scripts: {exc}")
+
+        current = get_story(story_id)
+        if current is None:
+            raise CommandError(f"Unknown story {story_id}")
+        new_version = options['new'] or current["version"]
+
+        started = time.perf_counter()
+        try:
+            diffs = run_regression(story_id, options['old'], new_version, scripts,
+                                   workers=options['workers'])
+        except LookupError as exc:
+            raise CommandError(str(exc))
+        elapsed = time.perf_counter() - started
+
+        for name, differences in diffs[:options['show']]:
+            self.stdout.write(self.style.WARNING(name))
+            for field, change in differences.items():
+                self.stdout.write(f"  {field}: {change['old']!r} -> {change['new']!r}")
+
+        summary = (
+            f"{len(scripts)} scripts, version {options['old']} vs {new_version}: "
+            f"{len(diffs)} changed ({elapsed:.2f} s)"
+        )
+        if diffs:
+            raise CommandError(summary)
+        self.stdout.write(self.style.SUCCESS(summary))
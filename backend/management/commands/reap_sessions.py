@@ -0,0 +1,37 @@
+import signal
+from django.core.management.base import BaseCommand
+from backend.reaper import Reaper
+
+
+class Command(BaseCommand):
+    help = "Delete expired sessions in small, time-bounded batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help="Run a single sweep and exit")
+        parser.add_argument('--interval', type=float, default=60.0,
+                            help="Seconds between sweeps (default: 60)")
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help="Initial sessions per delete (default: 500)")
+        parser.add_argument('--budget-ms', type=float, default=50.0,
+                            help="Target duration of one delete (default: 50 ms)")
+        parser.add_argument('--pause-ms', type=float, default=100.0,
+                            help="Pause between deletes (default: 100 ms)")
+
+    def handle(self, *args, **options):
+        reaper = Reaper(batch_size=options['batch_size'],
+                        budget=options['budget_ms'] / 1000,
+                        pause=options['pause_ms'] / 1000)
+
+        if options['once']:
+            deleted = reaper.sweep()
+            self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} expired sessions"))
+            return
+
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.on_stop)
+        signal.signal(signal.SIGINT, self.on_stop)
+        reaper.run(options['interval'], lambda: self.stopping)
+
+    def on_stop(self, signum, frame):
+        self.stopping = True
@@ -0,0 +1,79 @@
+import time
+from pathlib import Path
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from backend.sharded_sessions import connect, shard_index, shard_path
+
+BATCH_SIZE = 5000
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy sharded sessions into a layout with a different shard count. "
+        "Run with the servers stopped, then update SESSION_SHARD_COUNT."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--to', type=int, required=True, dest='to_count',
+                            help="Shard count of the new layout")
+        parser.add_argument('--from', type=int, default=None, dest='from_count',
+                            help="Shard count of the current layout (default: SESSION_SHARD_COUNT)")
+        parser.add_argument('--dir', default=None,
+                            help="Shard directory (default: SESSION_SHARD_DIR)")
+        parser.add_argument('--delete-old', action='store_true',
+                            help="Remove the old shard files after copying")
+
+    def handle(self, *args, **options):
+        directory = Path(options['dir'] or settings.SESSION_SHARD_DIR)
+        from_count = options['from_count'] or settings.SESSION_SHARD_COUNT
+        to_count = options['to_count']
+        if to_count < 1 or from_count < 1:
+            raise CommandError("Shard counts must be positive")
+        if to_count == from_count:
+            raise CommandError("--to must differ from the current shard count")
+
+        targets = [shard_path(directory, index, to_count) for index in range(to_count)]
+        existing = [path for path in targets if path.exists()]
+        if existing:
+            raise CommandError(f"Target shard already exists: {existing[0]}")
+
+        target_conns = [connect(path) for path in targets]
+        now = time.time()
+        copied = 0
+        sources = [shard_path(directory, index, from_count) for index in range(from_count)]
+        for source in sources:
+            if not source.exists():
+                continue
+            source_conn = connect(source)
+            rows = source_conn.execute(
+                "SELECT session_key, session_data, expire_date FROM django_session"
+                " WHERE expire_date > ?", (now,)
+            )
+            while True:
+                chunk = rows.fetchmany(BATCH_SIZE)
+                if not chunk:
+                    break
+                grouped = {}
+                for row in chunk:
+                    grouped.setdefault(shard_index(row[0], to_count), []).append(row)
+                for index, shard_rows in grouped.items():
+                    conn = target_conns[index]
+                    conn.execute("BEGIN")
+                    conn.executemany("INSERT INTO django_session VALUES (?, ?, ?)", shard_rows)
+                    conn.execute("COMMIT")
+                copied += len(chunk)
+            source_conn.close()
+
+        for conn in target_conns:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            conn.close()
+
+        if options['delete_old']:
+            for source in sources:
+                for suffix in ('', '-wal', '-shm'):
+                    Path(str(source) + suffix).unlink(missing_ok=True)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Copied {copied} sessions from {from_count} to {to_count} shards in {directory}. "
+            f"Set SESSION_SHARD_COUNT={to_count} before starting the servers."
+        ))
@@ -0,0 +1,304 @@
+import gc
+import os
+import random
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import WSGIRequestHandler, WSGIServer
+from django.core.wsgi import get_wsgi_application
+from django.db import connections
+from django.urls import get_resolver
+from backend import stories
+from backend.reaper import Reaper
+
+
+class PreforkRequestHandler(WSGIRequestHandler):
+    """
+    Drops connections that send nothing for the server's request_timeout,
+    and tells the application when the connection was accepted
+    """
+
+    def setup(self):
+        self.timeout = self.server.request_timeout
+        super().setup()
+
+    def get_environ(self):
+        environ = super().get_environ()
+        # Lets admission control shed requests that queued too long
+        environ['backend.accepted_at'] = self.server.local.accepted_at
+        return environ
+
+
+class PreforkWSGIServer(WSGIServer):
+    """
+    WSGIServer for one worker process. Accepted connections are handled by
+    a pool of threads, so a slow or idle client holds one thread rather
+    than the whole worker. Up to `queue` more connections wait for a free
+    thread in the process, where their queueing time can be measured,
+    instead of in the kernel's accept backlog. Counts the requests this
+    process has handled.
+    """
+    requests_handled = 0
+    request_timeout = None
+    pool = None
+    slots = None
+    dispatched = False
+
+    def start_pool(self, threads, queue):
+        self.pool = ThreadPoolExecutor(max_workers=threads)
+        self.slots = threading.BoundedSemaphore(threads + queue)
+        self.local = threading.local()
+
+    def process_request(self, request, client_address):
+        self.requests_handled += 1
+        self.dispatched = True
+        self.pool.submit(self.process_request_thread, request, client_address, time.time())
+
+    def process_request_thread(self, request, client_address, accepted_at):
+        self.local.accepted_at = accepted_at
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.slots.release()
+
+    def handle_error(self, request, client_address):
+        # Idle connections timing out are routine, not errors
+        if isinstance(sys.exc_info()[1], TimeoutError):
+            return
+        super().handle_error(request, client_address)
+
+
+class Command(BaseCommand):
+    help = (
+        "Production server: compile stories once in a master process, then "
+        "fork workers that share them copy-on-write"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--bind', default='0.0.0.0:8000',
+            help="Address to listen on, as host:port (default: 0.0.0.0:8000)",
+        )
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help="Number of worker processes (default: CPU count)",
+        )
+        parser.add_argument(
+            '--threads', type=int, default=4,
+            help="Connections each worker handles at once (default: 4)",
+        )
+        parser.add_argument(
+            '--queue', type=int, default=16,
+            help="Connections each worker accepts beyond --threads to wait for a thread (default: 16)",
+        )
+        parser.add_argument(
+            '--timeout', type=float, default=10.0,
+            help="Seconds a connection may stay idle before it is dropped (default: 10)",
+        )
+        parser.add_argument(
+            '--max-requests', type=int, default=0,
+            help="Recycle a worker after this many requests (0 disables)",
+        )
+        parser.add_argument(
+            '--max-requests-jitter', type=int, default=0,
+            help="Random extra requests per worker so recycling is staggered",
+        )
+        parser.add_argument(
+            '--reap-interval', type=float, default=0,
+            help="Run an expired-session reaper process every N seconds (0 disables)",
+        )
+        parser.add_argument(
+            '--graceful-timeout', type=float, default=30.0,
+            help="Seconds to wait for workers to finish before killing them",
+        )
+
+    def handle(self, *args, **options):
+        if not hasattr(os, 'fork'):
+            raise CommandError("serve needs os.fork(); use runserver on this platform")
+        if options['workers'] < 1:
+            raise CommandError("--workers must be at least 1")
+        if options['threads'] < 1:
+            raise CommandError("--threads must be at least 1")
+        if options['queue'] < 0:
+            raise CommandError("--queue cannot be negative")
+
+        host, _, port = options['bind'].rpartition(':')
+        try:
+            address = (host.strip('[]') or '0.0.0.0', int(port))
+        except ValueError:
+            raise CommandError(f"Invalid --bind address: {options['bind']}")
+
+        self.options = options
+        self.workers = {}  # pid -> generation
+        self.reaper_pid = None
+        self.generation = 0
+        self.stopping = False
+        self.reloading = False
+
+        self.application = get_wsgi_application()
+        self.server = PreforkWSGIServer(address, PreforkRequestHandler,
+                                        ipv6=':' in address[0])
+        self.server.set_app(self.application)
+        self.server.request_timeout = options['timeout']
+        # Non-blocking accept so idle workers racing for a connection don't hang
+        self.server.socket.setblocking(False)
+        self.preload()
+
+        signal.signal(signal.SIGTERM, self.on_stop)
+        signal.signal(signal.SIGINT, self.on_stop)
+        signal.signal(signal.SIGHUP, self.on_reload)
+
+        self.stdout.write(
+            f"Serving on http://{address[0]}:{address[1]}/ with "
+            f"{options['workers']} workers (master pid {os.getpid()})"
+        )
+        try:
+            self.run_master()
+        finally:
+            self.server.server_close()
+
+    def preload(self):
+        """Load everything workers share, then freeze it out of the GC's reach"""
+        stories.reset_stories()
+        stories.load_stories()
+        get_resolver().url_patterns
+        connections.close_all()
+        # Keep the collector from touching (and so copying) pre-fork objects
+        gc.collect()
+        gc.freeze()
+
+    def run_master(self):
+        while True:
+            self.reap_workers()
+            if self.stopping:
+                break
+            if self.reloading:
+                self.reload()
+            self.spawn_workers()
+            self.spawn_reaper()
+            time.sleep(0.5)
+        self.stop_workers(list(self.workers))
+
+    def spawn_workers(self):
+        current = [pid for pid, gen in self.workers.items() if gen == self.generation]
+        for _ in range(self.options['workers'] - len(current)):
+            pid = os.fork()
+            if pid == 0:
+                status = 1
+                try:
+                    self.run_worker()
+                    status = 0
+                finally:
+                    os._exit(status)
+            self.workers[pid] = self.generation
+
+    def spawn_reaper(self):
+        if not self.options['reap_interval'] or self.reaper_pid in self.workers:
+            return
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                self.run_reaper()
+                status = 0
+            finally:
+                os._exit(status)
+        # Tracked with the workers so it is reaped and stopped the same way
+        self.reaper_pid = pid
+        self.workers[pid] = None
+
+    def run_reaper(self):
+        """Delete expired sessions in small batches until told to stop"""
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.on_stop)
+        signal.signal(signal.SIGINT, self.on_stop)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        self.server.socket.close()
+        Reaper().run(self.options['reap_interval'], lambda: self.stopping)
+
+    def reap_workers(self):
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.workers.clear()
+                return
+            if pid == 0:
+                return
+            self.workers.pop(pid, None)
+            if os.waitstatus_to_exitcode(status) != 0 and not self.stopping:
+                self.stderr.write(f"Worker {pid} exited with status {status}")
+
+    def reload(self):
+        """Reload stories in the master and replace every worker"""
+        self.reloading = False
+        if settings.STORY_SNAPSHOT:
+            self.stdout.write(f"Reloading stories from {settings.STORY_SNAPSHOT} and recycling workers")
+        else:
+            # Builders are code already imported here; only a snapshot changes
+            self.stdout.write("STORY_SNAPSHOT is not set, so stories can't change; "
+                              "recycling workers only")
+        gc.unfreeze()
+        self.preload()
+        old = list(self.workers)
+        self.generation += 1
+        self.spawn_workers()
+        for pid in old:
+            self.signal_worker(pid, signal.SIGTERM)
+
+    def stop_workers(self, pids):
+        for pid in pids:
+            self.signal_worker(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.options['graceful_timeout']
+        while self.workers and time.monotonic() < deadline:
+            self.reap_workers()
+            time.sleep(0.1)
+        for pid in list(self.workers):
+            self.signal_worker(pid, signal.SIGKILL)
+        self.reap_workers()
+
+    def signal_worker(self, pid, signum):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            self.workers.pop(pid, None)
+
+    def on_stop(self, signum, frame):
+        self.stopping = True
+
+    def on_reload(self, signum, frame):
+        self.reloading = True
+
+    def run_worker(self):
+        """Accept requests on the shared socket until told to stop or recycled"""
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.on_stop)
+        signal.signal(signal.SIGINT, self.on_stop)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        random.seed()
+
+        max_requests = self.options['max_requests']
+        if max_requests:
+            max_requests += random.randint(0, self.options['max_requests_jitter'])
+
+        self.server.timeout = 1.0
+        self.server.start_pool(self.options['threads'], self.options['queue'])
+        while not self.stopping:
+            if not self.server.slots.acquire(timeout=1.0):
+                continue
+            self.server.dispatched = False
+            self.server.handle_request()
+            if not self.server.dispatched:
+                self.server.slots.release()
+            if max_requests and self.server.requests_handled >= max_requests:
+                break
+        # Let connections already accepted finish
+        self.server.pool.shutdown(wait=True)
+        sys.stdout.flush()
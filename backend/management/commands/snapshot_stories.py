@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from backend.stories import write_snapshot
+
+
+class Command(BaseCommand):
+    help = "Compile every registered story and write them to a startup snapshot"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default=None,
+            help="Snapshot file to write (defaults to settings.STORY_SNAPSHOT)",
+        )
+
+    def handle(self, *args, **options):
+        path = options['path'] or settings.STORY_SNAPSHOT
+        if not path:
+            raise CommandError("No snapshot path given and STORY_SNAPSHOT is not set")
+
+        stories = write_snapshot(path)
+        scene_count = sum(len(story["scenes"]) for story in stories.values())
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {len(stories)} stories ({scene_count} scenes) to {path}"
+        ))
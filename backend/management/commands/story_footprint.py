@@ -0,0 +1,61 @@
+import gc
+import tracemalloc
+from django.core.management.base import BaseCommand, CommandError
+from backend.stories import compile_story, generate_story
+from backend.story_logic import Choice
+
+
+class Command(BaseCommand):
+    help = "Measure memory per scene and per choice for a large generated story"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenes', type=int, default=100000,
+                            help="Scenes in the generated story (default: 100000)")
+        parser.add_argument('--choices', type=int, default=3,
+                            help="Choices per scene (default: 3)")
+
+    def handle(self, *args, **options):
+        scene_count, choices_per_scene = options['scenes'], options['choices']
+        if scene_count < 2 or choices_per_scene < 1:
+            raise CommandError("Need at least 2 scenes and 1 choice per scene")
+
+        # Warm the shared condition/effect and string tables first, so the
+        # measurements below count only per-object memory
+        generate_story(min(scene_count, 1000), choices_per_scene)
+
+        choice_bytes, choices = self.measure(lambda: [
+            Choice(n, "Continue...", n + 1, effects={"trust": 5})
+            for n in range(scene_count)
+        ])
+        del choices
+
+        story_bytes, story = self.measure(
+            lambda: generate_story(scene_count, choices_per_scene)
+        )
+        total_choices = sum(len(scene.choices) for scene in story["scenes"].values())
+        compiled_bytes, _ = self.measure(lambda: compile_story(story))
+
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"{scene_count} scenes, {total_choices} choices"
+        ))
+        self.stdout.write(f"  per choice:              {choice_bytes / scene_count:8.1f} bytes")
+        self.stdout.write(f"  per scene (with choices):{story_bytes / scene_count:8.1f} bytes")
+        self.stdout.write(f"  compiled indices/scene:  {compiled_bytes / scene_count:8.1f} bytes")
+        total = story_bytes + compiled_bytes
+        self.stdout.write(f"  total:                   {total / 2 ** 20:8.1f} MiB")
+        self.stdout.write(
+            f"  projected for 1M scenes: {total / scene_count * 1_000_000 / 2 ** 20:8.1f} MiB"
+        )
+
+    def measure(self, build):
+        """Bytes still allocated after `build()` returns, and its result"""
+        gc.collect()
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            result = build()
+            gc.collect()
+            after = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+        return after - before, result
@@ -0,0 +1,166 @@
+"""
+Opt-in per-request profiling.
+
+A sampled request runs under a tracing profiler confined to its own thread.
+Wall time is charged to the call stack that was active, and the result is
+appended as collapsed stacks (one `frame;frame;... microseconds` line per
+stack, the input format of flamegraph.pl and speedscope) to a daily file
+in PROFILE_DIR.
+
+Each stack is prefixed with `endpoint=...;story=...;scene=...;to=...`
+frames, so one story or scene can be cut out with grep before rendering.
+`scene` is where the player was when the request arrived (the scene a
+choice was made in) and `to` where it left them.
+
+A request is profiled when it carries `X-Profile: <PROFILE_TOKEN>`, or at
+random with probability PROFILE_SAMPLE_RATE. Either way, at most
+PROFILE_MAX_PER_MINUTE profiles are taken per process. With both toggles
+off, the middleware removes itself at startup. Otherwise an unsampled
+request costs one header lookup and one random draw.
+"""
+import random
+import secrets
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from .appendfile import append_bytes
+from .ratelimit import TokenBucket
+
+
+def frame_label(frame):
+    return f"{frame.f_globals.get('__name__', '?')}.{frame.f_code.co_qualname}"
+
+
+def builtin_label(func):
+    module = getattr(func, '__module__', None) or 'builtins'
+    return f"{module}.{getattr(func, '__qualname__', repr(func))}"
+
+
+class StackProfiler:
+    """
+    Charges wall time to call stacks via sys.setprofile on the current thread
+    """
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.stacks = Counter()  # tuple of frame labels -> seconds
+        self.stack = []
+        self.last = None
+
+    def __enter__(self):
+        self.last = self.clock()
+        sys.setprofile(self.trace)
+        return self
+
+    def __exit__(self, *exc_info):
+        sys.setprofile(None)
+        self.charge()
+        return False
+
+    def charge(self):
+        now = self.clock()
+        if self.stack:
+            self.stacks[tuple(self.stack)] += now - self.last
+        self.last = now
+
+    def trace(self, frame, event, arg):
+        self.charge()
+        if event == 'call':
+            self.stack.append(frame_label(frame))
+        elif event == 'c_call':
+            self.stack.append(builtin_label(arg))
+        elif self.stack:
+            # return, c_return, c_exception; unmatched returns from the
+            # frames that started profiling leave the stack empty
+            self.stack.pop()
+
+    def collapsed(self, prefix=()):
+        """Yield `frame;frame;... microseconds` lines, heaviest first"""
+        for stack, seconds in self.stacks.most_common():
+            micros = round(seconds * 1e6)
+            if micros:
+                yield f"{';'.join(prefix + stack)} {micros}"
+
+
+def profile_path(timestamp):
+    day = time.strftime('%Y%m%d', time.gmtime(timestamp))
+    return Path(settings.PROFILE_DIR) / f"profiles-{day}.folded"
+
+
+def session_scene(request):
+    """(story_id, scene_id) the request's session is at, or None"""
+    session = getattr(request, 'session', None)
+    state = session.get('game_state') if session is not None else None
+    if not state:
+        return None
+    return state.get('story_id'), state.get('current_scene_id')
+
+
+def request_tags(request, before=None):
+    """
+    Endpoint, story and scenes of a finished request; `before` is its
+    session_scene() from before the view ran
+    """
+    match = getattr(request, 'resolver_match', None)
+    endpoint = match.url_name if match and match.url_name else request.path
+    tags = [f"endpoint={endpoint}"]
+    after = session_scene(request)
+    start = before or after
+    if start:
+        tags.append(f"story={start[0]}")
+        tags.append(f"scene={start[1]}")
+        if after:
+            tags.append(f"to={after[1]}")
+    return tuple(tag.replace(';', '_').replace(' ', '_') for tag in tags)
+
+
+def write_profile(lines):
+    """Append collapsed stacks in a single O_APPEND write; failures are logged"""
+    path = profile_path(time.time())
+    if not append_bytes(path, "".join(line + "\n" for line in lines).encode()):
+        return None
+    return path
+
+
+class ProfilingMiddleware:
+    """
+    Profiles sampled requests and writes their collapsed stacks to PROFILE_DIR
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.rate = settings.PROFILE_SAMPLE_RATE
+        self.token = settings.PROFILE_TOKEN
+        if not self.rate and not self.token:
+            raise MiddlewareNotUsed
+        per_minute = settings.PROFILE_MAX_PER_MINUTE
+        self.bucket = TokenBucket(per_minute / 60, max(1, per_minute))
+
+    def __call__(self, request):
+        if not self.should_profile(request):
+            return self.get_response(request)
+
+        request.profile_scene = None
+        with StackProfiler() as profiler:
+            response = self.get_response(request)
+        lines = list(profiler.collapsed(request_tags(request, request.profile_scene)))
+        if lines:
+            write_profile(lines)
+        response['X-Profiled'] = '1'
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # The session only exists inside SessionMiddleware, so note where a
+        # profiled player is here, before the view moves them on
+        if hasattr(request, 'profile_scene'):
+            request.profile_scene = session_scene(request)
+        return None
+
+    def should_profile(self, request):
+        header = request.META.get('HTTP_X_PROFILE')
+        if header is not None:
+            wanted = bool(self.token) and secrets.compare_digest(header.encode(), self.token.encode())
+        else:
+            wanted = self.rate > 0 and random.random() < self.rate
+        return wanted and self.bucket.try_acquire()
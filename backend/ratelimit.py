@@ -0,0 +1,38 @@
+"""
+Token buckets for rate limiting.
+"""
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Allows `rate` events per second on average, with bursts up to `capacity`
+    """
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def try_acquire(self, tokens=1):
+        """Take `tokens` if available; returns False without blocking otherwise"""
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < tokens:
+                return False
+            self.tokens -= tokens
+            return True
+
+    def retry_after(self, tokens=1):
+        """Seconds until `tokens` will be available"""
+        with self.lock:
+            elapsed = self.clock() - self.updated
+            available = min(self.capacity, self.tokens + elapsed * self.rate)
+            if available >= tokens or not self.rate:
+                return 0.0
+            return (tokens - available) / self.rate
@@ -0,0 +1,74 @@
+"""
+Incremental session expiry.
+
+Instead of one large `clearsessions` delete, expired sessions are removed
+in small batches. The batch size adapts so each delete stays within a
+time budget, and the reaper pauses between batches so writers are never
+stalled for long.
+"""
+import time
+from importlib import import_module
+from django.conf import settings
+from django.utils import timezone
+
+
+def delete_expired_batch(limit):
+    """Delete up to `limit` expired sessions; returns how many were deleted"""
+    engine = import_module(settings.SESSION_ENGINE)
+    store = engine.SessionStore
+    if hasattr(store, 'clear_expired_batch'):
+        return store.clear_expired_batch(limit)
+
+    if hasattr(store, 'get_model_class'):
+        model = store.get_model_class()
+        keys = list(
+            model.objects.filter(expire_date__lt=timezone.now())
+            .values_list('session_key', flat=True)[:limit]
+        )
+        if keys:
+            model.objects.filter(session_key__in=keys).delete()
+        return len(keys)
+
+    # Cache and cookie sessions expire on their own
+    return 0
+
+
+class Reaper:
+    """
+    Deletes expired sessions in batches sized to fit `budget` seconds
+    """
+    def __init__(self, batch_size=500, budget=0.05, pause=0.1,
+                 min_batch=10, max_batch=10000):
+        self.batch_size = batch_size
+        self.budget = budget
+        self.pause = pause
+        self.min_batch = min_batch
+        self.max_batch = max_batch
+
+    def sweep(self, should_stop=lambda: False):
+        """Delete expired sessions until none are left; returns the total"""
+        total = 0
+        while not should_stop():
+            started = time.monotonic()
+            deleted = delete_expired_batch(self.batch_size)
+            total += deleted
+            self.adapt(time.monotonic() - started)
+            if deleted == 0:
+                break
+            time.sleep(self.pause)
+        return total
+
+    def adapt(self, elapsed):
+        """Shrink the batch when a delete overran its budget, grow it when well under"""
+        if elapsed > self.budget:
+            self.batch_size = max(self.min_batch, self.batch_size // 2)
+        elif elapsed < self.budget / 4:
+            self.batch_size = min(self.max_batch, self.batch_size * 2)
+
+    def run(self, interval, should_stop=lambda: False):
+        """Sweep every `interval` seconds until `should_stop()` is true"""
+        while not should_stop():
+            self.sweep(should_stop)
+            deadline = time.monotonic() + interval
+            while not should_stop() and time.monotonic() < deadline:
+                time.sleep(min(1.0, interval))
@@ -0,0 +1,141 @@
+"""
+Headless playthrough regression runner.
+
+Replays recorded choice scripts against two versions of a story directly
+through the engine (no HTTP) and reports scripts whose ending, final
+variables or path differ. Scripts are spread over a process pool; each
+worker gets both story versions once and sends back only the diffs.
+"""
+import json
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+from .stories import apply_choice, get_story, offered_choice_ids
+from .story_logic import StoryState
+
+# Story versions being compared, set per worker by init_worker
+_versions = {}
+
+
+def load_scripts(path):
+    """
+    Read choice scripts from a JSON array or a JSON-lines file. Each
+    script is a list of choice ids or {"name": ..., "choices": [...]}.
+    """
+    with open(path, encoding='utf-8') as fh:
+        content = fh.read()
+    if content.lstrip().startswith('['):
+        items = json.loads(content)
+    else:
+        items = [json.loads(line) for line in content.splitlines() if line.strip()]
+
+    scripts = []
+    for number, item in enumerate(items):
+        if isinstance(item, dict):
+            scripts.append((item.get("name") or f"script-{number}", list(item["choices"])))
+        else:
+            scripts.append((f"script-{number}", list(item)))
+    return scripts
+
+
+def random_scripts(story, count, seed=0, max_steps=200):
+    """Record random playthroughs of a story as scripts, taking only offered choices"""
+    rng = random.Random(seed)
+    scripts = []
+    for number in range(count):
+        # Followed with run_script's seed, so branched choices land where
+        # a replay of the script will
+        state = StoryState(story_id=None, current_scene_id=0, seed=0)
+        scene = story["scenes"][0]
+        choices = []
+        while scene.choices and len(choices) < max_steps:
+            offered = offered_choice_ids(scene, state.variables)
+            if not offered:
+                break
+            choice_id = rng.choice(offered)
+            choices.append(choice_id)
+            apply_choice(story, state, scene.id, choice_id)
+            scene = story["scenes"].get(state.current_scene_id)
+            if scene is None:
+                break
+        scripts.append((f"random-{number}", choices))
+    return scripts
+
+
+def run_script(story, choices, start_scene_id=0):
+    """Play one script through the engine and summarise the outcome"""
+    state = StoryState(story_id=None, current_scene_id=start_scene_id, seed=0)
+    for step, choice_id in enumerate(choices):
+        scene_id = state.current_scene_id
+        scene = story["scenes"].get(scene_id)
+        # A choice the player would not be offered counts as a broken
+        # route, e.g. one whose conditions were tightened
+        if scene is None or choice_id not in offered_choice_ids(scene, state.variables):
+            return {
+                "ending": False,
+                "error": f"step {step}: choice {choice_id} not offered in scene {scene_id}",
+                "final_variables": state.variables,
+                "path": state.visited_scenes,
+            }
+        apply_choice(story, state, scene_id, choice_id)
+
+    scene = story["scenes"].get(state.current_scene_id)
+    return {
+        "ending": scene is not None and not scene.choices,
+        "error": None if scene is not None else f"missing scene {state.current_scene_id}",
+        "final_variables": state.variables,
+        "path": state.visited_scenes + [state.current_scene_id],
+    }
+
+
+def compare_outcomes(old, new):
+    """Fields that differ between two run_script results"""
+    return {
+        field: {"old": old[field], "new": new[field]}
+        for field in ("ending", "error", "final_variables", "path")
+        if old[field] != new[field]
+    }
+
+
+def init_worker(old_story, new_story):
+    _versions["old"] = old_story
+    _versions["new"] = new_story
+
+
+def run_chunk(scripts):
+    """Replay scripts on both versions; returns (name, differences) for changed ones"""
+    old_story, new_story = _versions["old"], _versions["new"]
+    diffs = []
+    for name, choices in scripts:
+        differences = compare_outcomes(run_script(old_story, choices),
+                                       run_script(new_story, choices))
+        if differences:
+            diffs.append((name, differences))
+    return diffs
+
+
+def run_regression(story_id, old_version, new_version, scripts, workers=None):
+    """
+    Replay every script on both versions across a process pool.
+    Returns the list of (name, differences) for scripts whose outcome changed.
+    """
+    old_story = get_story(story_id, old_version)
+    new_story = get_story(story_id, new_version)
+    if old_story is None or new_story is None:
+        missing = old_version if old_story is None else new_version
+        raise LookupError(f"Story {story_id} version {missing} is not available")
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(scripts) < 2:
+        init_worker(old_story, new_story)
+        return run_chunk(scripts)
+
+    # A few chunks per worker keeps the pool busy without much IPC
+    chunk_size = max(1, len(scripts) // (workers * 4))
+    chunks = [scripts[start:start + chunk_size] for start in range(0, len(scripts), chunk_size)]
+    diffs = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(old_story, new_story)) as pool:
+        for chunk_diffs in pool.map(run_chunk, chunks):
+            diffs.extend(chunk_diffs)
+    return diffs
@@ -0,0 +1,49 @@
+"""
+Compare-and-set saves for whichever session engine is configured.
+
+A turn must only be saved over the session row it was read from, so of
+two requests racing for the same step only the first is applied. The
+sharded engine does this itself; the db and cached_db engines do it with
+a conditional UPDATE. Engines with no row to compare (signed cookies,
+cache, file) keep their ordinary last-write-wins save.
+"""
+from django.contrib.sessions.backends.cached_db import SessionStore as CachedDBStore
+from django.contrib.sessions.backends.db import SessionStore as DBStore
+
+
+def stored_data(session):
+    """
+    The session's encoded row as stored right now, or None if it has none
+    or the engine can't compare rows
+    """
+    if hasattr(session, 'stored_data'):
+        return session.stored_data()
+    if isinstance(session, DBStore):
+        return session.model.objects.filter(session_key=session.session_key).values_list(
+            'session_data', flat=True).first()
+    return None
+
+
+def save_if_unchanged(session, expected):
+    """
+    Save the session only if its stored row is still `expected`; returns
+    whether it was saved. Engines without rows to compare are left for
+    SessionMiddleware to save as usual, and always win.
+    """
+    if hasattr(session, 'save_if_unchanged'):
+        saved = session.save_if_unchanged(expected)
+    elif isinstance(session, DBStore):
+        saved = expected is not None and bool(session.model.objects.filter(
+            session_key=session.session_key, session_data=expected,
+        ).update(session_data=session.encode(dict(session.items())),
+                 expire_date=session.get_expiry_date()))
+        if saved and isinstance(session, CachedDBStore):
+            # Later requests read the cache first
+            session._cache.set(session.cache_key, dict(session.items()),
+                               session.get_expiry_age())
+    else:
+        return True
+    if saved:
+        # Saved here; the cookie keeps the lifetime it was last set with
+        session.modified = False
+    return saved
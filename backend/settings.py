@@ -24,9 +24,11 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'backend',
 ]
 
 MIDDLEWARE = [
+    'backend.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -67,6 +69,73 @@ DATABASES = {
 }
 
 
+# Sessions
+# Set SESSION_ENGINE=backend.sharded_sessions to spread sessions across
+# SESSION_SHARD_COUNT SQLite files (see `manage.py reshard_sessions`).
+
+SESSION_ENGINE = env('SESSION_ENGINE', default='django.contrib.sessions.backends.db')
+
+SESSION_SHARD_DIR = Path(env('SESSION_SHARD_DIR', default=str(BASE_DIR / 'data' / 'sessions')))
+
+SESSION_SHARD_COUNT = env.int('SESSION_SHARD_COUNT', default=8)
+
+# Most writes a shard commits in one transaction. Above 1, a writer thread
+# per shard batches them; that only pays off with many threads per worker
+# (`serve --threads 16`). At 1, each thread commits its own writes.
+SESSION_SHARD_BATCH_SIZE = env.int('SESSION_SHARD_BATCH_SIZE', default=1)
+
+
+# Finished playthroughs are appended to compressed daily archives here, and
+# their sessions expire FINISHED_SESSION_TTL seconds later. Run
+# `manage.py reap_sessions` (or `serve --reap-interval`) to delete
+# expired sessions incrementally.
+
+PLAYTHROUGH_ARCHIVE_DIR = Path(env('PLAYTHROUGH_ARCHIVE_DIR', default=str(BASE_DIR / 'data' / 'archive')))
+
+FINISHED_SESSION_TTL = env.int('FINISHED_SESSION_TTL', default=3600)
+
+
+# Admission control for /api/start/ and /api/choice/, held per worker.
+# With ADMISSION_CLIENT_RATE set, each client address gets that many
+# requests per second (bursts up to ADMISSION_CLIENT_BURST). It is off by
+# default: behind a load balancer every player shares its address, so set
+# ADMISSION_TRUSTED_PROXIES before enabling it there. Requests that queued
+# longer than ADMISSION_MAX_QUEUE_NEW_SESSION (new sessions) or
+# ADMISSION_MAX_QUEUE_IN_STORY (choices) seconds are shed with 503.
+# 0 disables a limit.
+
+ADMISSION_CLIENT_RATE = env.float('ADMISSION_CLIENT_RATE', default=0.0)
+
+ADMISSION_CLIENT_BURST = env.int('ADMISSION_CLIENT_BURST', default=30)
+
+ADMISSION_MAX_CLIENTS = env.int('ADMISSION_MAX_CLIENTS', default=10000)
+
+# Reverse proxies whose X-Forwarded-For is believed when keying clients
+ADMISSION_TRUSTED_PROXIES = env.list('ADMISSION_TRUSTED_PROXIES', default=[])
+
+# Requests sending this in X-Admission-Token skip the per-client limit
+# (e.g. `loadtest --url`); empty disables the bypass
+ADMISSION_BYPASS_TOKEN = env('ADMISSION_BYPASS_TOKEN', default='')
+
+ADMISSION_MAX_QUEUE_NEW_SESSION = env.float('ADMISSION_MAX_QUEUE_NEW_SESSION', default=0.5)
+
+ADMISSION_MAX_QUEUE_IN_STORY = env.float('ADMISSION_MAX_QUEUE_IN_STORY', default=2.0)
+
+
+# Request profiling
+# Requests sent with `X-Profile: <PROFILE_TOKEN>`, or a PROFILE_SAMPLE_RATE
+# fraction of all requests, are profiled. Collapsed stacks for flamegraphs
+# are appended to PROFILE_DIR, at most PROFILE_MAX_PER_MINUTE per process.
+
+PROFILE_SAMPLE_RATE = env.float('PROFILE_SAMPLE_RATE', default=0.0)
+
+PROFILE_TOKEN = env('PROFILE_TOKEN', default='')
+
+PROFILE_MAX_PER_MINUTE = env.int('PROFILE_MAX_PER_MINUTE', default=6)
+
+PROFILE_DIR = Path(env('PROFILE_DIR', default=str(BASE_DIR / 'data' / 'profiles')))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
 
@@ -102,3 +171,69 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/6.0/howto/static-files/
 
 STATIC_URL = 'static/'
+
+# Scene assets (see `manage.py build_assets`)
+# Backgrounds are looked up in STORY_ASSET_DIRS and copied to content-hashed
+# files in STORY_ASSET_ROOT, served from STORY_ASSET_URL. The app can serve
+# them, but only through Python; in production the fronting proxy should
+# serve STORY_ASSET_URL from STORY_ASSET_ROOT.
+
+STORY_ASSET_DIRS = [BASE_DIR / 'static']
+
+STORY_ASSET_ROOT = Path(env('STORY_ASSET_ROOT', default=str(BASE_DIR / 'data' / 'assets')))
+
+STORY_ASSET_URL = '/assets/'
+
+
+# Story loading
+# Path to a precompiled story snapshot (see `manage.py snapshot_stories`).
+# Workers unpickle it instead of building every story from scratch.
+
+STORY_SNAPSHOT = env('STORY_SNAPSHOT', default=None)
+
+# Every released story version is archived here (`manage.py
+# archive_story_versions`) so sessions pinned to an older version can
+# finish it. Every server must share this directory, and it must outlive
+# deploys. At most STORY_VERSION_CACHE_SIZE older versions are kept in
+# memory at once.
+
+STORY_VERSION_DIR = Path(env('STORY_VERSION_DIR', default=str(BASE_DIR / 'data' / 'story_versions')))
+
+STORY_VERSION_CACHE_SIZE = env.int('STORY_VERSION_CACHE_SIZE', default=4)
+
+# Locale of the text built into the story graph; translations for other
+# locales are loaded on demand from STORY_TEXT_DIR/<story_id>/<locale>.json,
+# or STORY_TEXT_DIR/<story_id>/<version>/<locale>.json for one version
+
+STORY_DEFAULT_LOCALE = 'en'
+
+STORY_TEXT_DIR = BASE_DIR / 'backend' / 'story_text'
+
+
+# Bundles of the scenes ahead of a player, for client-side play: default
+# and maximum depth in choices, scene cap, and compressed bundles kept in
+# memory. Clients verify up to STORY_PATH_MAX_CHOICES choices per call.
+
+STORY_BUNDLE_HOPS = env.int('STORY_BUNDLE_HOPS', default=5)
+
+STORY_BUNDLE_MAX_HOPS = env.int('STORY_BUNDLE_MAX_HOPS', default=12)
+
+STORY_BUNDLE_MAX_SCENES = env.int('STORY_BUNDLE_MAX_SCENES', default=500)
+
+STORY_BUNDLE_CACHE_SIZE = env.int('STORY_BUNDLE_CACHE_SIZE', default=256)
+
+STORY_PATH_MAX_CHOICES = env.int('STORY_PATH_MAX_CHOICES', default=64)
+
+
+# Spectators
+# Events are fanned out in process memory, so spectating only works on a
+# single-process ASGI server (backend.asgi). Set SPECTATORS_ENABLED there;
+# otherwise no spectator channels are handed out. Events a spectator may
+# fall behind before being dropped, and seconds between keepalive
+# comments on idle streams.
+
+SPECTATORS_ENABLED = env.bool('SPECTATORS_ENABLED', default=False)
+
+SPECTATOR_QUEUE_SIZE = env.int('SPECTATOR_QUEUE_SIZE', default=16)
+
+SPECTATOR_KEEPALIVE = env.float('SPECTATOR_KEEPALIVE', default=15.0)
@@ -0,0 +1,30 @@
+"""
+Lean settings profile for gameplay-only workers.
+
+Loads just what /api/start/ and /api/choice/ need: sessions and CSRF.
+The admin, auth, messages and template stack are left out so a cold
+worker imports as little of Django as possible.
+
+Use with DJANGO_SETTINGS_MODULE=backend.settings_gameplay
+"""
+from .settings import *  # noqa: F401,F403
+
+INSTALLED_APPS = [
+    'django.contrib.sessions',
+    'backend',
+]
+
+MIDDLEWARE = [
+    'backend.profiling.ProfilingMiddleware',
+    'django.middleware.security.SecurityMiddleware',
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.common.CommonMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+]
+
+TEMPLATES = []
+
+AUTH_PASSWORD_VALIDATORS = []
+
+# Gameplay responses carry no translated Django strings
+USE_I18N = False
@@ -0,0 +1,310 @@
+"""
+Session engine that spreads sessions across several SQLite files.
+
+Set SESSION_ENGINE = 'backend.sharded_sessions'. Each session key hashes
+to one of SESSION_SHARD_COUNT shard files in SESSION_SHARD_DIR, so
+writers only contend on their own shard's lock.
+
+Each thread keeps a persistent connection per shard and, by default,
+writes on it too. With SESSION_SHARD_BATCH_SIZE above 1, writes instead
+go to a single writer thread per shard and process, which commits
+whatever has queued up (at most that many writes) in one transaction.
+Either way the caller waits for its commit, so a saved session is durable
+and visible to other workers as soon as save() returns.
+"""
+import hashlib
+import os
+import queue
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from django.conf import settings
+from django.contrib.sessions.backends.base import CreateError, SessionBase, UpdateError
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS django_session ("
+    " session_key TEXT PRIMARY KEY,"
+    " session_data TEXT NOT NULL,"
+    " expire_date REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS django_session_expire_date ON django_session (expire_date)",
+)
+
+# busy_timeout comes first so the others wait out a locked shard too
+PRAGMAS = (
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+)
+
+# Longest a save waits for its batch: the busy timeout plus some slack
+WRITE_TIMEOUT = 10
+
+
+def shard_path(directory, index, count):
+    """Shard files are named by index and count, so layouts can coexist"""
+    return Path(directory) / f"sessions-{index:03d}-of-{count:03d}.sqlite3"
+
+
+def shard_index(session_key, count):
+    digest = hashlib.blake2b(session_key.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % count
+
+
+def connect(path):
+    """Open a shard, creating its schema and applying the tuned pragmas"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    for statement in SCHEMA:
+        conn.execute(statement)
+    return conn
+
+
+class DirectWriter:
+    """Commits each write on the calling thread's own connection"""
+    def __init__(self, pool, index):
+        self.pool = pool
+        self.index = index
+
+    def execute(self, sql, params):
+        """Run one statement in its own transaction; returns rowcount"""
+        conn = self.pool.reader(self.index)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rowcount = conn.execute(sql, params).rowcount
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        return rowcount
+
+
+class ShardWriter:
+    """
+    Owns the write connection for one shard and commits queued writes
+    in batches
+    """
+    def __init__(self, path, batch_size):
+        self.path = path
+        self.batch_size = batch_size
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self.run, daemon=True,
+                                       name=f"session-writer-{path.stem}")
+        self.thread.start()
+
+    def execute(self, sql, params):
+        """Queue one statement and wait for its batch to commit; returns rowcount"""
+        item = [sql, params, threading.Event(), None, None]
+        self.queue.put(item)
+        if not item[2].wait(WRITE_TIMEOUT):
+            raise sqlite3.OperationalError(f"session writer for {self.path.name} timed out")
+        if item[4] is not None:
+            raise item[4]
+        return item[3]
+
+    def run(self):
+        conn = None
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            # Any failure fails this batch only; the thread lives on to
+            # serve the next one, reconnecting if it has to
+            try:
+                if conn is None:
+                    conn = connect(self.path)
+                conn.execute("BEGIN IMMEDIATE")
+                for item in batch:
+                    item[3] = conn.execute(item[0], item[1]).rowcount
+                conn.execute("COMMIT")
+            except Exception as exc:
+                for item in batch:
+                    item[4] = exc
+                try:
+                    if conn is not None and conn.in_transaction:
+                        conn.execute("ROLLBACK")
+                except Exception:
+                    conn.close()
+                    conn = None
+            for item in batch:
+                item[2].set()
+
+
+class ShardPool:
+    """Per-process connections and writers for one shard layout"""
+    def __init__(self, directory, count, batch_size):
+        self.directory = directory
+        self.count = count
+        self.batch_size = batch_size
+        self.pid = os.getpid()
+        self.local = threading.local()
+        self.writers = {}
+        self.lock = threading.Lock()
+
+    def reader(self, index):
+        connections = getattr(self.local, 'connections', None)
+        if connections is None:
+            connections = self.local.connections = {}
+        conn = connections.get(index)
+        if conn is None:
+            conn = connections[index] = connect(shard_path(self.directory, index, self.count))
+        return conn
+
+    def writer(self, index):
+        writer = self.writers.get(index)
+        if writer is None:
+            with self.lock:
+                writer = self.writers.get(index)
+                if writer is None:
+                    if self.batch_size > 1:
+                        writer = ShardWriter(
+                            shard_path(self.directory, index, self.count), self.batch_size
+                        )
+                    else:
+                        writer = DirectWriter(self, index)
+                    self.writers[index] = writer
+        return writer
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Shard pool for the current process and settings, rebuilt after fork"""
+    global _pool
+    key = (str(settings.SESSION_SHARD_DIR), settings.SESSION_SHARD_COUNT,
+           settings.SESSION_SHARD_BATCH_SIZE)
+    pool = _pool
+    if pool is None or pool.pid != os.getpid() or \
+            (str(pool.directory), pool.count, pool.batch_size) != key:
+        with _pool_lock:
+            pool = _pool
+            if pool is None or pool.pid != os.getpid() or \
+                    (str(pool.directory), pool.count, pool.batch_size) != key:
+                pool = _pool = ShardPool(*key)
+    return pool
+
+
+class SessionStore(SessionBase):
+    """
+    Sharded SQLite session store
+    """
+    def shard(self, session_key):
+        return shard_index(session_key, get_pool().count)
+
+    def load(self):
+        if self.session_key is not None:
+            row = get_pool().reader(self.shard(self.session_key)).execute(
+                "SELECT session_data FROM django_session"
+                " WHERE session_key = ? AND expire_date > ?",
+                (self.session_key, time.time()),
+            ).fetchone()
+            if row is not None:
+                return self.decode(row[0])
+        self._session_key = None
+        return {}
+
+    def exists(self, session_key):
+        row = get_pool().reader(self.shard(session_key)).execute(
+            "SELECT 1 FROM django_session WHERE session_key = ?", (session_key,)
+        ).fetchone()
+        return row is not None
+
+    def create(self):
+        while True:
+            self._session_key = self._get_new_session_key()
+            try:
+                # Save immediately to ensure we have a unique entry
+                self.save(must_create=True)
+            except CreateError:
+                # Key wasn't unique. Try again.
+                continue
+            self.modified = True
+            return
+
+    def save(self, must_create=False):
+        if self.session_key is None:
+            return self.create()
+        data = self.encode(self._get_session(no_load=must_create))
+        expire_date = self.get_expiry_date().timestamp()
+        writer = get_pool().writer(self.shard(self.session_key))
+
+        if must_create:
+            changed = writer.execute(
+                "INSERT OR IGNORE INTO django_session VALUES (?, ?, ?)",
+                (self.session_key, data, expire_date),
+            )
+            if not changed:
+                raise CreateError
+        else:
+            changed = writer.execute(
+                "UPDATE django_session SET session_data = ?, expire_date = ?"
+                " WHERE session_key = ?",
+                (data, expire_date, self.session_key),
+            )
+            if not changed:
+                raise UpdateError
+
+    def stored_data(self):
+        """The session's encoded row as stored right now, or None"""
+        row = get_pool().reader(self.shard(self.session_key)).execute(
+            "SELECT session_data FROM django_session WHERE session_key = ?",
+            (self.session_key,),
+        ).fetchone()
+        return row[0] if row is not None else None
+
+    def save_if_unchanged(self, expected):
+        """
+        Save only if the stored row is still `expected`, so of two requests
+        that loaded the same row only the first to save wins. Returns
+        whether this one did.
+        """
+        changed = get_pool().writer(self.shard(self.session_key)).execute(
+            "UPDATE django_session SET session_data = ?, expire_date = ?"
+            " WHERE session_key = ? AND session_data = ?",
+            (self.encode(self._get_session()), self.get_expiry_date().timestamp(),
+             self.session_key, expected),
+        )
+        return bool(changed)
+
+    def delete(self, session_key=None):
+        if session_key is None:
+            if self.session_key is None:
+                return
+            session_key = self.session_key
+        get_pool().writer(self.shard(session_key)).execute(
+            "DELETE FROM django_session WHERE session_key = ?", (session_key,)
+        )
+
+    @classmethod
+    def clear_expired_batch(cls, limit):
+        """Delete up to `limit` expired sessions, spread over the shards"""
+        pool = get_pool()
+        deleted = 0
+        per_shard = max(1, limit // pool.count)
+        for index in range(pool.count):
+            if deleted >= limit:
+                break
+            deleted += pool.writer(index).execute(
+                "DELETE FROM django_session WHERE rowid IN ("
+                " SELECT rowid FROM django_session WHERE expire_date < ? LIMIT ?)",
+                (time.time(), min(per_shard, limit - deleted)),
+            )
+        return deleted
+
+    @classmethod
+    def clear_expired(cls):
+        pool = get_pool()
+        for index in range(pool.count):
+            pool.writer(index).execute(
+                "DELETE FROM django_session WHERE expire_date < ?", (time.time(),)
+            )
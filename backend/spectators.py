@@ -0,0 +1,121 @@
+"""
+Spectator fan-out - streams a live playthrough to its audience over
+server-sent events.
+
+Each published event is encoded once and the same bytes are queued for
+every subscriber. Subscribers that fall `max_queue` events behind are
+dropped rather than slowing the publisher down.
+
+Subscriptions live in the memory of the process that serves them, so
+spectator streams need an ASGI deployment (backend.asgi) that routes a
+channel's viewers and its player to the same process.
+"""
+import asyncio
+import json
+import threading
+from django.conf import settings
+
+
+def encode_event(payload, event='scene'):
+    """Encode a payload as a single server-sent event frame"""
+    data = json.dumps(payload, separators=(',', ':'))
+    return f"event: {event}\ndata: {data}\n\n".encode()
+
+
+class Subscriber:
+    """One viewer's bounded queue of pending frames"""
+    def __init__(self, loop, max_queue):
+        self.loop = loop
+        self.queue = asyncio.Queue(max_queue)
+        self.dropped = False
+
+
+class Broadcaster:
+    """
+    Tracks subscribers per channel and fans published events out to them
+    """
+    def __init__(self, max_queue=16, keepalive=15.0):
+        self.max_queue = max_queue
+        self.keepalive = keepalive
+        self.channels = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, channel):
+        """Register a subscriber on the running event loop"""
+        subscriber = Subscriber(asyncio.get_running_loop(), self.max_queue)
+        with self.lock:
+            self.channels.setdefault(channel, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, channel, subscriber):
+        with self.lock:
+            subscribers = self.channels.get(channel)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self.channels[channel]
+
+    def subscriber_count(self, channel):
+        with self.lock:
+            return len(self.channels.get(channel, ()))
+
+    def publish(self, channel, payload, event='scene'):
+        """Encode once and queue for every subscriber; safe from any thread"""
+        with self.lock:
+            subscribers = list(self.channels.get(channel, ()))
+        if not subscribers:
+            return 0
+
+        frame = encode_event(payload, event)
+        by_loop = {}
+        for subscriber in subscribers:
+            by_loop.setdefault(subscriber.loop, []).append(subscriber)
+        for loop, loop_subscribers in by_loop.items():
+            try:
+                loop.call_soon_threadsafe(self.deliver, channel, loop_subscribers, frame)
+            except RuntimeError:
+                # Event loop already closed
+                for subscriber in loop_subscribers:
+                    self.unsubscribe(channel, subscriber)
+        return len(subscribers)
+
+    def deliver(self, channel, subscribers, frame):
+        """Queue a frame on one event loop, dropping subscribers that lag"""
+        for subscriber in subscribers:
+            if subscriber.dropped:
+                continue
+            try:
+                subscriber.queue.put_nowait(frame)
+            except asyncio.QueueFull:
+                self.drop(channel, subscriber)
+
+    def drop(self, channel, subscriber):
+        subscriber.dropped = True
+        self.unsubscribe(channel, subscriber)
+        while not subscriber.queue.empty():
+            subscriber.queue.get_nowait()
+        subscriber.queue.put_nowait(None)
+
+    async def stream(self, channel):
+        """Yield event frames for one viewer until the viewer goes away or lags"""
+        subscriber = self.subscribe(channel)
+        try:
+            yield b"retry: 3000\n\n"
+            while True:
+                try:
+                    frame = await asyncio.wait_for(subscriber.queue.get(), self.keepalive)
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+                    continue
+                if frame is None:
+                    yield encode_event({"reason": "slow consumer"}, event='dropped')
+                    return
+                yield frame
+        finally:
+            self.unsubscribe(channel, subscriber)
+
+
+broadcaster = Broadcaster(
+    max_queue=getattr(settings, 'SPECTATOR_QUEUE_SIZE', 16),
+    keepalive=getattr(settings, 'SPECTATOR_KEEPALIVE', 15.0),
+)
@@ -0,0 +1,600 @@
+"""
+Story registry - builds, compiles and caches the stories served by the API.
+
+Each story has one current version, built from STORY_BUILDERS and kept
+resident. Every version that has been served is archived as JSON under
+STORY_VERSION_DIR, so sessions that started on an older version can keep
+playing it; those versions are loaded on demand into a small LRU cache.
+"""
+import hashlib
+import json
+import logging
+import pickle
+import random
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from django.conf import settings
+from .story_logic import Branch, Scene, Choice
+
+# Bump whenever the compiled layout changes so stale snapshots are rebuilt
+SNAPSHOT_FORMAT = 4
+
+# Scenes with more choices than this get a choice-id lookup table
+CHOICE_INDEX_THRESHOLD = 8
+
+
+def build_sample_story():
+    """A simple sample story"""
+    return {
+        "version": 1,
+        "attributes": ["trust", "security"],
+        "scenes": {
+            0: Scene(
+                scene_id=0,
+                background="/static/house_entrance.jpg",
+                choices=[
+                    Choice(1, "Enter the house", 1,
+                          effects={}),
+                    Choice(2, "Don't enter, go to the barn", 3,
+                          effects={})
+                ]
+            ),
+            1: Scene(
+                scene_id=1,
+                background="/static/inside_house.jpg",
+                choices=[
+                    Choice(3, "Trust the friend", 2,
+                          effects={"trust": 10, "security": 10}),
+                    Choice(4, "Don't trust them, go outside", 3,
+                          effects={})
+                ]
+            ),
+            2: Scene(
+                scene_id=2,
+                background="/static/with_friend.jpg",
+                choices=[
+                    Choice(5, "Gift him my watch", 5,
+                          effects={"trust": 20}),
+                    Choice(6, "Don't gift the watch", 5,
+                          effects={})
+                ]
+            ),
+            3: Scene(
+                scene_id=3,
+                background="/static/barn.jpg",
+                choices=[
+                    Choice(7, "Sleep in the barn", 6,
+                          effects={"trust": -5, "security": -10})
+                ]
+            ),
+            4: Scene(
+                scene_id=4,
+                background="/static/outside.jpg",
+                choices=[]
+            ),
+            5: Scene(
+                scene_id=5,
+                background="/static/friend_room.jpg",
+                choices=[
+                    Choice(8, "Continue...", 7,
+                          conditions={"trust": 30, "security": 10}),
+                    Choice(9, "Continue...", 8,
+                          conditions={})
+                ]
+            ),
+            6: Scene(
+                scene_id=6,
+                background="/static/barn_ending.jpg",
+                choices=[]
+            ),
+            7: Scene(
+                scene_id=7,
+                background="/static/separate_bed.jpg",
+                choices=[]
+            ),
+            8: Scene(
+                scene_id=8,
+                background="/static/couch.jpg",
+                choices=[]
+            )
+        }
+    }
+
+
+def generate_story(scene_count, choices_per_scene=3, seed=0):
+    """
+    Build a large synthetic story for benchmarks and tests. Scenes only
+    lead forward, so every playthrough ends; the last scenes are endings.
+    Conditions, effects, texts and backgrounds come from small pools, as
+    they do in hand-written stories.
+    """
+    rng = random.Random(seed)
+    attributes = ["trust", "security", "courage", "wit"]
+    backgrounds = [f"/static/generated_{n}.jpg" for n in range(50)]
+    texts = ["Continue...", "Go left", "Go right", "Wait", "Run", "Talk", "Leave"]
+    effects_pool = [{}] * 4 + [{name: delta} for name in attributes for delta in (-5, 5, 10)]
+    conditions_pool = [{}] * 8 + [{name: 10} for name in attributes]
+
+    scenes = {}
+    choice_id = 0
+    for scene_id in range(scene_count):
+        choices = []
+        remaining = scene_count - scene_id - 1
+        for _ in range(min(choices_per_scene, remaining)):
+            choice_id += 1
+            target = scene_id + 1 + rng.randrange(min(remaining, 20))
+            choices.append(Choice(choice_id, rng.choice(texts), target,
+                                  conditions=dict(rng.choice(conditions_pool)),
+                                  effects=dict(rng.choice(effects_pool))))
+        scenes[scene_id] = Scene(scene_id=scene_id, background=rng.choice(backgrounds),
+                                 choices=choices)
+    return {"version": 1, "attributes": attributes, "scenes": scenes}
+
+
+# story_id -> callable returning raw story data
+STORY_BUILDERS = {
+    0: build_sample_story,
+}
+
+logger = logging.getLogger(__name__)
+
+_compiled_stories = {}
+_story_versions = OrderedDict()  # (story_id, version) -> compiled story, LRU order
+_versions_lock = threading.Lock()
+
+
+def compile_story(story_data):
+    """Attach lookup tables derived from the scene graph to raw story data"""
+    story_data.setdefault("version", 1)
+    story_data.setdefault("migrations", {})
+    scenes = story_data["scenes"]
+    # Scenes with a handful of choices are cheaper to scan than to index
+    story_data["choice_index"] = {
+        scene_id: {choice.id: choice for choice in scene.choices}
+        for scene_id, scene in scenes.items()
+        if len(scene.choices) > CHOICE_INDEX_THRESHOLD
+    }
+    story_data["scene_order"] = sorted(scenes)
+    # Branches whose weights don't depend on variables are sampled from
+    # precomputed alias tables
+    story_data["alias_tables"] = {
+        (scene_id, choice.id): build_alias_table([branch.weight for branch in choice.branches])
+        for scene_id, scene in scenes.items()
+        for choice in scene.choices
+        if choice.branches and not any(branch.modifiers for branch in choice.branches)
+    }
+
+    adjacency = {}
+    reverse_adjacency = {scene_id: [] for scene_id in scenes}
+    for scene_id, scene in scenes.items():
+        targets = tuple(dict.fromkeys(
+            target for choice in scene.choices for target in choice_targets(choice)
+        ))
+        adjacency[scene_id] = targets
+        for target in targets:
+            reverse_adjacency.setdefault(target, []).append(scene_id)
+    story_data["adjacency"] = adjacency
+    story_data["reverse_adjacency"] = {
+        scene_id: tuple(sources) for scene_id, sources in reverse_adjacency.items()
+    }
+    return story_data
+
+
+def choice_targets(choice):
+    """Every scene a choice can lead to"""
+    return (choice.target_scene_id,) + tuple(branch.target_scene_id for branch in choice.branches)
+
+
+def build_alias_table(weights):
+    """
+    Walker alias table for sampling indexes in proportion to `weights`:
+    (probabilities, aliases), or None if no weight is positive
+    """
+    # Negative weights count as 0, as in Branch.weight_for
+    weights = [max(0, weight) for weight in weights]
+    total = sum(weights)
+    if total <= 0:
+        return None
+    count = len(weights)
+    scaled = [weight * count / total for weight in weights]
+    probabilities = [1.0] * count
+    aliases = list(range(count))
+    small = [index for index, value in enumerate(scaled) if value < 1]
+    large = [index for index, value in enumerate(scaled) if value >= 1]
+    while small and large:
+        less, more = small.pop(), large.pop()
+        probabilities[less] = scaled[less]
+        aliases[less] = more
+        scaled[more] += scaled[less] - 1
+        (small if scaled[more] < 1 else large).append(more)
+    # Whatever is left over is 1 up to rounding error and keeps probability 1
+    return tuple(probabilities), tuple(aliases)
+
+
+def branch_draws(seed, step, scene_id, choice_id):
+    """
+    Two uniform numbers in [0, 1) fixed by the session seed, the step and
+    the choice, so the same choice at the same point always has the same outcome
+    """
+    key = f"{seed}:{step}:{scene_id}:{choice_id}".encode()
+    digest = hashlib.blake2b(key, digest_size=16).digest()
+    return (
+        (int.from_bytes(digest[:8], 'big') >> 11) / (1 << 53),
+        (int.from_bytes(digest[8:], 'big') >> 11) / (1 << 53),
+    )
+
+
+def pick_target(story, state, scene_id, choice):
+    """
+    Scene a choice leads to for this player. Branched choices sample their
+    alias table in constant time; tables for variable-dependent weights
+    are built from the player's variables first.
+    """
+    if not choice.branches:
+        return choice.target_scene_id
+    table = story["alias_tables"].get((scene_id, choice.id))
+    if table is None:
+        table = build_alias_table([branch.weight_for(state.variables)
+                                   for branch in choice.branches])
+    if table is None:
+        return choice.target_scene_id
+
+    probabilities, aliases = table
+    column, coin = branch_draws(state.seed, state.step, scene_id, choice.id)
+    index = int(column * len(probabilities))
+    if coin >= probabilities[index]:
+        index = aliases[index]
+    return choice.branches[index].target_scene_id
+
+
+def find_choice(story, scene, choice_id):
+    """Look up a choice of a scene by id"""
+    index = story["choice_index"].get(scene.id)
+    if index is not None:
+        return index.get(choice_id)
+    for choice in scene.choices:
+        if choice.id == choice_id:
+            return choice
+    return None
+
+
+def get_available_choices(scene, variables, text=None):
+    """Get filtered list of available choices based on conditions"""
+    available_choices = []
+    for choice in scene.choices:
+        is_available = check_conditions(choice.conditions, variables)
+        available_choices.append({
+            "id": choice.id,
+            "text": text.choice_text(choice) if text else choice.text,
+            "available": is_available
+        })
+
+    # For conditional flow scenes, show only the first matching choice
+    if len(available_choices) > 1 and has_conditional_flow(scene.choices):
+        for i, choice in enumerate(scene.choices):
+            if check_conditions(choice.conditions, variables):
+                return [available_choices[i]]
+        # No conditional choices matched, return the fallback (last choice)
+        return [available_choices[-1]]
+
+    return available_choices
+
+
+def check_conditions(conditions, variables):
+    """Evaluate if all conditions are met with current variables"""
+    for var_name, required_value in conditions.items():
+        if variables.get(var_name, 0) < required_value:
+            return False
+    return True
+
+
+def has_conditional_flow(choices):
+    """Check if scene has conditional flow pattern (conditional choice followed by fallback)"""
+    return len(choices) >= 2 and choices[0].conditions and not choices[-1].conditions
+
+
+def offered_choice_ids(scene, variables):
+    """Ids of the choices a player with `variables` is offered in a scene"""
+    return [choice["id"] for choice in get_available_choices(scene, variables)
+            if choice["available"]]
+
+
+def apply_choice(story, state, scene_id, choice_id):
+    """
+    Take a choice for the player: apply its effects, record the scene and
+    move to the target (picking a branch with the variables after the
+    effects). Returns the choice, or None (leaving the state untouched) if
+    the scene or choice doesn't exist.
+    """
+    scene = story["scenes"].get(scene_id)
+    if scene is None:
+        return None
+    choice = find_choice(story, scene, choice_id)
+    if choice is None:
+        return None
+
+    for var_name, value in choice.effects.items():
+        state.variables[var_name] = state.variables.get(var_name, 0) + value
+    state.visited_scenes.append(scene_id)
+    state.current_scene_id = pick_target(story, state, scene_id, choice)
+    state.step += 1
+    return choice
+
+
+def scenes_within(story, scene_id, hops, limit, neighbours=None):
+    """
+    Scene ids reachable from `scene_id` in at most `hops` steps, nearest
+    first, capped at `limit`. `neighbours(scene_id)` gives the scenes one
+    step away; by default that is along choices in either direction.
+    """
+    if neighbours is None:
+        adjacency = story["adjacency"]
+        reverse_adjacency = story["reverse_adjacency"]
+
+        def neighbours(current):
+            return adjacency.get(current, ()) + reverse_adjacency.get(current, ())
+
+    found = {scene_id: 0}
+    frontier = [scene_id]
+    for distance in range(1, hops + 1):
+        next_frontier = []
+        for current in frontier:
+            for neighbour in neighbours(current):
+                if neighbour not in found:
+                    found[neighbour] = distance
+                    next_frontier.append(neighbour)
+                    if len(found) >= limit:
+                        return found
+        if not next_frontier:
+            break
+        frontier = next_frontier
+    return found
+
+
+def get_story(story_id=0, version=None):
+    """
+    Return a compiled story, loading the registry on first use.
+    Without a version, or for the current one, this is the resident story;
+    older versions come from the archive.
+    """
+    if not _compiled_stories:
+        load_stories()
+    story = _compiled_stories.get(story_id)
+    if story is None or version is None or version == story["version"]:
+        return story
+    return get_story_version(story_id, version)
+
+
+def get_story_version(story_id, version):
+    """Load an archived version, keeping the most recently used ones resident"""
+    key = (story_id, version)
+    with _versions_lock:
+        story = _story_versions.get(key)
+        if story is not None:
+            _story_versions.move_to_end(key)
+            return story
+
+    story = read_story_version(story_id, version)
+    if story is None:
+        return None
+
+    with _versions_lock:
+        _story_versions[key] = story
+        _story_versions.move_to_end(key)
+        while len(_story_versions) > settings.STORY_VERSION_CACHE_SIZE:
+            _story_versions.popitem(last=False)
+    return story
+
+
+def migrate_state(state, story):
+    """
+    Move a session pinned to an older version onto `story` (the current
+    version) using the author's scene mapping for that older version.
+
+    story["migrations"][old_version] maps old scene ids to new ones; scenes
+    it leaves out keep their id if it still exists, and a mapping to None
+    keeps the player on the old version. Variables the new version doesn't
+    declare are dropped. Returns True if the state was migrated.
+    """
+    mapping = story["migrations"].get(state.story_version)
+    if mapping is None:
+        return False
+
+    new_scene_id = mapping.get(state.current_scene_id, state.current_scene_id)
+    if new_scene_id is None or new_scene_id not in story["scenes"]:
+        return False
+
+    attributes = set(story["attributes"])
+    state.variables = {
+        name: value for name, value in state.variables.items() if name in attributes
+    }
+    state.current_scene_id = new_scene_id
+    state.story_version = story["version"]
+    return True
+
+
+def load_stories(archive=True):
+    """
+    Load every registered story, from the snapshot when one is available.
+    Versions are normally archived at release time (archive_story_versions);
+    archiving here as well covers deployments that skip that step.
+    """
+    snapshot = read_snapshot(getattr(settings, 'STORY_SNAPSHOT', None))
+    if snapshot is not None:
+        _compiled_stories.update(snapshot)
+    for story_id, builder in STORY_BUILDERS.items():
+        if story_id not in _compiled_stories:
+            _compiled_stories[story_id] = compile_story(builder())
+    if archive:
+        for story_id, story in _compiled_stories.items():
+            try:
+                archive_story_version(story_id, story)
+            except ValueError as exc:
+                logger.error("%s", exc)
+    return _compiled_stories
+
+
+def read_snapshot(path):
+    """Read compiled stories from a snapshot file, or None if unusable"""
+    if not path or not Path(path).is_file():
+        return None
+    with open(path, 'rb') as fh:
+        try:
+            payload = pickle.load(fh)
+        except (pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            return None
+    if payload.get("format") != SNAPSHOT_FORMAT:
+        return None
+    return payload["stories"]
+
+
+def write_snapshot(path):
+    """Compile every registered story and serialize them to a snapshot file"""
+    stories = {
+        story_id: compile_story(builder())
+        for story_id, builder in STORY_BUILDERS.items()
+    }
+    path = Path(path)
+    tmp_path = path.with_suffix(path.suffix + '.tmp')
+    with open(tmp_path, 'wb') as fh:
+        pickle.dump({"format": SNAPSHOT_FORMAT, "stories": stories}, fh,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+    tmp_path.replace(path)
+    return stories
+
+
+def reset_stories():
+    """Drop every cached story so the next access rebuilds it"""
+    _compiled_stories.clear()
+    with _versions_lock:
+        _story_versions.clear()
+
+
+def version_path(story_id, version):
+    return Path(settings.STORY_VERSION_DIR) / str(story_id) / f"{version}.json"
+
+
+def archive_story_version(story_id, story):
+    """
+    Write a story version to the archive unless it is already there.
+    Raises ValueError if the archive holds different content under the
+    same version: sessions pinned to it would silently play something else.
+    """
+    path = version_path(story_id, story["version"])
+    data = story_to_dict(story)
+    try:
+        with open(path, encoding='utf-8') as fh:
+            stored = json.load(fh)
+    except FileNotFoundError:
+        stored = None
+    except (OSError, ValueError) as exc:
+        logger.warning("Could not read archived story %s version %s: %s",
+                       story_id, story["version"], exc)
+        return
+    if stored is not None:
+        # Compare as JSON so int keys (migrations) match their stored strings
+        if stored != json.loads(json.dumps(data)):
+            raise ValueError(f"Story {story_id} version {story['version']} changed without "
+                             f"a version bump; archived copy at {path} differs")
+        return
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as fh:
+            json.dump(data, fh, ensure_ascii=False)
+        tmp_path.replace(path)
+    except OSError as exc:
+        logger.warning("Could not archive story %s version %s: %s",
+                       story_id, story["version"], exc)
+
+
+def archive_story_versions():
+    """Archive every registered story's current version; see archive_story_version"""
+    stories = load_stories(archive=False)
+    for story_id, story in stories.items():
+        archive_story_version(story_id, story)
+    return stories
+
+
+def read_story_version(story_id, version):
+    """Load and compile an archived version, or None if it isn't archived"""
+    try:
+        with open(version_path(story_id, version), encoding='utf-8') as fh:
+            data = json.load(fh)
+    except (OSError, ValueError):
+        return None
+    return compile_story(story_from_dict(data))
+
+
+def serialize_scene(scene):
+    """Full view of a scene, including conditions and effects"""
+    return {
+        "id": scene.id,
+        "background": scene.background,
+        "conditions": scene.conditions,
+        "choices": [serialize_choice(choice) for choice in scene.choices]
+    }
+
+
+def serialize_choice(choice):
+    data = {
+        "id": choice.id,
+        "text": choice.text,
+        "target_scene_id": choice.target_scene_id,
+        "conditions": choice.conditions,
+        "effects": choice.effects
+    }
+    if choice.branches:
+        data["branches"] = [
+            {
+                "target_scene_id": branch.target_scene_id,
+                "weight": branch.weight,
+                "modifiers": branch.modifiers
+            }
+            for branch in choice.branches
+        ]
+    return data
+
+
+def story_to_dict(story):
+    """JSON-safe form of a story version, independent of the compiled layout"""
+    return {
+        "version": story["version"],
+        "attributes": list(story["attributes"]),
+        "migrations": {
+            str(from_version): [[old, new] for old, new in mapping.items()]
+            for from_version, mapping in story["migrations"].items()
+        },
+        "scenes": [serialize_scene(scene) for scene in story["scenes"].values()],
+    }
+
+
+def story_from_dict(data):
+    """Rebuild raw story data from story_to_dict output"""
+    return {
+        "version": data["version"],
+        "attributes": data["attributes"],
+        "migrations": {
+            int(from_version): {old: new for old, new in pairs}
+            for from_version, pairs in data["migrations"].items()
+        },
+        "scenes": {
+            scene["id"]: Scene(
+                scene_id=scene["id"],
+                background=scene["background"],
+                choices=[
+                    Choice(choice["id"], choice["text"], choice["target_scene_id"],
+                           conditions=choice["conditions"], effects=choice["effects"],
+                           branches=[
+                               Branch(branch["target_scene_id"], branch["weight"],
+                                      branch["modifiers"])
+                               for branch in choice.get("branches", ())
+                           ])
+                    for choice in scene["choices"]
+                ],
+                conditions=scene["conditions"]
+            )
+            for scene in data["scenes"]
+        },
+    }
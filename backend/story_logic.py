@@ -1,28 +1,97 @@
+import sys
+
+# Canonical condition/effect maps, keyed by their items. Choices with the
+# same conditions or effects share one dict, so they must never be mutated.
+_shared_maps = {}
+
+
+def shared_map(mapping):
+    """Return the shared read-only dict equal to `mapping`"""
+    if not mapping:
+        mapping = {}
+    try:
+        key = frozenset(mapping.items())
+    except TypeError:
+        return dict(mapping)
+    shared = _shared_maps.get(key)
+    if shared is None:
+        shared = _shared_maps[key] = {sys.intern(k) if isinstance(k, str) else k: v
+                                      for k, v in mapping.items()}
+    return shared
+
+
+def intern_text(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
 class StoryState:
-    """Tracks the player's progress through a single story"""
-    def __init__(self, story_id, current_scene_id, variables=None, visited_scenes=None):
+    """
+    Tracks the player's progress through a single story.
+    `step` counts choices made and is echoed back by clients to detect
+    stale or duplicate submissions. `story_version` pins the session to
+    the story version it is playing (None means the current one). `seed`
+    drives weighted branches, so a session's outcomes can be replayed.
+    """
+    __slots__ = ('story_id', 'current_scene_id', 'variables', 'visited_scenes', 'step',
+                 'story_version', 'seed')
+
+    def __init__(self, story_id, current_scene_id, variables=None, visited_scenes=None, step=0,
+                 story_version=None, seed=None):
         self.story_id = story_id
         self.current_scene_id = current_scene_id
         self.variables = variables or {}
         self.visited_scenes = visited_scenes or []
+        self.step = step
+        self.story_version = story_version
+        self.seed = seed
+
+    def to_dict(self):
+        """Plain dict of the state, for storing in the session"""
+        return {name: getattr(self, name) for name in self.__slots__}
 
 class Scene:
     """
     Represents a scene in the story
     """
+    __slots__ = ('id', 'background', 'choices', 'conditions')
+
     def __init__(self, scene_id, background, choices, conditions=None):
         self.id = scene_id
-        self.background = background
+        self.background = intern_text(background)
         self.choices = choices or []
-        self.conditions = conditions or {}
+        self.conditions = shared_map(conditions)
 
 class Choice:
     """
-    Represents a choice available in a scene
+    Represents a choice available in a scene. A choice with `branches`
+    leads to one of them at random; `target_scene_id` is then the fallback
+    for when every branch weight is zero.
     """
-    def __init__(self, scene_id, text, target_scene_id, conditions=None, effects=None):
+    __slots__ = ('id', 'text', 'target_scene_id', 'conditions', 'effects', 'branches')
+
+    def __init__(self, scene_id, text, target_scene_id, conditions=None, effects=None,
+                 branches=None):
         self.id = scene_id
-        self.text = text
+        self.text = intern_text(text)
         self.target_scene_id = target_scene_id
-        self.conditions = conditions or {}
-        self.effects = effects or {}
\ No newline at end of file
+        self.conditions = shared_map(conditions)
+        self.effects = shared_map(effects)
+        self.branches = tuple(branches) if branches else ()
+
+class Branch:
+    """
+    One weighted outcome of a choice. Its weight is `weight` plus each
+    variable in `modifiers` times its coefficient, and never below zero.
+    """
+    __slots__ = ('target_scene_id', 'weight', 'modifiers')
+
+    def __init__(self, target_scene_id, weight, modifiers=None):
+        self.target_scene_id = target_scene_id
+        self.weight = weight
+        self.modifiers = shared_map(modifiers)
+
+    def weight_for(self, variables):
+        weight = self.weight
+        for var_name, coefficient in self.modifiers.items():
+            weight += coefficient * variables.get(var_name, 0)
+        return max(0, weight)
@@ -1,9 +1,23 @@
-from django.contrib import admin
+from django.apps import apps
 from django.urls import path
 from backend import views
 
 urlpatterns = [
-    path('admin/', admin.site.urls),
     path('api/start/', views.start_story, name='start_story'),
     path('api/choice/', views.process_choice, name='process_choice'),
+    path('api/path/', views.verify_path, name='verify_path'),
+    path('api/spectate/<slug:channel>/', views.spectate, name='spectate'),
+    path('api/stories/<int:story_id>/scenes/', views.story_scenes, name='story_scenes'),
+    path('api/stories/<int:story_id>/graph.ndjson', views.story_graph_stream,
+         name='story_graph_stream'),
+    path('api/stories/<int:story_id>/viewport/', views.story_viewport, name='story_viewport'),
+    path('api/stories/<int:story_id>/bundle/', views.story_bundle, name='story_bundle'),
+    path('assets/<str:filename>', views.serve_asset, name='serve_asset'),
+    path('api/ready/', views.readiness, name='readiness'),
 ]
+
+# The lean gameplay profile leaves the admin out entirely
+if apps.is_installed('django.contrib.admin'):
+    from django.contrib import admin
+
+    urlpatterns.insert(0, path('admin/', admin.site.urls))
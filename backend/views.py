@@ -1,96 +1,279 @@
-from django.http import JsonResponse
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.http import (
+    FileResponse, Http404, HttpResponse, HttpResponseNotModified, JsonResponse,
+    StreamingHttpResponse,
+)
 from django.views.decorators.csrf import ensure_csrf_cookie
 from django.middleware.csrf import get_token
+import bisect
+import itertools
 import json
-from .story_logic import StoryState, Scene, Choice
-
-# A simple sample story
-STORY_DATA = {
-    "attributes": ["trust", "security"],
-    "scenes": {
-        0: Scene(
-            scene_id=0,
-            background="/static/house_entrance.jpg",
-            choices=[
-                Choice(1, "Enter the house", 1, 
-                      effects={}),
-                Choice(2, "Don't enter, go to the barn", 3,
-                      effects={})
-            ]
-        ),
-        1: Scene(
-            scene_id=1,
-            background="/static/inside_house.jpg",
-            choices=[
-                Choice(3, "Trust the friend", 2,
-                      effects={"trust": 10, "security": 10}),
-                Choice(4, "Don't trust them, go outside", 3,
-                      effects={})
-            ]
-        ),
-        2: Scene(
-            scene_id=2,
-            background="/static/with_friend.jpg",
-            choices=[
-                Choice(5, "Gift him my watch", 5,
-                      effects={"trust": 20}),
-                Choice(6, "Don't gift the watch", 5,
-                      effects={})
-            ]
-        ),
-        3: Scene(
-            scene_id=3,
-            background="/static/barn.jpg",
-            choices=[
-                Choice(7, "Sleep in the barn", 6,
-                      effects={"trust": -5, "security": -10})
-            ]
-        ),
-        4: Scene(
-            scene_id=4,
-            background="/static/outside.jpg",
-            choices=[]
-        ),
-        5: Scene(
-            scene_id=5,
-            background="/static/friend_room.jpg",
-            choices=[
-                Choice(8, "Continue...", 7,
-                      conditions={"trust": 30, "security": 10}),
-                Choice(9, "Continue...", 8,
-                      conditions={})
-            ]
-        ),
-        6: Scene(
-            scene_id=6,
-            background="/static/barn_ending.jpg",
-            choices=[]
-        ),
-        7: Scene(
-            scene_id=7,
-            background="/static/separate_bed.jpg",
-            choices=[]
-        ),
-        8: Scene(
-            scene_id=8,
-            background="/static/couch.jpg",
-            choices=[]
-        )
-    }
-}
+import secrets
+from .admission import IN_STORY, NEW_SESSION, admission_control
+from .archive import archive_playthrough
+from .assets import asset_info, asset_path, asset_url
+from .bundles import get_bundle
+from . import sessions
+from .localization import get_story_text, negotiate_locale
+from .spectators import broadcaster
+from .story_logic import StoryState
+from .stories import (
+    STORY_BUILDERS, apply_choice, get_available_choices, get_story, migrate_state,
+    offered_choice_ids, scenes_within, serialize_scene,
+)
+# Choice filtering moved into the engine; keep it importable from here
+from .stories import check_conditions, has_conditional_flow  # noqa: F401
+
+
+def __getattr__(name):
+    # STORY_DATA used to be built at import time; keep it reachable lazily
+    if name == 'STORY_DATA':
+        return get_story(0)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
+
+@admission_control(NEW_SESSION)
 @ensure_csrf_cookie
 def start_story(request):
     """Initialize a new story session and return the first scene"""
-    initial_state = StoryState(story_id=0, current_scene_id=0)
-    request.session['game_state'] = initial_state.__dict__
+    story = get_story(0)
+    initial_state = StoryState(story_id=0, current_scene_id=0, story_version=story["version"],
+                               seed=secrets.randbits(32))
+    request.session['game_state'] = initial_state.to_dict()
+    request.session.pop('last_response', None)
+    # A finished playthrough shortened the session's lifetime; restore it
+    request.session.set_expiry(None)
+    channel = None
+    if spectating_available(request):
+        channel = request.session.get('spectator_channel') or secrets.token_urlsafe(12)
+        request.session['spectator_channel'] = channel
+    else:
+        request.session.pop('spectator_channel', None)
     
-    current_scene = STORY_DATA["scenes"][initial_state.current_scene_id]
-    return build_scene_response(request, current_scene, initial_state.variables)
+    current_scene = story["scenes"][initial_state.current_scene_id]
+    text = get_story_text(initial_state.story_id,
+                          negotiate_locale(request, initial_state.story_id,
+                                           version=story["version"]),
+                          story["version"])
+    payload = build_scene_payload(request, current_scene, initial_state.variables,
+                                  initial_state.step, text)
+    if channel:
+        broadcaster.publish(channel, spectator_event(payload))
+        payload["spectator_channel"] = channel
+    return JsonResponse(shape_payload(request, payload, get_response_options(request)))
 
+@admission_control(IN_STORY)
 @ensure_csrf_cookie
 def process_choice(request):
     """POST endpoint - processes player choice and returns next scene"""
+    turn = begin_turn(request)
+    if isinstance(turn, HttpResponse):
+        return turn
+    state, story, data, options, stored = turn
+    choice_id = data.get('choice_id')
+    current_scene_id = data.get('current_scene_id')
+
+    # Validate choice exists in current scene and apply it
+    if story["scenes"].get(current_scene_id) is None:
+        return JsonResponse({"error": "Invalid scene"}, status=400)
+    
+    previous_variables = dict(state.variables)
+    if apply_choice(story, state, current_scene_id, choice_id) is None:
+        return JsonResponse({"error": "Invalid choice"}, status=400)
+
+    turn = finish_turn(request, state, story, data, options, stored)
+    if isinstance(turn, HttpResponse):
+        return turn
+    payload, migrated = turn
+    # The client's echoed step is the state we started from, so it already
+    # holds previous_variables and only needs what this choice changed
+    known_variables = previous_variables if data.get('step') is not None and not migrated else None
+    return JsonResponse(shape_payload(request, payload, options, known_variables))
+
+@admission_control(IN_STORY)
+@ensure_csrf_cookie
+def verify_path(request):
+    """POST endpoint - verifies and applies a path the client played from a bundle"""
+    turn = begin_turn(request)
+    if isinstance(turn, HttpResponse):
+        return turn
+    state, story, data, options, stored = turn
+    moves = data.get('path')
+    if not isinstance(moves, list) or not moves:
+        return JsonResponse({"error": "Path must be a non-empty list"}, status=400)
+    if len(moves) > settings.STORY_PATH_MAX_CHOICES:
+        return JsonResponse({"error": "Path too long"}, status=400)
+
+    # Apply the longest valid prefix; the response tells the client where
+    # the server's state diverged from its own
+    rejected = None
+    for index, move in enumerate(moves):
+        error = check_move(story, state, move)
+        if error:
+            rejected = {"index": index, "error": error}
+            break
+        apply_choice(story, state, move['current_scene_id'], move['choice_id'])
+
+    if rejected and rejected["index"] == 0:
+        return JsonResponse({"error": rejected["error"], "rejected": rejected}, status=400)
+
+    outcome = {"accepted": rejected["index"] if rejected else len(moves)}
+    if rejected:
+        outcome["rejected"] = rejected
+    turn = finish_turn(request, state, story, data, options, stored, outcome)
+    if isinstance(turn, HttpResponse):
+        return turn
+    payload, _ = turn
+    return JsonResponse(shape_payload(request, payload, options))
+
+async def spectate(request, channel):
+    """GET endpoint - streams a playthrough to spectators as server-sent events"""
+    if not spectating_available(request):
+        return JsonResponse({"error": "Spectating is not available on this server"},
+                            status=501)
+    response = StreamingHttpResponse(broadcaster.stream(channel),
+                                     content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+def serve_asset(request, filename):
+    """GET endpoint - serves a content-hashed scene asset with immutable caching"""
+    # wsgiref's file wrapper reads the file through Python (no sendfile);
+    # production proxies serve STORY_ASSET_ROOT themselves
+    path = asset_path(filename)
+    if path is None:
+        raise Http404("Unknown asset")
+
+    try:
+        response = FileResponse(open(path, 'rb'))
+    except FileNotFoundError:
+        raise Http404("Unknown asset")
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+def story_scenes(request, story_id):
+    """GET endpoint - one cursor-paginated page of a story's scene graph"""
+    story = get_story(story_id)
+    if story is None:
+        return JsonResponse({"error": "Unknown story"}, status=404)
+
+    try:
+        limit = min(max(int(request.GET.get('limit', 100)), 1), 1000)
+        cursor = request.GET.get('cursor')
+        cursor = int(cursor) if cursor is not None else None
+    except ValueError:
+        return JsonResponse({"error": "Invalid limit or cursor"}, status=400)
+
+    order = story["scene_order"]
+    start = bisect.bisect_right(order, cursor) if cursor is not None else 0
+    page = order[start:start + limit]
+    has_more = start + limit < len(order)
+
+    return JsonResponse({
+        "scenes": [serialize_scene(story["scenes"][scene_id]) for scene_id in page],
+        "next_cursor": page[-1] if has_more else None
+    })
+
+def story_graph_stream(request, story_id):
+    """GET endpoint - streams a whole story as NDJSON, one scene per line"""
+    story = get_story(story_id)
+    if story is None:
+        return JsonResponse({"error": "Unknown story"}, status=404)
+
+    def lines():
+        yield json.dumps({"attributes": story["attributes"],
+                          "scene_count": len(story["scene_order"])}) + "\n"
+        for scene_id in story["scene_order"]:
+            yield json.dumps(serialize_scene(story["scenes"][scene_id])) + "\n"
+
+    return StreamingHttpResponse(lines(), content_type='application/x-ndjson')
+
+def story_viewport(request, story_id):
+    """GET endpoint - scenes within K hops of a scene, for the editor viewport"""
+    story = get_story(story_id)
+    if story is None:
+        return JsonResponse({"error": "Unknown story"}, status=404)
+
+    try:
+        scene_id = int(request.GET['scene'])
+        hops = min(max(int(request.GET.get('hops', 2)), 0), 50)
+        limit = min(max(int(request.GET.get('limit', 500)), 1), 5000)
+    except (KeyError, ValueError):
+        return JsonResponse({"error": "Invalid scene, hops or limit"}, status=400)
+    if scene_id not in story["scenes"]:
+        return JsonResponse({"error": "Invalid scene"}, status=400)
+
+    # One scene past the limit tells a cut-off neighbourhood from one that
+    # has exactly `limit` scenes
+    distances = scenes_within(story, scene_id, hops, limit + 1)
+    truncated = len(distances) > limit
+    return JsonResponse({
+        "center": scene_id,
+        "hops": hops,
+        "scenes": [
+            dict(serialize_scene(story["scenes"][found_id]), distance=distance)
+            for found_id, distance in itertools.islice(distances.items(), limit)
+            if found_id in story["scenes"]
+        ],
+        "truncated": truncated
+    })
+
+def story_bundle(request, story_id):
+    """GET endpoint - precompressed bundle of the scenes within K choices of a scene"""
+    try:
+        scene_id = int(request.GET['scene'])
+        hops = min(max(int(request.GET.get('hops', settings.STORY_BUNDLE_HOPS)), 1),
+                   settings.STORY_BUNDLE_MAX_HOPS)
+        version = request.GET.get('version')
+        version = int(version) if version is not None else None
+    except (KeyError, ValueError):
+        return JsonResponse({"error": "Invalid scene, hops or version"}, status=400)
+
+    story = get_story(story_id, version)
+    if story is None:
+        return JsonResponse({"error": "Unknown story"}, status=404)
+    if scene_id not in story["scenes"]:
+        return JsonResponse({"error": "Invalid scene"}, status=400)
+
+    text = get_story_text(story_id, negotiate_locale(request, story_id, version=story["version"]),
+                          story["version"])
+    bundle = get_bundle(story_id, story, scene_id, hops, text)
+    if bundle.etag in request.META.get('HTTP_IF_NONE_MATCH', '').replace(' ', '').split(','):
+        response = HttpResponseNotModified()
+    elif 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+        response = HttpResponse(bundle.compressed, content_type='application/json')
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = HttpResponse(bundle.body(), content_type='application/json')
+    response['ETag'] = bundle.etag
+    response['Vary'] = 'Accept-Encoding, Accept-Language'
+    # A pinned version never changes; the current one can be replaced on reload
+    max_age = 31536000 if version is not None else 300
+    response['Cache-Control'] = f'public, max-age={max_age}'
+    return response
+
+def readiness(request):
+    """GET endpoint - reports whether this worker can serve gameplay traffic"""
+    try:
+        connection.ensure_connection()
+    except DatabaseError:
+        return JsonResponse({"ready": False, "error": "Database unavailable"}, status=503)
+
+    if any(get_story(story_id) is None for story_id in STORY_BUILDERS):
+        return JsonResponse({"ready": False, "error": "Stories not loaded"}, status=503)
+
+    return JsonResponse({"ready": True, "stories": len(STORY_BUILDERS)})
+
+# Helper functions
+def begin_turn(request):
+    """
+    Load the session and request body shared by the gameplay POST endpoints.
+    Returns (state, story, data, options, stored), or a response to send
+    instead: an error, or the replayed last response for a duplicate submit.
+    `stored` is the session row finish_turn may save over.
+    """
     if request.method != 'POST':
         return JsonResponse({"error": "POST required"}, status=405)
     
@@ -100,89 +283,218 @@ def process_choice(request):
         return JsonResponse({"error": "No active game session"}, status=400)
     
     state = StoryState(**state_dict)
+    if state.seed is None:
+        # Sessions started before weighted branches existed
+        state.seed = secrets.randbits(32)
     
     # Get choice data from request
     try:
         data = json.loads(request.body)
     except json.JSONDecodeError:
         return JsonResponse({"error": "Invalid JSON"}, status=400)
-    choice_id = data.get('choice_id')
-    current_scene_id = data.get('current_scene_id')
-    
-    # Validate choice exists in current scene
-    current_scene = STORY_DATA["scenes"].get(current_scene_id)
-    if not current_scene:
-        return JsonResponse({"error": "Invalid scene"}, status=400)
-    
-    selected_choice = next((c for c in current_scene.choices if c.id == choice_id), None)
-    if not selected_choice:
-        return JsonResponse({"error": "Invalid choice"}, status=400)
+    if not isinstance(data, dict):
+        return JsonResponse({"error": "Invalid JSON"}, status=400)
+    options = get_response_options(request, data)
+
+    # Clients echo the step they were shown. Anything older is a double
+    # submit or retry racing a request that already advanced the story,
+    # so replay what that request returned instead of applying it again.
+    step = data.get('step')
+    if step is not None and step != state.step:
+        last_response = request.session.get('last_response')
+        if isinstance(step, int) and step < state.step and last_response:
+            response = JsonResponse(shape_payload(request, last_response, options))
+            response['X-Story-Replay'] = '1'
+            return response
+        return JsonResponse({"error": "Stale or unknown step"}, status=409)
+
+    # Two submits for the same step can both get this far. finish_turn only
+    # saves over the row read here, so the second to save replays the first
+    stored = sessions.stored_data(request.session)
+    if stored is not None and \
+            request.session.decode(stored).get('game_state', {}).get('step') != state.step:
+        return replay_stored(request, options)
     
-    # Apply effects to variables
-    if len(selected_choice.effects) > 0:
-        for var_name, value in selected_choice.effects.items():
-            state.variables[var_name] = state.variables.get(var_name, 0) + value
+    # Sessions stay on the story version they started on
+    story = get_story(state.story_id, state.story_version)
+    if story is None:
+        story = get_story(state.story_id)
+        if not migrate_state(state, story):
+            return JsonResponse({"error": "Story version no longer available"}, status=409)
+
+    return state, story, data, options, stored
 
-    # Update state and move to next scene
-    state.visited_scenes.append(current_scene_id)
-    state.current_scene_id = selected_choice.target_scene_id
-    request.session['game_state'] = state.__dict__
+def finish_turn(request, state, story, data, options, stored, extra=None):
+    """
+    Save the state after the player's choices and build the response body,
+    with `extra` fields added. Returns (payload, migrated), or the winner's
+    replayed response if a concurrent submit saved first.
+    """
+    # Move onto the current version if its author mapped the new scene
+    migrated = False
+    if state.story_version != get_story(state.story_id)["version"]:
+        migrated = migrate_state(state, get_story(state.story_id))
+        if migrated:
+            story = get_story(state.story_id)
 
     # Check if story ends
-    next_scene = STORY_DATA["scenes"].get(state.current_scene_id)
-    if len(next_scene.choices) == 0:
-        return JsonResponse({
+    next_scene = story["scenes"].get(state.current_scene_id)
+    text = get_story_text(state.story_id,
+                          negotiate_locale(request, state.story_id, data, story["version"]),
+                          story["version"])
+    ending = len(next_scene.choices) == 0
+    if ending:
+        payload = {
             "ending": True,
-            "message": "The story concludes here.",
+            "message": text.message("ending"),
             "final_variables": state.variables,
-            "path": state.visited_scenes
-        })
-    
-    return build_scene_response(request, next_scene, state.variables)
+            "path": list(state.visited_scenes),
+            "step": state.step,
+            "locale": text.locale
+        }
+        request.session.set_expiry(settings.FINISHED_SESSION_TTL)
+    else:
+        payload = build_scene_payload(request, next_scene, state.variables, state.step, text)
+    if extra:
+        payload.update(extra)
 
-# Helper functions
-def build_scene_response(request, scene, variables):
-    """Build a JSON response for a scene with filtered choices"""
-    available_choices = get_available_choices(scene, variables)
+    game_state = state.to_dict()
+    if ending:
+        # Finished playthroughs move to the archive; the session keeps only
+        # what a duplicate submit needs and expires soon after
+        game_state['visited_scenes'] = []
+    request.session['game_state'] = game_state
+    request.session['last_response'] = payload
+    if not sessions.save_if_unchanged(request.session, stored):
+        return replay_stored(request, options)
 
-    return JsonResponse({
+    if ending:
+        archive_playthrough(state, text.locale)
+    channel = request.session.get('spectator_channel')
+    if channel:
+        broadcaster.publish(channel, spectator_event(payload))
+    return payload, migrated
+
+def replay_stored(request, options):
+    """Replay the response saved by whichever request last advanced the session"""
+    # Nothing this request changed may be saved over the winner's state
+    request.session.modified = False
+    stored = sessions.stored_data(request.session)
+    last_response = request.session.decode(stored).get('last_response') if stored else None
+    if not last_response:
+        return JsonResponse({"error": "Stale or unknown step"}, status=409)
+    response = JsonResponse(shape_payload(request, last_response, options))
+    response['X-Story-Replay'] = '1'
+    return response
+
+def check_move(story, state, move):
+    """Why a move of a submitted path can't be taken, or None if it can"""
+    if not isinstance(move, dict):
+        return "Invalid move"
+    scene = story["scenes"].get(state.current_scene_id)
+    if not scene.choices:
+        return "Story has ended"
+    if move.get('current_scene_id') != state.current_scene_id:
+        return "Scene does not match"
+    if move.get('choice_id') not in offered_choice_ids(scene, state.variables):
+        return "Invalid choice"
+    return None
+
+def build_scene_payload(request, scene, variables, step, text=None):
+    """Build the response body for a scene with filtered choices"""
+    available_choices = get_available_choices(scene, variables, text)
+
+    return {
         "csrf_token": get_token(request),
         "scene": {
             "id": scene.id,
-            "background": scene.background,
+            "background": asset_url(scene.background),
+            "background_info": asset_info(scene.background),
             "choices": available_choices
         },
-        "variables": variables
-    })
+        "variables": variables,
+        "step": step,
+        "locale": text.locale if text else settings.STORY_DEFAULT_LOCALE
+    }
+
+def spectating_available(request):
+    """Whether this server can stream spectators, so channels are worth handing out"""
+    # A WSGI server (serve, runserver) buffers an async stream to the end,
+    # holding a worker forever; and fan-out is per process, so it also
+    # takes a single-process ASGI server, which deployments opt into
+    return settings.SPECTATORS_ENABLED and 'wsgi.input' not in request.META
+
+def spectator_event(payload):
+    """Strip per-player fields from a response before broadcasting it"""
+    return {key: value for key, value in payload.items() if key != "csrf_token"}
+
+def get_response_options(request, data=None):
+    """Read the negotiated response mode and field projection.
+
+    `mode` is "full" (default) or "delta"; `fields` is a list or
+    comma-separated string of top-level keys or `scene.<key>` paths.
+    Both come from the JSON body when given, else from the query string.
+    """
+    def read(key):
+        if isinstance(data, dict) and key in data:
+            return data[key]
+        return request.GET.get(key)
+
+    fields = read('fields')
+    if isinstance(fields, str):
+        fields = [field.strip() for field in fields.split(',') if field.strip()]
+    elif not isinstance(fields, list):
+        fields = None
+
+    return {"delta": read('mode') == 'delta', "fields": fields}
+
+def shape_payload(request, payload, options, known_variables=None):
+    """Apply delta encoding and field projection to a response body.
+
+    In delta mode the CSRF token is left out unless it rotated during this
+    request, and when the client's known variables are available only the
+    changed ones are sent as `variables_changed`.
+    """
+    if options["delta"]:
+        payload = dict(payload)
+        if not csrf_token_rotated(request):
+            payload.pop("csrf_token", None)
+        if known_variables is not None and "variables" in payload:
+            variables = payload.pop("variables")
+            payload["variables_changed"] = {
+                name: value for name, value in variables.items()
+                if known_variables.get(name) != value
+            }
+
+    if options["fields"]:
+        payload = project_fields(payload, options["fields"])
+
+    return payload
+
+def project_fields(payload, fields):
+    """Keep only the requested fields; `step` and `ending` are always kept"""
+    projected = {key: payload[key] for key in ("step", "ending") if key in payload}
+    nested = []
+    for field in fields:
+        key, _, subkey = field.partition('.')
+        if key == "variables" and "variables_changed" in payload:
+            key = "variables_changed"
+        if key not in payload:
+            continue
+        if subkey:
+            nested.append((key, subkey))
+        else:
+            projected[key] = payload[key]
+
+    for key, subkey in nested:
+        value = payload[key]
+        if projected.get(key) is value or not isinstance(value, dict) or subkey not in value:
+            continue
+        projected.setdefault(key, {})[subkey] = value[subkey]
+
+    return projected
 
-def get_available_choices(scene, variables):
-    """Get filtered list of available choices based on conditions"""
-    available_choices = []
-    for choice in scene.choices:
-        is_available = check_conditions(choice.conditions, variables)
-        available_choices.append({
-            "id": choice.id,
-            "text": choice.text,
-            "available": is_available
-        })
-
-    # For conditional flow scenes, show only the first matching choice
-    if len(available_choices) > 1 and has_conditional_flow(scene.choices):
-        for i, choice in enumerate(scene.choices):
-            if check_conditions(choice.conditions, variables):
-                return [available_choices[i]]
-        # No conditional choices matched, return the fallback (last choice)
-        return [available_choices[-1]]
-
-    return available_choices
-
-def check_conditions(conditions, variables):
-    """Evaluate if all conditions are met with current variables"""
-    for var_name, required_value in conditions.items():
-        if variables.get(var_name, 0) < required_value:
-            return False
-    return True
-
-def has_conditional_flow(choices):
-    """Check if scene has conditional flow pattern (conditional choice followed by fallback)"""
-    return len(choices) >= 2 and choices[0].conditions and not choices[-1].conditions
+def csrf_token_rotated(request):
+    """Check if the CSRF secret differs from the one the client sent"""
+    sent = request.COOKIES.get(settings.CSRF_COOKIE_NAME)
+    return not sent or sent != request.META.get("CSRF_COOKIE")
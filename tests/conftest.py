@@ -4,6 +4,7 @@ Configuration file for pytest
 import os
 import sys
 import django
+import pytest
 
 # Add the project directory to the Python path
 sys.path.insert(0, os.path.abspath(os.path.dirname(__file__) + '/..'))
@@ -11,3 +12,20 @@ sys.path.insert(0, os.path.abspath(os.path.dirname(__file__) + '/..'))
 # Setup Django settings
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 django.setup()
+
+
+@pytest.fixture(autouse=True)
+def reset_admission_control():
+    """Give every test fresh per-client and concurrency limits"""
+    from backend.admission import reset_admission
+    reset_admission()
+    yield
+
+
+@pytest.fixture(autouse=True)
+def isolated_data_dirs(tmp_path):
+    """Keep archived playthroughs and story versions out of the working tree"""
+    from django.test import override_settings
+    with override_settings(PLAYTHROUGH_ARCHIVE_DIR=tmp_path / 'archive',
+                           STORY_VERSION_DIR=tmp_path / 'story_versions'):
+        yield
@@ -1,7 +1,7 @@
 """
 Test fixtures and sample data for tests
 """
-from backend.story_logic import Scene, Choice
+from backend.story_logic import Branch, Scene, Choice
 
 
 def create_test_story():
@@ -86,3 +86,17 @@ def create_empty_story():
             )
         }
     }
+
+
+def create_branching_story():
+    """Create a story whose first choice leads to scene 1 or 2 at random"""
+    story = create_test_story()
+    story["scenes"][0].choices.append(
+        Choice(5, "Roll the dice", 3, effects={"courage": 1},
+               branches=[Branch(1, 70), Branch(2, 30)])
+    )
+    story["scenes"][0].choices.append(
+        Choice(6, "Trust your luck", 3,
+               branches=[Branch(1, 0, modifiers={"trust": 1}), Branch(2, 10)])
+    )
+    return story
@@ -0,0 +1,180 @@
+"""
+Tests for admission control on the gameplay endpoints
+"""
+import json
+import time
+from django.test import Client, RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from backend.admission import ClientBuckets, client_address, queue_time, reset_admission
+
+
+class TestQueueTime(TestCase):
+    """Test cases for queue_time"""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def test_unknown(self):
+        """Test requests without a timestamp have no queue time"""
+        self.assertIsNone(queue_time(self.factory.get('/')))
+
+    def test_accepted_at(self):
+        """Test the time serve accepted the connection is used"""
+        request = self.factory.get('/', **{'backend.accepted_at': time.time() - 2})
+
+        self.assertAlmostEqual(queue_time(request), 2, delta=0.5)
+
+    def test_proxy_header_units(self):
+        """Test X-Request-Start is read in seconds, milliseconds or microseconds"""
+        started = time.time() - 3
+        for value in (f't={started:.3f}', str(int(started * 1000)), str(int(started * 1e6))):
+            request = self.factory.get('/', HTTP_X_REQUEST_START=value)
+            self.assertAlmostEqual(queue_time(request), 3, delta=0.5)
+
+    def test_longest_wait_wins(self):
+        """Test a proxy's earlier start time counts over the worker's own"""
+        request = self.factory.get('/', HTTP_X_REQUEST_START=f't={time.time() - 5}',
+                                   **{'backend.accepted_at': time.time() - 1})
+
+        self.assertAlmostEqual(queue_time(request), 5, delta=0.5)
+
+
+class TestClientAddress(TestCase):
+    """Test cases for client_address"""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def test_direct_client(self):
+        """Test X-Forwarded-For is ignored from untrusted peers"""
+        request = self.factory.get('/', REMOTE_ADDR='203.0.113.9',
+                                   HTTP_X_FORWARDED_FOR='198.51.100.1')
+
+        self.assertEqual(client_address(request), '203.0.113.9')
+
+    @override_settings(ADMISSION_TRUSTED_PROXIES=['10.0.0.1', '10.0.0.2'])
+    def test_behind_trusted_proxies(self):
+        """Test the nearest address not added by a trusted proxy is used"""
+        request = self.factory.get(
+            '/', REMOTE_ADDR='10.0.0.1',
+            HTTP_X_FORWARDED_FOR='1.2.3.4, 198.51.100.1, 10.0.0.2'
+        )
+
+        self.assertEqual(client_address(request), '198.51.100.1')
+
+
+class TestClientBuckets(TestCase):
+    """Test cases for ClientBuckets"""
+
+    def test_clients_limited_independently(self):
+        """Test one client running out of tokens does not affect another"""
+        buckets = ClientBuckets(rate=1, burst=2, max_clients=10)
+
+        self.assertEqual(buckets.try_acquire('a'), 0)
+        self.assertEqual(buckets.try_acquire('a'), 0)
+        self.assertGreater(buckets.try_acquire('a'), 0)
+        self.assertEqual(buckets.try_acquire('b'), 0)
+
+    def test_oldest_clients_evicted(self):
+        """Test only the most recent clients keep buckets"""
+        buckets = ClientBuckets(rate=1, burst=1, max_clients=2)
+        for client in ('a', 'b', 'c'):
+            buckets.try_acquire(client)
+
+        self.assertEqual(list(buckets.buckets), ['b', 'c'])
+
+
+@override_settings(ADMISSION_CLIENT_RATE=0.5, ADMISSION_CLIENT_BURST=3)
+class TestRateLimitedViews(TestCase):
+    """Test cases for per-client limits on the views"""
+
+    def setUp(self):
+        reset_admission()
+
+    def test_429_with_retry_after(self):
+        """Test a client over its rate gets 429 with Retry-After"""
+        client = Client()
+        statuses = [client.get(reverse('start_story')).status_code for _ in range(3)]
+        response = client.get(reverse('start_story'))
+
+        self.assertEqual(statuses, [200, 200, 200])
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(int(response['Retry-After']), 2)
+        self.assertEqual(response.json(), {'error': 'Too many requests'})
+
+    @override_settings(ADMISSION_BYPASS_TOKEN='load')
+    def test_bypass_token(self):
+        """Test requests with the bypass token skip the per-client limit"""
+        client = Client(HTTP_X_ADMISSION_TOKEN='load')
+        statuses = {client.get(reverse('start_story')).status_code for _ in range(5)}
+        wrong = Client(HTTP_X_ADMISSION_TOKEN='guess')
+        limited = [wrong.get(reverse('start_story')).status_code for _ in range(4)]
+
+        self.assertEqual(statuses, {200})
+        self.assertEqual(limited[-1], 429)
+
+    def test_other_clients_unaffected(self):
+        """Test limits are per client address"""
+        for _ in range(4):
+            Client().get(reverse('start_story'))
+
+        response = Client(REMOTE_ADDR='10.0.0.2').get(reverse('start_story'))
+
+        self.assertEqual(response.status_code, 200)
+
+
+class TestDefaultAdmission(TestCase):
+    """Test cases for admission control with the shipped settings"""
+
+    def test_no_per_client_limit_by_default(self):
+        """Test players behind one address (a load balancer) are not throttled together"""
+        reset_admission()
+        client = Client()
+        statuses = {client.get(reverse('start_story')).status_code for _ in range(40)}
+
+        self.assertEqual(statuses, {200})
+
+
+@override_settings(ADMISSION_CLIENT_RATE=0, ADMISSION_MAX_QUEUE_NEW_SESSION=0.5,
+                   ADMISSION_MAX_QUEUE_IN_STORY=2)
+class TestLoadShedding(TestCase):
+    """Test cases for queue-time shedding on the views"""
+
+    def setUp(self):
+        reset_admission()
+
+    def queued(self, seconds):
+        return {'backend.accepted_at': time.time() - seconds}
+
+    def choose(self, client, **extra):
+        return client.post(
+            reverse('process_choice'),
+            data=json.dumps({'choice_id': 1, 'current_scene_id': 0}),
+            content_type='application/json', **extra
+        )
+
+    def test_overloaded_worker_prefers_players_in_story(self):
+        """Test new sessions are shed after a wait that choices still survive"""
+        client = Client()
+        client.get(reverse('start_story'))
+
+        start = Client().get(reverse('start_story'), **self.queued(1))
+        choice = self.choose(client, **self.queued(1))
+
+        self.assertEqual(start.status_code, 503)
+        self.assertEqual(start['Retry-After'], '1')
+        self.assertEqual(choice.status_code, 200)
+
+    def test_long_queued_choice_shed(self):
+        """Test choices are shed too once they waited past their limit"""
+        client = Client()
+        client.get(reverse('start_story'))
+
+        self.assertEqual(self.choose(client, **self.queued(3)).status_code, 503)
+        self.assertEqual(client.session['game_state']['step'], 0)
+
+    def test_prompt_requests_served(self):
+        """Test requests picked up quickly are never shed"""
+        response = Client().get(reverse('start_story'), **self.queued(0.01))
+
+        self.assertEqual(response.status_code, 200)
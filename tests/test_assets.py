@@ -0,0 +1,110 @@
+"""
+Tests for the hashed scene-asset manifest and asset serving
+"""
+import shutil
+import struct
+import tempfile
+import unittest
+from pathlib import Path
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+from backend import assets
+from backend.assets import build_manifest, image_dimensions
+from tests.fixtures import create_test_story
+
+
+def png_bytes(width, height):
+    """Smallest header image_dimensions needs to read a PNG"""
+    return (b'\x89PNG\r\n\x1a\n' + b'\x00\x00\x00\x0dIHDR'
+            + struct.pack('>II', width, height) + b'\x08\x02\x00\x00\x00')
+
+
+def jpeg_bytes(width, height):
+    """JPEG with an APP0 segment followed by a baseline frame header"""
+    app0 = b'\xff\xe0' + struct.pack('>H', 16) + b'JFIF\x00' + bytes(9)
+    sof0 = b'\xff\xc0' + struct.pack('>HBHH', 17, 8, height, width) + bytes(10)
+    return b'\xff\xd8' + app0 + sof0 + b'\xff\xd9'
+
+
+class TestImageDimensions(unittest.TestCase):
+    """Test cases for image_dimensions"""
+
+    def test_png(self):
+        self.assertEqual(image_dimensions(png_bytes(640, 480)), (640, 480))
+
+    def test_jpeg(self):
+        self.assertEqual(image_dimensions(jpeg_bytes(1920, 1080)), (1920, 1080))
+
+    def test_gif(self):
+        self.assertEqual(image_dimensions(b'GIF89a' + struct.pack('<HH', 32, 16)), (32, 16))
+
+    def test_unknown_format(self):
+        self.assertEqual(image_dimensions(b'not an image'), (None, None))
+
+
+class TestAssetManifest(TestCase):
+    """Test cases for building and serving hashed assets"""
+
+    def setUp(self):
+        self.source_dir = Path(tempfile.mkdtemp())
+        self.output_dir = Path(tempfile.mkdtemp())
+        (self.source_dir / 'start.jpg').write_bytes(jpeg_bytes(800, 600))
+        (self.source_dir / 'left.jpg').write_bytes(jpeg_bytes(800, 600))
+        self.settings = override_settings(STORY_ASSET_DIRS=[self.source_dir],
+                                          STORY_ASSET_ROOT=self.output_dir)
+        self.settings.enable()
+        assets.reset_manifest()
+
+    def tearDown(self):
+        self.settings.disable()
+        assets.reset_manifest()
+        shutil.rmtree(self.source_dir)
+        shutil.rmtree(self.output_dir)
+
+    def test_build_manifest(self):
+        """Test backgrounds are hashed, measured and copied"""
+        manifest, missing = build_manifest([create_test_story()])
+
+        self.assertEqual(missing, ['/static/end.jpg', '/static/right.jpg'])
+        entry = manifest['/static/start.jpg']
+        self.assertRegex(entry['file'], r'^start\.[0-9a-f]{12}\.jpg$')
+        self.assertEqual(entry['url'], '/assets/' + entry['file'])
+        self.assertEqual((entry['width'], entry['height']), (800, 600))
+        self.assertEqual(entry['bytes'], len(jpeg_bytes(800, 600)))
+        self.assertTrue((self.output_dir / entry['file']).is_file())
+
+    def test_identical_content_shares_hash(self):
+        """Test the hash depends only on file content"""
+        manifest, _ = build_manifest([create_test_story()])
+
+        self.assertEqual(manifest['/static/start.jpg']['sha256'],
+                         manifest['/static/left.jpg']['sha256'])
+
+    def test_serves_with_immutable_cache(self):
+        """Test hashed assets are served with long-lived cache headers"""
+        manifest, _ = build_manifest([create_test_story()])
+
+        response = Client().get(manifest['/static/start.jpg']['url'])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(b''.join(response.streaming_content), jpeg_bytes(800, 600))
+
+    def test_unknown_asset_not_found(self):
+        """Test files outside the manifest are not served"""
+        build_manifest([create_test_story()])
+
+        response = Client().get(reverse('serve_asset', args=['manifest.json']))
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_scene_response_uses_hashed_url(self):
+        """Test scene backgrounds are rewritten to manifest URLs"""
+        (self.source_dir / 'house_entrance.jpg').write_bytes(png_bytes(1280, 720))
+        from backend.stories import get_story
+        manifest, _ = build_manifest([get_story(0)])
+
+        scene = Client().get(reverse('start_story')).json()['scene']
+
+        self.assertEqual(scene['background'], manifest['/static/house_entrance.jpg']['url'])
+        self.assertEqual(scene['background_info']['width'], 1280)
@@ -0,0 +1,167 @@
+"""
+Tests for story bundles and batch path verification
+"""
+import gzip
+import json
+import shutil
+import tempfile
+from pathlib import Path
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from backend.bundles import build_bundle, reset_bundles
+from backend.localization import get_story_text
+from backend.stories import compile_story, scenes_within
+from tests.fixtures import create_branching_story
+
+
+class TestForwardScenes(TestCase):
+    """Test cases for scenes_within with a forward-only neighbour function"""
+
+    def test_forward_only(self):
+        """Test only scenes reachable by choices are found, nearest first"""
+        story = compile_story(create_branching_story())
+
+        def ahead(scene_id, hops, limit):
+            return scenes_within(story, scene_id, hops, limit,
+                                 neighbours=lambda current: story["adjacency"][current])
+
+        self.assertEqual(ahead(1, 3, 100), {1: 0, 3: 1})
+        self.assertEqual(ahead(0, 1, 100), {0: 0, 1: 1, 2: 1, 3: 1})
+        self.assertEqual(len(ahead(0, 5, 2)), 2)
+
+
+class TestStoryBundle(TestCase):
+    """Test cases for the story bundle endpoint"""
+
+    def setUp(self):
+        reset_bundles()
+        self.url = reverse('story_bundle', args=[0])
+
+    def tearDown(self):
+        reset_bundles()
+
+    def test_gzip_bundle(self):
+        """Test the bundle is sent precompressed to clients accepting gzip"""
+        response = self.client.get(self.url, {'scene': 0, 'hops': 2},
+                                   HTTP_ACCEPT_ENCODING='gzip, br')
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        bundle = json.loads(gzip.decompress(response.content))
+        self.assertEqual(bundle['root'], 0)
+        self.assertEqual([scene['id'] for scene in bundle['scenes']], [0, 1, 3, 2, 6])
+        self.assertEqual(bundle['frontier'], [2])
+        first = bundle['scenes'][0]['choices'][0]
+        self.assertEqual(first, {'id': 1, 'text': 'Enter the house', 'target_scene_id': 1})
+
+    def test_plain_bundle(self):
+        """Test clients without gzip get the same bundle uncompressed"""
+        response = self.client.get(self.url, {'scene': 5, 'hops': 1})
+
+        self.assertFalse(response.has_header('Content-Encoding'))
+        scene = json.loads(response.content)['scenes'][0]
+        self.assertTrue(scene['conditional_flow'])
+        self.assertEqual(scene['choices'][0]['conditions'], {'trust': 30, 'security': 10})
+
+    def test_not_modified(self):
+        """Test a matching ETag returns 304"""
+        first = self.client.get(self.url, {'scene': 0})
+        second = self.client.get(self.url, {'scene': 0}, HTTP_IF_NONE_MATCH=first['ETag'])
+
+        self.assertEqual(second.status_code, 304)
+
+    def test_pinned_version_cached_long(self):
+        """Test bundles for an explicit version are cacheable for a year"""
+        response = self.client.get(self.url, {'scene': 0, 'version': 1})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('max-age=31536000', response['Cache-Control'])
+
+    def test_invalid_requests(self):
+        """Test bad parameters and unknown stories or versions are rejected"""
+        self.assertEqual(self.client.get(self.url).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'scene': 99}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'scene': 0, 'version': 99}).status_code, 404)
+        self.assertEqual(
+            self.client.get(reverse('story_bundle', args=[9]), {'scene': 0}).status_code, 404
+        )
+
+    def test_branched_choice_has_no_target(self):
+        """Test branched choices are left for the server to resolve"""
+        story = compile_story(create_branching_story())
+        bundle = build_bundle(0, story, 0, 1, get_story_text(0, 'en'))
+
+        choices = {choice['id']: choice for choice in bundle['scenes'][0]['choices']}
+        self.assertIsNone(choices[5]['target_scene_id'])
+        self.assertEqual(choices[1]['target_scene_id'], 1)
+
+
+class TestVerifyPath(TestCase):
+    """Test cases for verifying a path played from a bundle"""
+
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp())
+        self.settings_override = override_settings(PLAYTHROUGH_ARCHIVE_DIR=self.directory)
+        self.settings_override.enable()
+        self.client.get(reverse('start_story'))
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.directory)
+
+    def submit(self, path, step=0):
+        return self.client.post(
+            reverse('verify_path'),
+            data=json.dumps({'path': [
+                {'choice_id': choice_id, 'current_scene_id': scene_id}
+                for choice_id, scene_id in path
+            ], 'step': step}),
+            content_type='application/json'
+        )
+
+    def test_whole_path_to_ending(self):
+        """Test a valid path is applied in one call and ends the story"""
+        data = self.submit([(2, 0), (7, 3)]).json()
+
+        self.assertTrue(data['ending'])
+        self.assertEqual(data['accepted'], 2)
+        self.assertEqual(data['path'], [0, 3])
+        self.assertEqual(data['final_variables'], {'trust': -5, 'security': -10})
+        self.assertEqual(data['step'], 2)
+
+    def test_stops_at_first_invalid_move(self):
+        """Test conditions are checked and the valid prefix is kept"""
+        data = self.submit([(1, 0), (3, 1), (6, 2), (8, 5)]).json()
+
+        self.assertEqual(data['accepted'], 3)
+        self.assertEqual(data['rejected'], {'index': 3, 'error': 'Invalid choice'})
+        self.assertEqual(data['scene']['id'], 5)
+        self.assertEqual(data['step'], 3)
+        self.assertEqual(self.client.session['game_state']['current_scene_id'], 5)
+
+    def test_scene_mismatch(self):
+        """Test a move from a scene the player isn't in is rejected"""
+        data = self.submit([(1, 0), (7, 3)]).json()
+
+        self.assertEqual(data['rejected'], {'index': 1, 'error': 'Scene does not match'})
+
+    def test_nothing_accepted_leaves_session(self):
+        """Test a path rejected at its first move changes nothing"""
+        response = self.submit([(3, 1)])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['rejected']['index'], 0)
+        self.assertEqual(self.client.session['game_state']['step'], 0)
+
+    def test_duplicate_submit_replayed(self):
+        """Test resubmitting an applied path replays its response"""
+        first = self.submit([(1, 0), (3, 1)]).json()
+        replay = self.submit([(1, 0), (3, 1)])
+
+        self.assertEqual(replay['X-Story-Replay'], '1')
+        self.assertEqual(replay.json(), first)
+
+    def test_invalid_paths(self):
+        """Test empty and overlong paths are rejected"""
+        self.assertEqual(self.submit([]).status_code, 400)
+        with self.settings(STORY_PATH_MAX_CHOICES=1):
+            self.assertEqual(self.submit([(1, 0), (3, 1)]).status_code, 400)
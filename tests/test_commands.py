@@ -0,0 +1,170 @@
+"""
+Tests for the backend management commands
+"""
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from io import StringIO
+from pathlib import Path
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from backend import stories
+from backend.management.commands.loadtest import percentile
+
+
+class TestStoryFootprintCommand(TestCase):
+    """Test cases for the story_footprint command"""
+
+    def test_reports_bytes_per_scene_and_choice(self):
+        out = StringIO()
+        call_command('story_footprint', scenes=500, choices=2, stdout=out)
+
+        report = out.getvalue()
+        self.assertIn('500 scenes', report)
+        self.assertIn('per choice:', report)
+        self.assertIn('projected for 1M scenes:', report)
+
+
+class TestArchiveStoryVersionsCommand(SimpleTestCase):
+    """Test cases for the archive_story_versions command"""
+
+    def tearDown(self):
+        stories.reset_stories()
+
+    def test_archives_current_versions(self):
+        out = StringIO()
+        call_command('archive_story_versions', stdout=out)
+
+        self.assertIn('0 v1', out.getvalue())
+        self.assertTrue(stories.version_path(0, 1).is_file())
+
+    def test_fails_on_changed_content(self):
+        """Test a story edited without a version bump stops the release"""
+        stories.version_path(0, 1).parent.mkdir(parents=True, exist_ok=True)
+        stories.version_path(0, 1).write_text('{"version": 1, "scenes": []}')
+
+        with self.assertRaises(CommandError):
+            call_command('archive_story_versions', stdout=StringIO())
+
+class TestLoadtestCommand(TransactionTestCase):
+    """Test cases for the loadtest command"""
+
+    def setUp(self):
+        # Concurrent players lock the in-memory test database's session
+        # table, so keep sessions in file-backed shards as in production
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.settings = override_settings(SESSION_ENGINE='backend.sharded_sessions',
+                                          SESSION_SHARD_DIR=Path(directory))
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+
+    def test_random_playthroughs(self):
+        """Test concurrent players get through both endpoints without errors"""
+        out = StringIO()
+        call_command('loadtest', players=4, playthroughs=12, seed=1, stdout=out)
+
+        report = out.getvalue()
+        self.assertIn('12 playthroughs, 4 players', report)
+        start_row = next(line for line in report.splitlines() if '/api/start/' in line)
+        self.assertEqual(start_row.split()[1:3], ['12', '0'])
+        choice_row = next(line for line in report.splitlines() if '/api/choice/' in line)
+        self.assertEqual(choice_row.split()[2], '0')
+
+    def test_scripted_playthroughs(self):
+        """Test loadtest replays scripts recorded for playthrough_regression"""
+        handle, path = tempfile.mkstemp(suffix='.jsonl')
+        with os.fdopen(handle, 'w') as fh:
+            fh.write(json.dumps({"name": "trust", "choices": [1, 3]}) + "\n")
+            fh.write(json.dumps({"name": "doubt", "choices": [2, 7]}) + "\n")
+        out = StringIO()
+
+        try:
+            call_command('loadtest', players=3, playthroughs=6, script=path, stdout=out)
+        finally:
+            os.remove(path)
+
+        choice_row = next(line for line in out.getvalue().splitlines() if '/api/choice/' in line)
+        self.assertEqual(choice_row.split()[1:3], ['12', '0'])
+
+    def test_percentile(self):
+        """Test nearest-rank percentile in milliseconds"""
+        samples = [n / 1000 for n in range(1, 101)]
+
+        self.assertAlmostEqual(percentile(samples, 50), 50)
+        self.assertAlmostEqual(percentile(samples, 99), 99)
+        self.assertAlmostEqual(percentile([0.004], 95), 4)
+
+
+class TestServeCommand(SimpleTestCase):
+    """Runs `serve` in a subprocess and talks to it over TCP"""
+
+    def start_server(self, *args, **env):
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            self.port = probe.getsockname()[1]
+        data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, data_dir)
+        env = dict(os.environ, SECRET_KEY='test', STORY_VERSION_DIR=data_dir,
+                   PLAYTHROUGH_ARCHIVE_DIR=data_dir, SESSION_ENGINE='backend.sharded_sessions',
+                   SESSION_SHARD_DIR=data_dir, **env)
+        process = subprocess.Popen(
+            [sys.executable, 'manage.py', 'serve', '--bind', f'127.0.0.1:{self.port}',
+             '--workers', '1', *args],
+            cwd=Path(__file__).resolve().parent.parent, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        self.addCleanup(process.wait, 10)
+        self.addCleanup(process.terminate)
+
+        deadline = time.monotonic() + 15
+        while time.monotonic() < deadline:
+            try:
+                return self.get_ready()
+            except OSError:
+                time.sleep(0.2)
+        self.fail("serve did not start")
+
+    def get_ready(self, timeout=1.0):
+        url = f'http://127.0.0.1:{self.port}/api/ready/'
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            return response.status
+
+    def idle_connection(self):
+        idle = socket.create_connection(('127.0.0.1', self.port))
+        self.addCleanup(idle.close)
+        return idle
+
+    def test_idle_connection_does_not_block_worker(self):
+        """Test a client that sends nothing holds one thread, not the worker"""
+        self.start_server('--threads', '2')
+        self.idle_connection()
+
+        self.assertEqual(self.get_ready(timeout=5), 200)
+
+    def test_idle_connection_dropped_after_timeout(self):
+        """Test idle connections are closed so they cannot hold every thread"""
+        self.start_server('--threads', '1', '--timeout', '1')
+        idle = self.idle_connection()
+        idle.settimeout(5)
+
+        self.assertEqual(idle.recv(1), b'')
+        self.assertEqual(self.get_ready(timeout=5), 200)
+
+    def test_live_loadtest_passes_rate_limit(self):
+        """Test live loadtest players, all from one address, are not throttled"""
+        self.start_server('--threads', '4', ADMISSION_CLIENT_RATE='1',
+                          ADMISSION_CLIENT_BURST='2', ADMISSION_BYPASS_TOKEN='load')
+        out = StringIO()
+
+        call_command('loadtest', url=f'http://127.0.0.1:{self.port}', players=4,
+                     playthroughs=12, admission_token='load', seed=1, stdout=out)
+
+        rows = [line.split() for line in out.getvalue().splitlines() if '/api/' in line]
+        self.assertEqual([row[2] for row in rows], ['0', '0'])
@@ -0,0 +1,154 @@
+"""
+Tests for locale negotiation and lazily loaded story text
+"""
+import json
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from django.test import Client, RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from backend import localization
+from backend.localization import (
+    available_locales, get_story_text, negotiate_locale, parse_accept_language,
+)
+
+
+class TestAcceptLanguage(unittest.TestCase):
+    """Test cases for Accept-Language parsing"""
+
+    def test_orders_by_quality(self):
+        """Test tags come back most preferred first"""
+        header = 'en;q=0.5, bn-BD, fr;q=0.8'
+
+        self.assertEqual(parse_accept_language(header), ['bn-BD', 'fr', 'en'])
+
+    def test_skips_wildcard_and_zero_quality(self):
+        """Test wildcards and q=0 tags are ignored"""
+        self.assertEqual(parse_accept_language('*, de;q=0, en'), ['en'])
+
+
+class TestNegotiateLocale(unittest.TestCase):
+    """Test cases for negotiate_locale"""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def test_region_falls_back_to_language(self):
+        """Test bn-BD matches the bn text table"""
+        request = self.factory.get('/', HTTP_ACCEPT_LANGUAGE='bn-BD,en;q=0.5')
+
+        self.assertEqual(negotiate_locale(request, 0), 'bn')
+
+    def test_parameter_overrides_header(self):
+        """Test an explicit lang parameter wins over Accept-Language"""
+        request = self.factory.get('/', {'lang': 'en'}, HTTP_ACCEPT_LANGUAGE='bn')
+
+        self.assertEqual(negotiate_locale(request, 0), 'en')
+
+    def test_unsupported_uses_default(self):
+        """Test unsupported locales fall back to the default"""
+        request = self.factory.get('/', HTTP_ACCEPT_LANGUAGE='fr')
+
+        self.assertEqual(negotiate_locale(request, 0), 'en')
+        self.assertEqual(available_locales(0), {'en', 'bn'})
+
+
+class TestStoryText(unittest.TestCase):
+    """Test cases for lazily loaded text tables"""
+
+    def setUp(self):
+        localization.reset_story_text()
+
+    def test_loaded_on_first_use_only(self):
+        """Test a text table is loaded once and then reused"""
+        self.assertEqual(localization._loaded_text, {})
+
+        text = get_story_text(0, 'bn')
+
+        self.assertIs(get_story_text(0, 'bn'), text)
+        self.assertEqual(list(localization._loaded_text), [(0, None, 'bn')])
+
+    def test_repeated_strings_interned(self):
+        """Test identical translated strings share one object"""
+        text = get_story_text(0, 'bn')
+
+        self.assertIs(text.choices[8], text.choices[9])
+
+
+
+class TestTextFiles(unittest.TestCase):
+    """Test cases for finding text tables on disk"""
+
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp())
+        self.settings = override_settings(STORY_TEXT_DIR=self.directory)
+        self.settings.enable()
+        localization.reset_story_text()
+
+    def tearDown(self):
+        self.settings.disable()
+        localization.reset_story_text()
+        shutil.rmtree(self.directory)
+
+    def write_table(self, relative, choices):
+        path = self.directory / relative
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps({"choices": choices}), encoding='utf-8')
+
+    def test_mixed_case_file_name(self):
+        """Test pt-BR.json is offered as pt-br and loads from its real name"""
+        self.write_table('0/pt-BR.json', {"1": "Olá"})
+        request = RequestFactory().get('/', HTTP_ACCEPT_LANGUAGE='pt-BR')
+
+        locale = negotiate_locale(request, 0)
+
+        self.assertEqual(locale, 'pt-br')
+        self.assertEqual(get_story_text(0, locale).choices, {1: "Olá"})
+
+    def test_version_table_takes_precedence(self):
+        """Test a version's own table replaces the story-wide one for that version only"""
+        self.write_table('0/bn.json', {"1": "old"})
+        self.write_table('0/2/bn.json', {"1": "new"})
+
+        self.assertEqual(get_story_text(0, 'bn', 1).choices, {1: "old"})
+        self.assertEqual(get_story_text(0, 'bn', 2).choices, {1: "new"})
+
+    def test_version_only_locale(self):
+        """Test a locale translated for one version is only offered for it"""
+        self.write_table('0/2/fr.json', {"1": "Bonjour"})
+
+        self.assertIn('fr', available_locales(0, 2))
+        self.assertNotIn('fr', available_locales(0, 1))
+
+class TestLocalizedViews(TestCase):
+    """Test cases for localized scene responses"""
+
+    def test_start_story_in_requested_locale(self):
+        """Test choice texts follow Accept-Language"""
+        data = Client().get(reverse('start_story'), HTTP_ACCEPT_LANGUAGE='bn').json()
+
+        self.assertEqual(data['locale'], 'bn')
+        self.assertEqual(data['scene']['choices'][0]['text'], 'বাড়িতে প্রবেশ করো')
+
+    def test_default_locale(self):
+        """Test the story's own text is used without a preference"""
+        data = Client().get(reverse('start_story')).json()
+
+        self.assertEqual(data['locale'], 'en')
+        self.assertEqual(data['scene']['choices'][0]['text'], 'Enter the house')
+
+    def test_localized_ending_message(self):
+        """Test the ending message is translated from the lang parameter"""
+        client = Client()
+        client.get(reverse('start_story'))
+        client.post(reverse('process_choice'),
+                    data=json.dumps({'choice_id': 2, 'current_scene_id': 0}),
+                    content_type='application/json')
+
+        data = client.post(reverse('process_choice'),
+                           data=json.dumps({'choice_id': 7, 'current_scene_id': 3, 'lang': 'bn'}),
+                           content_type='application/json').json()
+
+        self.assertTrue(data['ending'])
+        self.assertEqual(data['message'], 'গল্প এখানেই শেষ।')
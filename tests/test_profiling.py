@@ -0,0 +1,118 @@
+"""
+Tests for opt-in request profiling
+"""
+import json
+import shutil
+import tempfile
+from pathlib import Path
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+from backend.profiling import ProfilingMiddleware, StackProfiler
+from backend.ratelimit import TokenBucket
+
+
+def inner():
+    return sum(range(1000))
+
+
+def outer():
+    return inner()
+
+
+class TestStackProfiler(TestCase):
+    """Test cases for StackProfiler"""
+
+    def test_nested_calls_collapsed(self):
+        """Test time is charged to the full stack of nested calls"""
+        with StackProfiler() as profiler:
+            outer()
+
+        stacks = [stack for stack in profiler.stacks if stack[-1].endswith('.inner')]
+        self.assertTrue(stacks)
+        self.assertTrue(stacks[0][-2].endswith('.outer'))
+
+    def test_collapsed_format(self):
+        """Test lines carry the prefix and an integer weight"""
+        with StackProfiler() as profiler:
+            outer()
+
+        line = next(profiler.collapsed(('endpoint=test',)))
+        frames, weight = line.rsplit(' ', 1)
+        self.assertTrue(frames.startswith('endpoint=test;'))
+        self.assertGreater(int(weight), 0)
+
+
+class TestTokenBucket(TestCase):
+    """Test cases for TokenBucket"""
+
+    def test_refills_over_time(self):
+        """Test bursts are capped and tokens come back at the given rate"""
+        now = [0.0]
+        bucket = TokenBucket(rate=1, capacity=2, clock=lambda: now[0])
+
+        self.assertTrue(bucket.try_acquire())
+        self.assertTrue(bucket.try_acquire())
+        self.assertFalse(bucket.try_acquire())
+        now[0] = 1.0
+        self.assertTrue(bucket.try_acquire())
+        self.assertFalse(bucket.try_acquire())
+
+
+class TestProfilingMiddleware(TestCase):
+    """Test cases for ProfilingMiddleware"""
+
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def profile_lines(self):
+        return [line for path in self.directory.glob('*.folded')
+                for line in path.read_text().splitlines()]
+
+    def test_disabled_by_default(self):
+        """Test the middleware removes itself when both toggles are off"""
+        with override_settings(PROFILE_SAMPLE_RATE=0.0, PROFILE_TOKEN=''):
+            with self.assertRaises(MiddlewareNotUsed):
+                ProfilingMiddleware(lambda request: HttpResponse())
+
+    def test_header_profiles_tagged_request(self):
+        """Test a profiled choice is tagged with the scene it was made in and the next"""
+        with override_settings(PROFILE_TOKEN='secret', PROFILE_DIR=self.directory):
+            client = Client()
+            client.get(reverse('start_story'))
+            response = client.post(
+                reverse('process_choice'),
+                data=json.dumps({'choice_id': 1, 'current_scene_id': 0, 'step': 0}),
+                content_type='application/json',
+                HTTP_X_PROFILE='secret'
+            )
+
+        self.assertEqual(response['X-Profiled'], '1')
+        lines = self.profile_lines()
+        self.assertTrue(lines)
+        self.assertTrue(all(
+            line.startswith('endpoint=process_choice;story=0;scene=0;to=1;') for line in lines
+        ))
+        self.assertTrue(any('backend.views.process_choice' in line for line in lines))
+
+    def test_wrong_token_not_profiled(self):
+        """Test a request with the wrong token runs unprofiled"""
+        with override_settings(PROFILE_TOKEN='secret', PROFILE_DIR=self.directory):
+            response = Client().get(reverse('start_story'), HTTP_X_PROFILE='guess')
+
+        self.assertFalse(response.has_header('X-Profiled'))
+        self.assertEqual(self.profile_lines(), [])
+
+    def test_sampling_rate_limited(self):
+        """Test sampled profiles stop once the per-minute budget is spent"""
+        with override_settings(PROFILE_SAMPLE_RATE=1.0, PROFILE_MAX_PER_MINUTE=2,
+                               PROFILE_DIR=self.directory):
+            client = Client()
+            profiled = [client.get(reverse('start_story')).has_header('X-Profiled')
+                        for _ in range(4)]
+
+        self.assertEqual(profiled, [True, True, False, False])
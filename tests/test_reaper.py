@@ -0,0 +1,186 @@
+"""
+Tests for incremental session expiry and the playthrough archive
+"""
+import json
+import shutil
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+from django.conf import settings
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.core.management import call_command
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+from backend.archive import read_archive
+from backend.reaper import Reaper, delete_expired_batch
+
+
+def create_sessions(count, expired):
+    for _ in range(count):
+        session = SessionStore()
+        session.set_expiry(timedelta(seconds=-60 if expired else 60))
+        session.save()
+
+
+class TestReaper(TestCase):
+    """Test cases for batched expiry"""
+
+    def test_batch_respects_limit(self):
+        """Test one batch deletes at most `limit` expired sessions"""
+        Session.objects.all().delete()
+        create_sessions(5, expired=True)
+        create_sessions(2, expired=False)
+
+        self.assertEqual(delete_expired_batch(3), 3)
+        self.assertEqual(Session.objects.count(), 4)
+
+    def test_sweep_deletes_only_expired(self):
+        """Test a sweep removes every expired session in several batches"""
+        Session.objects.all().delete()
+        create_sessions(25, expired=True)
+        create_sessions(3, expired=False)
+
+        with mock.patch('backend.reaper.time.sleep'):
+            deleted = Reaper(batch_size=4, min_batch=4, max_batch=4).sweep()
+
+        self.assertEqual(deleted, 25)
+        self.assertEqual(Session.objects.count(), 3)
+
+    def test_batch_size_adapts_to_budget(self):
+        """Test slow deletes shrink the batch and fast ones grow it"""
+        reaper = Reaper(batch_size=100, budget=0.05)
+
+        reaper.adapt(0.2)
+        self.assertEqual(reaper.batch_size, 50)
+        reaper.adapt(0.001)
+        self.assertEqual(reaper.batch_size, 100)
+
+    def test_sweep_stops_when_asked(self):
+        create_sessions(3, expired=True)
+
+        self.assertEqual(Reaper().sweep(should_stop=lambda: True), 0)
+
+
+class TestPlaythroughArchive(TestCase):
+    """Test cases for archiving finished playthroughs"""
+
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp())
+        self.settings = override_settings(PLAYTHROUGH_ARCHIVE_DIR=self.directory)
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.directory)
+
+    def play_to_ending(self, client):
+        client.get(reverse('start_story'))
+        for choice_id, scene_id, step in ((2, 0, 0), (7, 3, 1)):
+            response = client.post(
+                reverse('process_choice'),
+                data=json.dumps({'choice_id': choice_id, 'current_scene_id': scene_id,
+                                 'step': step}),
+                content_type='application/json'
+            )
+        return response
+
+    def test_ending_archived_and_session_trimmed(self):
+        """Test the ending is archived and dropped from the live session"""
+        client = Client()
+        data = self.play_to_ending(client).json()
+
+        records = [record for path in self.directory.glob('*.jsonl.gz')
+                   for record in read_archive(path)]
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]['path'], [0, 3])
+        self.assertEqual(records[0]['final_variables'], {'trust': -5, 'security': -10})
+        self.assertEqual(data['path'], [0, 3])
+        self.assertEqual(client.session['game_state']['visited_scenes'], [])
+        self.assertLessEqual(client.session.get_expiry_age(), 3600)
+
+    def test_new_playthrough_restores_expiry(self):
+        """Test starting again after an ending gives the session its full lifetime"""
+        client = Client()
+        self.play_to_ending(client)
+        client.get(reverse('start_story'))
+
+        self.assertEqual(client.session.get_expiry_age(), settings.SESSION_COOKIE_AGE)
+
+    def test_unwritable_archive_logged_not_raised(self):
+        """Test a failed append is logged and the ending still served"""
+        blocker = self.directory / 'blocked'
+        blocker.write_text('')
+
+        with override_settings(PLAYTHROUGH_ARCHIVE_DIR=blocker / 'archive'), \
+                self.assertLogs('backend.appendfile', 'WARNING'):
+            response = self.play_to_ending(Client())
+
+        self.assertTrue(response.json()['ending'])
+
+    def test_archive_appends_across_playthroughs(self):
+        """Test several playthroughs append to the same daily file"""
+        self.play_to_ending(Client())
+        self.play_to_ending(Client())
+
+        paths = list(self.directory.glob('*.jsonl.gz'))
+        self.assertEqual(len(paths), 1)
+        self.assertEqual(len(list(read_archive(paths[0]))), 2)
+
+    def test_duplicate_ending_replayed_not_rearchived(self):
+        """Test a double submit at the ending replays without archiving again"""
+        client = Client()
+        first = self.play_to_ending(client).json()
+
+        replay = client.post(
+            reverse('process_choice'),
+            data=json.dumps({'choice_id': 7, 'current_scene_id': 3, 'step': 1}),
+            content_type='application/json'
+        )
+
+        self.assertEqual(replay.json(), first)
+        path = next(self.directory.glob('*.jsonl.gz'))
+        self.assertEqual(len(list(read_archive(path))), 1)
+
+
+    def test_concurrent_duplicate_ending_archived_once(self):
+        """Test two submits racing to the ending archive the playthrough once"""
+        from backend.views import apply_choice
+        client = Client()
+        client.get(reverse('start_story'))
+        body = {'choice_id': 2, 'current_scene_id': 0, 'step': 0}
+        client.post(reverse('process_choice'), data=json.dumps(body),
+                    content_type='application/json')
+        body = {'choice_id': 7, 'current_scene_id': 3, 'step': 1}
+        racing = []
+
+        def apply_after_race(*args):
+            if not racing:
+                racing.append(None)
+                racing[0] = client.post(reverse('process_choice'), data=json.dumps(body),
+                                        content_type='application/json')
+            return apply_choice(*args)
+
+        with mock.patch('backend.views.apply_choice', side_effect=apply_after_race):
+            replay = client.post(reverse('process_choice'), data=json.dumps(body),
+                                 content_type='application/json')
+
+        self.assertEqual(replay.json(), racing[0].json())
+        path = next(self.directory.glob('*.jsonl.gz'))
+        self.assertEqual(len(list(read_archive(path))), 1)
+
+class TestReapSessionsCommand(TestCase):
+    """Test cases for the reap_sessions command"""
+
+    def test_once(self):
+        """Test a single sweep reports the deleted sessions"""
+        Session.objects.all().delete()
+        create_sessions(3, expired=True)
+        out = StringIO()
+
+        call_command('reap_sessions', once=True, stdout=out)
+
+        self.assertIn("Deleted 3 expired sessions", out.getvalue())
+        self.assertEqual(Session.objects.count(), 0)
@@ -0,0 +1,139 @@
+"""
+Tests for the headless playthrough regression runner
+"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from io import StringIO
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import override_settings
+from backend import stories
+from backend.regression import (
+    compare_outcomes, load_scripts, random_scripts, run_regression, run_script,
+)
+from backend.stories import archive_story_version, compile_story
+from tests.fixtures import create_test_story
+
+
+class TestRunScript(unittest.TestCase):
+    """Test cases for run_script"""
+
+    def setUp(self):
+        self.story = compile_story(create_test_story())
+
+    def test_reaches_ending(self):
+        """Test a complete script reports its ending, variables and path"""
+        outcome = run_script(self.story, [1, 3])
+
+        self.assertTrue(outcome['ending'])
+        self.assertIsNone(outcome['error'])
+        self.assertEqual(outcome['final_variables'], {'trust': 15})
+        self.assertEqual(outcome['path'], [0, 1, 3])
+
+    def test_unavailable_choice(self):
+        """Test a script that no longer fits the graph reports an error"""
+        outcome = run_script(self.story, [1, 4])
+
+        self.assertFalse(outcome['ending'])
+        self.assertIn('choice 4', outcome['error'])
+
+    def test_choice_not_offered(self):
+        """Test a choice whose conditions the player doesn't meet is an error"""
+        story = create_test_story()
+        story["scenes"][1].choices[0].conditions = {"trust": 50}
+        outcome = run_script(compile_story(story), [1, 3])
+
+        self.assertEqual(outcome['error'], 'step 1: choice 3 not offered in scene 1')
+
+    def test_recorded_scripts_only_take_offered_choices(self):
+        """Test recording never takes a choice players aren't shown"""
+        sample = compile_story(stories.build_sample_story())
+        scripts = random_scripts(sample, 300, seed=1)
+
+        self.assertTrue(all(run_script(sample, choices)['error'] is None
+                            for _, choices in scripts))
+        self.assertNotIn([1, 3, 6, 8], [choices for _, choices in scripts])
+
+    def test_compare_outcomes(self):
+        """Test only differing fields are reported"""
+        differences = compare_outcomes(run_script(self.story, [1, 3]),
+                                       run_script(self.story, [2, 4]))
+
+        self.assertEqual(set(differences), {'final_variables', 'path'})
+
+
+class TestRunRegression(unittest.TestCase):
+    """Test cases for run_regression across archived versions"""
+
+    def setUp(self):
+        stories.reset_stories()
+        self.directory = tempfile.mkdtemp()
+        self.settings = override_settings(STORY_VERSION_DIR=self.directory)
+        self.settings.enable()
+
+        old = compile_story(create_test_story())
+        old["version"] = 101
+        new = compile_story(create_test_story())
+        new["version"] = 102
+        new["scenes"][2].choices[0].target_scene_id = 1
+        for story in (old, new):
+            archive_story_version(0, story)
+        self.scripts = random_scripts(old, 40, seed=3)
+
+    def tearDown(self):
+        self.settings.disable()
+        stories.reset_stories()
+        shutil.rmtree(self.directory)
+
+    def test_detects_changed_routes(self):
+        """Test only scripts through the edited scene are reported"""
+        diffs = run_regression(0, 101, 102, self.scripts, workers=1)
+
+        changed = {name for name, _ in diffs}
+        expected = {name for name, choices in self.scripts if choices[0] == 2}
+        self.assertEqual(changed, expected)
+
+    def test_process_pool_matches_serial(self):
+        """Test parallel runs report the same diffs as a serial run"""
+        self.assertEqual(run_regression(0, 101, 102, self.scripts, workers=2),
+                         run_regression(0, 101, 102, self.scripts, workers=1))
+
+    def test_missing_version(self):
+        with self.assertRaises(LookupError):
+            run_regression(0, 101, 999, self.scripts, workers=1)
+
+    def test_command(self):
+        """Test the command records scripts and fails on changed outcomes"""
+        handle, path = tempfile.mkstemp(suffix='.jsonl')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+
+        call_command('playthrough_regression', path, old=101, new=101, record=10,
+                     stdout=StringIO())
+        with self.assertRaises(CommandError):
+            call_command('playthrough_regression', path, old=101, new=102,
+                         stdout=StringIO())
+
+
+class TestLoadScripts(unittest.TestCase):
+    """Test cases for load_scripts"""
+
+    def write(self, content):
+        handle, path = tempfile.mkstemp()
+        with os.fdopen(handle, 'w') as fh:
+            fh.write(content)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_json_array(self):
+        path = self.write(json.dumps([[1, 3], {"name": "barn", "choices": [2, 7]}]))
+
+        self.assertEqual(load_scripts(path), [('script-0', [1, 3]), ('barn', [2, 7])])
+
+    def test_json_lines(self):
+        path = self.write('{"name": "a", "choices": [1]}\n\n{"choices": [2]}\n')
+
+        self.assertEqual(load_scripts(path), [('a', [1]), ('script-1', [2])])
@@ -0,0 +1,230 @@
+"""
+Tests for the sharded SQLite session engine
+"""
+import shutil
+import tempfile
+import sqlite3
+import threading
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+from django.contrib.sessions.backends.base import CreateError
+from django.core.management import call_command
+from django.test import Client, SimpleTestCase, override_settings
+from django.urls import reverse
+from backend.sharded_sessions import SessionStore, ShardWriter, connect, get_pool, shard_path
+
+
+class ShardedSessionTestCase(SimpleTestCase):
+    """Runs each test against a fresh directory of four shards"""
+
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp())
+        self.settings = override_settings(
+            SESSION_ENGINE='backend.sharded_sessions',
+            SESSION_SHARD_DIR=self.directory,
+            SESSION_SHARD_COUNT=4,
+            SESSION_SHARD_BATCH_SIZE=8,
+        )
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.directory)
+
+    def count_rows(self, count=4):
+        return sum(
+            connect(shard_path(self.directory, index, count))
+            .execute("SELECT COUNT(*) FROM django_session").fetchone()[0]
+            for index in range(count)
+        )
+
+
+class TestSessionStore(ShardedSessionTestCase):
+    """Test cases for SessionStore"""
+
+    def test_save_and_load(self):
+        """Test a saved session loads back from its shard"""
+        session = SessionStore()
+        session['game_state'] = {'step': 3}
+        session.save()
+
+        loaded = SessionStore(session.session_key)
+
+        self.assertEqual(loaded['game_state'], {'step': 3})
+        self.assertTrue(loaded.exists(session.session_key))
+
+    def test_must_create_rejects_existing_key(self):
+        """Test creating a session with a taken key raises CreateError"""
+        session = SessionStore()
+        session.save()
+
+        duplicate = SessionStore(session.session_key)
+        with self.assertRaises(CreateError):
+            duplicate.save(must_create=True)
+
+    def test_save_if_unchanged(self):
+        """Test a conditional save only wins over the row it was read from"""
+        session = SessionStore()
+        session['game_state'] = {'step': 0}
+        session.save()
+        first = SessionStore(session.session_key)
+        second = SessionStore(session.session_key)
+        stored = first.stored_data()
+        first['game_state'] = {'step': 1}
+        second['game_state'] = {'step': 1, 'late': True}
+
+        self.assertTrue(first.save_if_unchanged(stored))
+        self.assertFalse(second.save_if_unchanged(stored))
+        self.assertEqual(SessionStore(session.session_key)['game_state'], {'step': 1})
+
+    def test_delete(self):
+        """Test deleted sessions no longer load"""
+        session = SessionStore()
+        session['a'] = 1
+        session.save()
+        session.delete()
+
+        self.assertFalse(SessionStore().exists(session.session_key))
+        self.assertEqual(SessionStore(session.session_key).load(), {})
+
+    def test_clear_expired(self):
+        """Test clear_expired removes only expired sessions"""
+        expired = SessionStore()
+        expired.set_expiry(timedelta(seconds=-1))
+        expired.save()
+        live = SessionStore()
+        live.save()
+
+        SessionStore.clear_expired()
+
+        self.assertEqual(self.count_rows(), 1)
+        self.assertTrue(live.exists(live.session_key))
+
+    def test_clear_expired_batch(self):
+        """Test batched expiry never deletes more than the limit"""
+        for _ in range(20):
+            expired = SessionStore()
+            expired.set_expiry(timedelta(seconds=-1))
+            expired.save()
+
+        first = SessionStore.clear_expired_batch(6)
+        while SessionStore.clear_expired_batch(6):
+            pass
+
+        self.assertLessEqual(first, 6)
+        self.assertGreater(first, 0)
+        self.assertEqual(self.count_rows(), 0)
+
+    def test_sessions_spread_across_shards(self):
+        """Test session keys hash to every shard"""
+        for _ in range(40):
+            SessionStore().save()
+
+        populated = [
+            connect(shard_path(self.directory, index, 4))
+            .execute("SELECT COUNT(*) FROM django_session").fetchone()[0]
+            for index in range(4)
+        ]
+        self.assertTrue(all(populated))
+
+    def test_concurrent_writers(self):
+        """Test concurrent saves from many threads all commit"""
+        def save_sessions():
+            for _ in range(10):
+                SessionStore().save()
+
+        threads = [threading.Thread(target=save_sessions) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.count_rows(), 80)
+
+    @override_settings(SESSION_SHARD_BATCH_SIZE=1)
+    def test_concurrent_direct_writers(self):
+        """Test unbatched saves commit on each thread's own connection"""
+        def save_sessions():
+            for _ in range(10):
+                SessionStore().save()
+
+        threads = [threading.Thread(target=save_sessions) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.count_rows(), 80)
+        self.assertNotIsInstance(get_pool().writer(0), ShardWriter)
+
+    def test_drop_in_session_engine(self):
+        """Test gameplay works end to end on the sharded engine"""
+        client = Client()
+        client.get(reverse('start_story'))
+
+        self.assertEqual(client.session['game_state']['current_scene_id'], 0)
+
+
+class TestShardWriter(ShardedSessionTestCase):
+    """Test cases for the batching writer thread"""
+
+    def test_survives_failed_connect(self):
+        """Test a shard that can't be opened fails its writes, not the thread"""
+        blocker = self.directory / 'blocked'
+        blocker.write_text('')
+        writer = ShardWriter(blocker / 'shard.sqlite3', 8)
+        sql = "INSERT INTO django_session VALUES (?, ?, ?)"
+
+        with self.assertRaises(OSError):
+            writer.execute(sql, ('key', 'data', 0))
+        blocker.unlink()
+
+        self.assertEqual(writer.execute(sql, ('key', 'data', 0)), 1)
+        self.assertTrue(writer.thread.is_alive())
+
+    def test_failed_statement_fails_its_batch_only(self):
+        """Test a bad statement raises for its caller and later writes still commit"""
+        writer = ShardWriter(self.directory / 'shard.sqlite3', 8)
+
+        with self.assertRaises(sqlite3.Error):
+            writer.execute("INSERT INTO missing VALUES (?)", (1,))
+        self.assertEqual(
+            writer.execute("INSERT INTO django_session VALUES (?, ?, ?)", ('key', 'data', 0)), 1
+        )
+
+    def test_wait_times_out(self):
+        """Test a save gives up when its shard stays locked"""
+        path = self.directory / 'shard.sqlite3'
+        writer = ShardWriter(path, 8)
+        writer.execute("DELETE FROM django_session", ())
+        holder = connect(path)
+        holder.execute("BEGIN IMMEDIATE")
+
+        try:
+            with mock.patch('backend.sharded_sessions.WRITE_TIMEOUT', 0.1):
+                with self.assertRaises(sqlite3.OperationalError):
+                    writer.execute("DELETE FROM django_session", ())
+        finally:
+            holder.execute("ROLLBACK")
+
+
+class TestReshardCommand(ShardedSessionTestCase):
+    """Test cases for reshard_sessions"""
+
+    def test_reshard(self):
+        """Test every live session is reachable in the new layout"""
+        keys = []
+        for number in range(20):
+            session = SessionStore()
+            session['number'] = number
+            session.save()
+            keys.append(session.session_key)
+
+        call_command('reshard_sessions', to_count=3, delete_old=True, stdout=StringIO())
+
+        self.assertFalse(shard_path(self.directory, 0, 4).exists())
+        with override_settings(SESSION_SHARD_COUNT=3):
+            numbers = [SessionStore(key)['number'] for key in keys]
+        self.assertEqual(numbers, list(range(20)))
@@ -0,0 +1,177 @@
+"""
+Tests for spectator fan-out over server-sent events
+"""
+import asyncio
+import json
+import threading
+import unittest
+from unittest import mock
+from django.test import AsyncClient, Client, TransactionTestCase, override_settings
+from django.urls import reverse
+from backend.spectators import Broadcaster, broadcaster, encode_event
+
+
+def parse_frame(frame):
+    """Decode the data line of an event frame"""
+    data_line = next(line for line in frame.decode().splitlines() if line.startswith('data: '))
+    return json.loads(data_line[len('data: '):])
+
+
+class TestBroadcaster(unittest.TestCase):
+    """Test cases for the Broadcaster"""
+
+    def test_publish_without_subscribers(self):
+        """Test publishing to an empty channel reports no deliveries"""
+        self.assertEqual(Broadcaster().publish('nobody', {"step": 1}), 0)
+
+    def test_one_frame_shared_by_all_subscribers(self):
+        """Test every subscriber receives the same encoded frame"""
+        hub = Broadcaster()
+
+        async def run():
+            subscribers = [hub.subscribe('room') for _ in range(3)]
+            self.assertEqual(hub.publish('room', {"step": 1}), 3)
+            await asyncio.sleep(0)
+            return [s.queue.get_nowait() for s in subscribers]
+
+        frames = asyncio.run(run())
+
+        self.assertIs(frames[0], frames[1])
+        self.assertIs(frames[1], frames[2])
+        self.assertEqual(parse_frame(frames[0]), {"step": 1})
+
+    def test_publish_from_another_thread(self):
+        """Test events published off the event loop reach subscribers"""
+        hub = Broadcaster()
+
+        async def run():
+            subscriber = hub.subscribe('room')
+            thread = threading.Thread(target=hub.publish, args=('room', {"step": 2}))
+            thread.start()
+            frame = await asyncio.wait_for(subscriber.queue.get(), 1)
+            thread.join()
+            return frame
+
+        self.assertEqual(parse_frame(asyncio.run(run())), {"step": 2})
+
+    def test_slow_consumer_dropped(self):
+        """Test a subscriber whose queue overflows is dropped"""
+        hub = Broadcaster(max_queue=2)
+
+        async def run():
+            slow = hub.subscribe('room')
+            for step in range(3):
+                hub.publish('room', {"step": step})
+            await asyncio.sleep(0)
+            return slow
+
+        slow = asyncio.run(run())
+
+        self.assertTrue(slow.dropped)
+        self.assertIsNone(slow.queue.get_nowait())
+        self.assertEqual(hub.subscriber_count('room'), 0)
+
+    def test_stream_yields_events(self):
+        """Test stream yields a retry hint, then published frames"""
+        hub = Broadcaster()
+
+        async def run():
+            stream = hub.stream('room')
+            retry = await stream.__anext__()
+            next_frame = asyncio.ensure_future(stream.__anext__())
+            await asyncio.sleep(0)
+            hub.publish('room', {"step": 4})
+            frame = await asyncio.wait_for(next_frame, 1)
+            await stream.aclose()
+            return retry, frame
+
+        retry, frame = asyncio.run(run())
+
+        self.assertTrue(retry.startswith(b'retry:'))
+        self.assertEqual(frame, encode_event({"step": 4}))
+        self.assertEqual(hub.subscriber_count('room'), 0)
+
+
+@override_settings(SPECTATORS_ENABLED=True)
+class TestSpectatorViews(TransactionTestCase):
+    """
+    Test cases for spectator channels on the gameplay views. AsyncClient
+    runs the views on another thread, so each request must commit.
+    """
+
+    def test_start_story_returns_channel(self):
+        """Test start_story hands out a stable spectator channel over ASGI"""
+        async def start_twice():
+            client = AsyncClient()
+            first = await client.get(reverse('start_story'))
+            second = await client.get(reverse('start_story'))
+            return first.json()['spectator_channel'], second.json()['spectator_channel']
+
+        first, second = asyncio.run(start_twice())
+
+        self.assertTrue(first)
+        self.assertEqual(first, second)
+
+    def test_choice_broadcast_to_spectators(self):
+        """Test a processed choice is broadcast without the CSRF token"""
+        async def play():
+            client = AsyncClient()
+            start = await client.get(reverse('start_story'))
+            with mock.patch.object(broadcaster, 'publish') as publish:
+                await client.post(reverse('process_choice'),
+                                  data=json.dumps({'choice_id': 1, 'current_scene_id': 0}),
+                                  content_type='application/json')
+            return start.json()['spectator_channel'], publish
+
+        channel, publish = asyncio.run(play())
+
+        publish.assert_called_once()
+        published_channel, event = publish.call_args.args
+        self.assertEqual(published_channel, channel)
+        self.assertEqual(event['scene']['id'], 1)
+        self.assertNotIn('csrf_token', event)
+
+    def test_no_channel_under_wsgi(self):
+        """Test WSGI gameplay gets no channel and publishes nothing"""
+        client = Client()
+
+        with mock.patch.object(broadcaster, 'publish') as publish:
+            start = client.get(reverse('start_story'))
+            client.post(reverse('process_choice'),
+                        data=json.dumps({'choice_id': 1, 'current_scene_id': 0}),
+                        content_type='application/json')
+
+        self.assertNotIn('spectator_channel', start.json())
+        publish.assert_not_called()
+
+    def test_spectate_refused_under_wsgi(self):
+        """Test a WSGI request gets 501 instead of a stream that never flushes"""
+        response = Client().get(reverse('spectate', args=['channel']))
+
+        self.assertEqual(response.status_code, 501)
+
+    @override_settings(SPECTATORS_ENABLED=False)
+    def test_disabled_by_default(self):
+        """Test ASGI servers that did not opt in hand out no channels either"""
+        async def start_and_spectate():
+            client = AsyncClient()
+            start = await client.get(reverse('start_story'))
+            spectate = await client.get(reverse('spectate', args=['channel']))
+            return start, spectate
+
+        start, spectate = asyncio.run(start_and_spectate())
+
+        self.assertNotIn('spectator_channel', start.json())
+        self.assertEqual(spectate.status_code, 501)
+
+    def test_spectate_streams_under_asgi(self):
+        """Test an ASGI request gets an event stream"""
+        async def spectate():
+            response = await AsyncClient().get(reverse('spectate', args=['channel']))
+            await response.streaming_content.aclose()
+            return response
+
+        response = asyncio.run(spectate())
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
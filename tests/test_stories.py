@@ -0,0 +1,317 @@
+"""
+Unit tests for the story registry (lazy loading, compiling, snapshots)
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from django.test import override_settings
+from backend import stories
+from backend.story_logic import Choice, StoryState
+from backend.stories import (
+    CHOICE_INDEX_THRESHOLD, apply_choice, build_alias_table, compile_story, find_choice, get_story,
+    migrate_state, read_snapshot, scenes_within, story_from_dict, story_to_dict, write_snapshot,
+)
+from tests.fixtures import create_branching_story, create_conditional_story, create_test_story
+
+
+class TestCompileStory(unittest.TestCase):
+    """Test cases for compile_story"""
+
+    def test_indexes_only_wide_scenes(self):
+        """Test only scenes with many choices get a choice-id index"""
+        story = create_test_story()
+        story["scenes"][0].choices.extend(
+            Choice(n, "Extra", 3) for n in range(10, 10 + CHOICE_INDEX_THRESHOLD)
+        )
+        story = compile_story(story)
+
+        self.assertEqual(set(story["choice_index"]), {0})
+        self.assertEqual(story["choice_index"][0][2].target_scene_id, 2)
+
+    def test_find_choice(self):
+        """Test find_choice works with and without an index"""
+        story = compile_story(create_test_story())
+
+        self.assertEqual(find_choice(story, story["scenes"][0], 2).target_scene_id, 2)
+        self.assertIsNone(find_choice(story, story["scenes"][3], 2))
+
+    def test_builds_adjacency(self):
+        """Test compile_story precomputes forward and reverse edges"""
+        story = compile_story(create_test_story())
+
+        self.assertEqual(story["scene_order"], [0, 1, 2, 3])
+        self.assertEqual(story["adjacency"][0], (1, 2))
+        self.assertEqual(story["reverse_adjacency"][3], (1, 2))
+        self.assertEqual(story["reverse_adjacency"][0], ())
+
+
+class TestWeightedBranches(unittest.TestCase):
+    """Test cases for weighted multi-target choices"""
+
+    def setUp(self):
+        self.story = compile_story(create_branching_story())
+
+    def take(self, choice_id, seed, variables=None):
+        state = StoryState(story_id=0, current_scene_id=0, variables=variables, seed=seed)
+        apply_choice(self.story, state, 0, choice_id)
+        return state.current_scene_id
+
+    def test_alias_table_matches_weights(self):
+        """Test the alias table gives each index exactly its share"""
+        weights = [5, 1, 0, 3, 1]
+        probabilities, aliases = build_alias_table(weights)
+
+        shares = [0.0] * len(weights)
+        for index, probability in enumerate(probabilities):
+            shares[index] += probability
+            shares[aliases[index]] += 1 - probability
+        for share, weight in zip(shares, weights):
+            self.assertAlmostEqual(share / len(weights), weight / sum(weights))
+        self.assertIsNone(build_alias_table([0, 0]))
+
+    def test_negative_weight_counts_as_zero(self):
+        """Test a negative static weight is clamped like a modified one"""
+        probabilities, aliases = build_alias_table([-5, 10, 10])
+
+        shares = [0.0] * 3
+        for index, probability in enumerate(probabilities):
+            shares[index] += probability
+            shares[aliases[index]] += 1 - probability
+        self.assertEqual([share / 3 for share in shares], [0.0, 0.5, 0.5])
+        self.assertIsNone(build_alias_table([-1, 0]))
+
+    def test_static_weights_precompiled(self):
+        """Test only branches without modifiers get a table at load"""
+        self.assertEqual(set(self.story["alias_tables"]), {(0, 5)})
+        self.assertEqual(self.story["adjacency"][0], (1, 2, 3))
+
+    def test_reproducible(self):
+        """Test the same seed and step always take the same branch"""
+        outcomes = {self.take(5, seed=42) for _ in range(5)}
+
+        self.assertEqual(len(outcomes), 1)
+
+    def test_distribution_follows_weights(self):
+        """Test outcomes across sessions follow the 70/30 weights"""
+        outcomes = [self.take(5, seed) for seed in range(2000)]
+
+        self.assertAlmostEqual(outcomes.count(1) / len(outcomes), 0.7, delta=0.05)
+        self.assertEqual(set(outcomes), {1, 2})
+
+    def test_weights_depend_on_variables(self):
+        """Test modifiers shift the odds and zero weight never wins"""
+        low = {self.take(6, seed) for seed in range(200)}
+        high = [self.take(6, seed, variables={"trust": 90}) for seed in range(2000)]
+
+        self.assertEqual(low, {2})
+        self.assertAlmostEqual(high.count(1) / len(high), 0.9, delta=0.05)
+
+    def test_all_zero_weights_use_fallback(self):
+        """Test a branched choice with no positive weight goes to its target"""
+        story = create_branching_story()
+        story["scenes"][0].choices[3].branches[1].weight = 0
+        self.story = compile_story(story)
+
+        self.assertEqual(self.take(6, seed=1), 3)
+
+    def test_dict_round_trip_keeps_branches(self):
+        """Test archived versions keep branches and their weights"""
+        restored = compile_story(story_from_dict(story_to_dict(self.story)))
+
+        self.assertEqual(restored["alias_tables"], self.story["alias_tables"])
+        branches = restored["scenes"][0].choices[3].branches
+        self.assertEqual(branches[0].modifiers, {"trust": 1})
+
+
+class TestScenesWithin(unittest.TestCase):
+    """Test cases for scenes_within"""
+
+    def setUp(self):
+        self.story = compile_story(create_test_story())
+
+    def test_zero_hops(self):
+        self.assertEqual(scenes_within(self.story, 1, 0, 10), {1: 0})
+
+    def test_both_directions(self):
+        """Test neighbours are found along and against choices"""
+        self.assertEqual(scenes_within(self.story, 1, 1, 10), {1: 0, 3: 1, 0: 1})
+
+    def test_limit(self):
+        """Test the search stops once the limit is reached"""
+        self.assertEqual(len(scenes_within(self.story, 0, 5, 2)), 2)
+
+
+class TestGetStory(unittest.TestCase):
+    """Test cases for lazy story loading"""
+
+    def setUp(self):
+        stories.reset_stories()
+
+    def tearDown(self):
+        stories.reset_stories()
+
+    def test_not_built_until_requested(self):
+        """Test stories are only built on first access"""
+        self.assertEqual(stories._compiled_stories, {})
+
+        story = get_story(0)
+
+        self.assertIn(0, story["scenes"])
+        self.assertIs(get_story(0), story)
+
+    def test_unknown_story(self):
+        """Test get_story returns None for unregistered stories"""
+        self.assertIsNone(get_story(999))
+
+    def test_views_module_exposes_story_data(self):
+        """Test the legacy STORY_DATA attribute still resolves"""
+        from backend import views
+
+        self.assertIs(views.STORY_DATA, get_story(0))
+
+
+class TestSnapshot(unittest.TestCase):
+    """Test cases for the precompiled startup snapshot"""
+
+    def setUp(self):
+        stories.reset_stories()
+        handle, self.path = tempfile.mkstemp(suffix='.pkl')
+        os.close(handle)
+
+    def tearDown(self):
+        stories.reset_stories()
+        os.remove(self.path)
+
+    def test_round_trip(self):
+        """Test a written snapshot reads back the same story graph"""
+        write_snapshot(self.path)
+        snapshot = read_snapshot(self.path)
+
+        scene = snapshot[0]["scenes"][1]
+        self.assertEqual(scene.background, "/static/inside_house.jpg")
+        self.assertEqual(snapshot[0]["scenes"][1].choices[0].effects,
+                         {"trust": 10, "security": 10})
+
+    def test_get_story_uses_snapshot(self):
+        """Test get_story loads from the configured snapshot"""
+        write_snapshot(self.path)
+
+        with override_settings(STORY_SNAPSHOT=self.path):
+            story = get_story(0)
+
+        self.assertEqual(len(story["scenes"]), 9)
+
+    def test_unusable_snapshot_ignored(self):
+        """Test corrupt or missing snapshots fall back to building"""
+        with open(self.path, 'wb') as fh:
+            fh.write(b'not a pickle')
+
+        self.assertIsNone(read_snapshot(self.path))
+        self.assertIsNone(read_snapshot(self.path + '.missing'))
+
+
+class TestStoryVersions(unittest.TestCase):
+    """Test cases for archived story versions"""
+
+    def setUp(self):
+        stories.reset_stories()
+        self.directory = tempfile.mkdtemp()
+        self.settings = override_settings(STORY_VERSION_DIR=self.directory,
+                                          STORY_VERSION_CACHE_SIZE=1)
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        stories.reset_stories()
+        shutil.rmtree(self.directory)
+
+    def test_dict_round_trip(self):
+        """Test a story survives story_to_dict and story_from_dict"""
+        story = compile_story(create_conditional_story())
+        story["migrations"] = {1: {2: 3}}
+
+        restored = compile_story(story_from_dict(story_to_dict(story)))
+
+        self.assertEqual(restored["migrations"], {1: {2: 3}})
+        self.assertEqual(restored["scenes"][1].choices[0].conditions, {"trust": 30})
+        self.assertEqual(restored["scenes"][3].background, "/static/low_trust.jpg")
+
+    def test_current_version_archived_on_load(self):
+        """Test loading the registry archives the current versions"""
+        get_story(0)
+
+        self.assertTrue(os.path.exists(os.path.join(self.directory, '0', '1.json')))
+
+    def test_rearchiving_same_content_is_a_no_op(self):
+        """Test archiving an unchanged version again leaves it alone"""
+        story = compile_story(create_test_story())
+        story["migrations"] = {0: {1: 2}}
+        stories.archive_story_version(5, story)
+
+        stories.archive_story_version(5, compile_story(story_from_dict(story_to_dict(story))))
+
+        self.assertEqual(stories.get_story_version(5, 1)["migrations"], {0: {1: 2}})
+
+    def test_changed_content_without_version_bump_rejected(self):
+        """Test an archived version is never replaced by different content"""
+        story = compile_story(create_test_story())
+        stories.archive_story_version(5, story)
+        changed = compile_story(create_conditional_story())
+
+        with self.assertRaises(ValueError):
+            stories.archive_story_version(5, changed)
+        self.assertEqual(set(stories.get_story_version(5, 1)["scenes"]), set(story["scenes"]))
+
+    def test_old_versions_loaded_from_archive(self):
+        """Test older versions are read back and cached LRU"""
+        for version in (1, 2):
+            story = compile_story(create_test_story())
+            story["version"] = version
+            stories.archive_story_version(5, story)
+
+        self.assertIsNone(get_story(0, 99))
+        first = stories.get_story_version(5, 1)
+        self.assertIs(stories.get_story_version(5, 1), first)
+        stories.get_story_version(5, 2)
+
+        self.assertEqual(list(stories._story_versions), [(5, 2)])
+
+
+class TestMigrateState(unittest.TestCase):
+    """Test cases for migrate_state"""
+
+    def setUp(self):
+        self.story = compile_story(create_test_story())
+        self.story["version"] = 2
+        self.story["attributes"] = ["trust"]
+
+    def test_mapped_scene(self):
+        """Test the author's mapping moves the player and drops unknown variables"""
+        self.story["migrations"] = {1: {7: 2}}
+        state = StoryState(0, 7, variables={"trust": 5, "courage": 3}, story_version=1)
+
+        self.assertTrue(migrate_state(state, self.story))
+        self.assertEqual((state.current_scene_id, state.story_version), (2, 2))
+        self.assertEqual(state.variables, {"trust": 5})
+
+    def test_unmapped_scene_keeps_id(self):
+        """Test scenes left out of the mapping keep their id if it still exists"""
+        self.story["migrations"] = {1: {}}
+        state = StoryState(0, 1, story_version=1)
+
+        self.assertTrue(migrate_state(state, self.story))
+        self.assertEqual(state.current_scene_id, 1)
+
+    def test_stays_pinned(self):
+        """Test players stay on their version without a usable mapping"""
+        self.story["migrations"] = {1: {1: None}}
+
+        self.assertFalse(migrate_state(StoryState(0, 1, story_version=1), self.story))
+        self.assertFalse(migrate_state(StoryState(0, 1, story_version=0), self.story))
+        self.assertFalse(migrate_state(StoryState(0, 9, story_version=1),
+                                       dict(self.story, migrations={1: {}})))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -16,6 +16,7 @@ class TestStoryState(unittest.TestCase):
         self.assertEqual(state.current_scene_id, 0)
         self.assertEqual(state.variables, {})
         self.assertEqual(state.visited_scenes, [])
+        self.assertEqual(state.step, 0)
     
     def test_initialization_with_custom_values(self):
         """Test StoryState initializes with custom values"""
@@ -146,5 +147,49 @@ class TestChoice(unittest.TestCase):
         self.assertEqual(choice.effects, {})
 
 
+class TestCompactRepresentation(unittest.TestCase):
+    """Test cases for slots, shared maps and interned strings"""
+
+    def test_identical_maps_shared(self):
+        """Test equal conditions and effects share one dict"""
+        first = Choice(1, "Go", 2, conditions={"trust": 10}, effects={"trust": 5})
+        second = Choice(2, "Go", 3, conditions={"trust": 10}, effects={"trust": 5})
+
+        self.assertIs(first.conditions, second.conditions)
+        self.assertIs(first.effects, second.effects)
+        self.assertIs(Choice(3, "Go", 4).effects, Choice(4, "Go", 5).conditions)
+
+    def test_shared_map_copies_input(self):
+        """Test later changes to the caller's dict don't leak into the story"""
+        effects = {"courage": 1}
+        choice = Choice(1, "Go", 2, effects=effects)
+        effects["courage"] = 99
+
+        self.assertEqual(choice.effects, {"courage": 1})
+
+    def test_strings_interned(self):
+        """Test texts and backgrounds built at runtime are interned"""
+        text = "".join(["Continue", "..."])
+        background = "".join(["/static/", "barn.jpg"])
+
+        self.assertIs(Choice(1, text, 2).text, Choice(2, "Continue...", 3).text)
+        self.assertIs(Scene(1, background, []).background,
+                      Scene(2, "/static/barn.jpg", []).background)
+
+    def test_no_instance_dict(self):
+        """Test instances use slots instead of a __dict__"""
+        for obj in (StoryState(1, 0), Scene(1, "/static/bg.jpg", []), Choice(1, "Go", 2)):
+            self.assertFalse(hasattr(obj, '__dict__'))
+
+    def test_state_to_dict_round_trip(self):
+        """Test StoryState survives to_dict for session storage"""
+        state = StoryState(1, 3, variables={"trust": 5}, visited_scenes=[0, 2], step=2,
+                           story_version=4)
+
+        restored = StoryState(**state.to_dict())
+
+        self.assertEqual(restored.to_dict(), state.to_dict())
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -2,7 +2,8 @@
 Integration tests for Django views (start_story, process_choice)
 """
 import json
-from django.test import TestCase, Client
+from unittest import mock
+from django.test import TestCase, Client, override_settings
 from django.urls import reverse
 
 
@@ -54,6 +55,7 @@ class TestStartStoryView(TestCase):
         self.assertEqual(game_state['current_scene_id'], 0)
         self.assertEqual(game_state['variables'], {})
         self.assertEqual(game_state['visited_scenes'], [])
+        self.assertIsInstance(game_state['seed'], int)
     
     def test_start_story_returns_choices(self):
         """Test that start_story returns available choices"""
@@ -291,6 +293,192 @@ class TestProcessChoiceView(TestCase):
         self.assertEqual(variables.get('security', 0), -10)
 
 
+class TestChoiceSteps(TestCase):
+    """Test cases for step numbers and duplicate submissions"""
+
+    def setUp(self):
+        """Set up test client and start a story"""
+        self.client = Client()
+        self.choice_url = reverse('process_choice')
+        self.client.get(reverse('start_story'))
+
+    def post_choice(self, choice_id, scene_id, step):
+        return self.client.post(
+            self.choice_url,
+            data=json.dumps({'choice_id': choice_id, 'current_scene_id': scene_id, 'step': step}),
+            content_type='application/json'
+        )
+
+    def test_step_advances(self):
+        """Test each accepted choice increments the step"""
+        self.assertEqual(self.post_choice(1, 0, 0).json()['step'], 1)
+        self.assertEqual(self.post_choice(3, 1, 1).json()['step'], 2)
+        self.assertEqual(self.client.session['game_state']['step'], 2)
+
+    def test_duplicate_submit_replays_response(self):
+        """Test a double submit replays instead of applying effects twice"""
+        self.post_choice(1, 0, 0)
+        first = self.post_choice(3, 1, 1)
+        second = self.post_choice(3, 1, 1)
+
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second['X-Story-Replay'], '1')
+        self.assertEqual(second.json(), first.json())
+        game_state = self.client.session['game_state']
+        self.assertEqual(game_state['variables'], {'trust': 10, 'security': 10})
+        self.assertEqual(game_state['visited_scenes'], [0, 1])
+
+    def test_stale_submit_replays_latest_response(self):
+        """Test a submit for an older step replays the latest response"""
+        self.post_choice(1, 0, 0)
+        latest = self.post_choice(4, 1, 1)
+
+        response = self.post_choice(2, 0, 0)
+
+        self.assertEqual(response.json(), latest.json())
+        self.assertEqual(self.client.session['game_state']['current_scene_id'], 3)
+
+    def test_concurrent_submit_replays_first_save(self):
+        """Test of two submits racing for one step, the second to save replays the first"""
+        from backend.views import apply_choice
+        racing = []
+
+        def apply_after_race(*args):
+            # The other submit finishes while this one is mid-turn
+            if not racing:
+                racing.append(None)
+                racing[0] = self.post_choice(2, 0, 0)
+            return apply_choice(*args)
+
+        with mock.patch('backend.views.apply_choice', side_effect=apply_after_race):
+            response = self.post_choice(1, 0, 0)
+
+        self.assertEqual(racing[0].status_code, 200)
+        self.assertEqual(response['X-Story-Replay'], '1')
+        self.assertEqual(response.json(), racing[0].json())
+        game_state = self.client.session['game_state']
+        self.assertEqual(game_state['current_scene_id'], 3)
+        self.assertEqual(game_state['step'], 1)
+
+    def test_future_step_rejected(self):
+        """Test a step the server has not reached yet is a conflict"""
+        response = self.post_choice(1, 0, 5)
+
+        self.assertEqual(response.status_code, 409)
+        self.assertIn('error', response.json())
+
+
+
+class TestSessionEngines(TestCase):
+    """Test cases for playing on session engines other than the default"""
+
+    def play(self):
+        client = Client()
+        client.get(reverse('start_story'))
+        responses = [
+            client.post(
+                reverse('process_choice'),
+                data=json.dumps({'choice_id': choice_id, 'current_scene_id': scene_id,
+                                 'step': step}),
+                content_type='application/json'
+            )
+            for choice_id, scene_id, step in ((1, 0, 0), (3, 1, 1))
+        ]
+        return client, responses
+
+    def test_choices_on_every_engine(self):
+        """Test a game can be played on the cached_db, signed_cookies and cache engines"""
+        for engine in ('cached_db', 'signed_cookies', 'cache'):
+            with self.subTest(engine=engine), override_settings(
+                    SESSION_ENGINE=f'django.contrib.sessions.backends.{engine}'):
+                client, responses = self.play()
+
+                self.assertEqual([response.status_code for response in responses], [200, 200])
+                self.assertEqual(responses[-1].json()['step'], 2)
+                self.assertEqual(client.session['game_state']['step'], 2)
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cached_db')
+    def test_cached_db_race_replays_first_save(self):
+        """Test the compare-and-set on cached_db also keeps its cache current"""
+        from backend.views import apply_choice
+        client = Client()
+        client.get(reverse('start_story'))
+        racing = []
+
+        def post(choice_id):
+            return client.post(
+                reverse('process_choice'),
+                data=json.dumps({'choice_id': choice_id, 'current_scene_id': 0, 'step': 0}),
+                content_type='application/json'
+            )
+
+        def apply_after_race(*args):
+            if not racing:
+                racing.append(None)
+                racing[0] = post(2)
+            return apply_choice(*args)
+
+        with mock.patch('backend.views.apply_choice', side_effect=apply_after_race):
+            response = post(1)
+
+        self.assertEqual(response['X-Story-Replay'], '1')
+        self.assertEqual(response.json(), racing[0].json())
+        self.assertEqual(client.session['game_state']['current_scene_id'], 3)
+
+class TestResponseShaping(TestCase):
+    """Test cases for delta responses and field projection"""
+
+    def setUp(self):
+        """Set up test client and start a story"""
+        self.client = Client()
+        self.choice_url = reverse('process_choice')
+        self.client.get(reverse('start_story'))
+
+    def post_choice(self, **data):
+        return self.client.post(self.choice_url, data=json.dumps(data),
+                                content_type='application/json')
+
+    def test_delta_sends_only_changed_variables(self):
+        """Test delta mode diffs variables against the echoed step"""
+        self.post_choice(choice_id=1, current_scene_id=0, step=0)
+        self.post_choice(choice_id=3, current_scene_id=1, step=1)
+
+        data = self.post_choice(choice_id=5, current_scene_id=2, step=2, mode='delta').json()
+
+        self.assertNotIn('variables', data)
+        self.assertEqual(data['variables_changed'], {'trust': 30})
+        self.assertEqual(data['step'], 3)
+
+    def test_delta_omits_unrotated_csrf_token(self):
+        """Test delta mode leaves out a CSRF token the client already has"""
+        data = self.post_choice(choice_id=1, current_scene_id=0, step=0, mode='delta').json()
+
+        self.assertNotIn('csrf_token', data)
+        self.assertEqual(data['scene']['id'], 1)
+
+    def test_delta_without_step_sends_full_variables(self):
+        """Test delta mode falls back to full variables without a known step"""
+        data = self.post_choice(choice_id=1, current_scene_id=0, mode='delta').json()
+
+        self.assertEqual(data['variables'], {})
+        self.assertNotIn('variables_changed', data)
+
+    def test_field_projection(self):
+        """Test only requested fields are returned"""
+        data = self.post_choice(choice_id=1, current_scene_id=0,
+                                fields=['scene.id', 'scene.background']).json()
+
+        self.assertEqual(set(data), {'scene', 'step'})
+        self.assertEqual(data['scene'], {'id': 1, 'background': '/static/inside_house.jpg'})
+
+    def test_field_projection_on_start(self):
+        """Test start_story honours fields from the query string"""
+        data = self.client.get(reverse('start_story'), {'fields': 'variables,scene'}).json()
+
+        self.assertEqual(set(data), {'scene', 'variables', 'step'})
+        self.assertIn('choices', data['scene'])
+
+
 class TestConditionalChoices(TestCase):
     """Test cases for conditional choice filtering"""
     
@@ -459,3 +647,146 @@ class TestHelperFunctions(TestCase):
         self.assertEqual(len(result), 2)
         self.assertTrue(result[0]['available'])
         self.assertFalse(result[1]['available'])
+
+
+class TestStoryGraphViews(TestCase):
+    """Test cases for the editor's story graph endpoints"""
+
+    def test_scenes_paginated_by_cursor(self):
+        """Test walking every page visits each scene once"""
+        url = reverse('story_scenes', args=[0])
+        seen, cursor = [], None
+        while True:
+            params = {'limit': 4} if cursor is None else {'limit': 4, 'cursor': cursor}
+            data = self.client.get(url, params).json()
+            seen.extend(scene['id'] for scene in data['scenes'])
+            cursor = data['next_cursor']
+            if cursor is None:
+                break
+
+        self.assertEqual(seen, list(range(9)))
+
+    def test_scenes_include_choice_details(self):
+        """Test scenes carry targets, conditions and effects"""
+        data = self.client.get(reverse('story_scenes', args=[0]), {'limit': 2, 'cursor': 0}).json()
+
+        choice = data['scenes'][0]['choices'][0]
+        self.assertEqual(data['scenes'][0]['id'], 1)
+        self.assertEqual(choice['target_scene_id'], 2)
+        self.assertEqual(choice['effects'], {'trust': 10, 'security': 10})
+
+    def test_unknown_story(self):
+        """Test unknown stories return 404"""
+        response = self.client.get(reverse('story_scenes', args=[99]))
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_graph_stream(self):
+        """Test the NDJSON stream has a header line and one line per scene"""
+        response = self.client.get(reverse('story_graph_stream', args=[0]))
+
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(json.loads(lines[0])['scene_count'], 9)
+        self.assertEqual([json.loads(line)['id'] for line in lines[1:]], list(range(9)))
+
+    def test_viewport(self):
+        """Test the viewport returns scenes within K hops in either direction"""
+        data = self.client.get(reverse('story_viewport', args=[0]), {'scene': 2, 'hops': 1}).json()
+
+        distances = {scene['id']: scene['distance'] for scene in data['scenes']}
+        self.assertEqual(distances, {2: 0, 5: 1, 1: 1})
+        self.assertFalse(data['truncated'])
+
+    def test_viewport_truncation(self):
+        """Test truncated is only set when scenes were left out"""
+        def viewport(limit):
+            return self.client.get(reverse('story_viewport', args=[0]),
+                                   {'scene': 2, 'hops': 1, 'limit': limit}).json()
+
+        exact = viewport(3)
+        cut = viewport(2)
+
+        self.assertEqual(len(exact['scenes']), 3)
+        self.assertFalse(exact['truncated'])
+        self.assertEqual(len(cut['scenes']), 2)
+        self.assertTrue(cut['truncated'])
+
+    def test_viewport_invalid_scene(self):
+        """Test the viewport rejects scenes outside the story"""
+        response = self.client.get(reverse('story_viewport', args=[0]), {'scene': 99})
+
+        self.assertEqual(response.status_code, 400)
+
+
+class TestStoryVersionPinning(TestCase):
+    """Test cases for sessions pinned to an older story version"""
+
+    def setUp(self):
+        """Start a session on version 1, then deploy version 2"""
+        import shutil
+        import tempfile
+        from unittest import mock
+        from django.test import override_settings
+        from backend import stories
+        from tests.fixtures import create_test_story
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        settings_override = override_settings(STORY_VERSION_DIR=directory)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        stories.reset_stories()
+        self.addCleanup(stories.reset_stories)
+
+        self.client.get(reverse('start_story'))
+
+        def build_version_2():
+            story = create_test_story()
+            story["version"] = 2
+            story["migrations"] = self.migrations
+            return story
+
+        builders = mock.patch.dict(stories.STORY_BUILDERS, {0: build_version_2})
+        builders.start()
+        self.addCleanup(builders.stop)
+        stories.reset_stories()
+
+    def choose(self):
+        return self.client.post(
+            reverse('process_choice'),
+            data=json.dumps({'choice_id': 1, 'current_scene_id': 0}),
+            content_type='application/json'
+        ).json()
+
+    def test_session_stays_on_started_version(self):
+        """Test a session without a migration keeps playing version 1"""
+        self.migrations = {}
+
+        data = self.choose()
+
+        self.assertEqual(data['scene']['background'], '/static/inside_house.jpg')
+        self.assertEqual(self.client.session['game_state']['story_version'], 1)
+
+    def test_session_migrated_lazily(self):
+        """Test the next request moves the player through the author's mapping"""
+        self.migrations = {1: {1: 2}}
+
+        data = self.choose()
+
+        self.assertEqual(data['scene']['background'], '/static/right.jpg')
+        game_state = self.client.session['game_state']
+        self.assertEqual((game_state['story_version'], game_state['current_scene_id']), (2, 2))
+
+
+class TestReadinessView(TestCase):
+    """Test cases for the readiness check"""
+
+    def test_ready(self):
+        """Test readiness reports loaded stories"""
+        response = self.client.get(reverse('readiness'))
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertTrue(data['ready'])
+        self.assertEqual(data['stories'], 1)